@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""
+=============================
+Single-flight async LRU cache
+=============================
+
+When many coroutines miss the same key at once, each of them would run the
+expensive loader (a `most_similar` query, a metro route search, ...) and
+all but one of the results are thrown away. A single-flight cache runs one
+loader per missing key, the later callers wait for the future of the
+loader already in flight:
+
+    caller 1 --- miss ---> start loader ----------+--> value
+    caller 2 --- miss ---> in flight, wait ---+   |
+    caller 3 --- miss ---> in flight, wait ---+---+--> same value
+    caller 4 --- hit ----> value from the LRU
+
+The loader runs in a task of its own and the callers await it through
+`asyncio.shield`, so a cancelled caller does not cancel the load for the
+others. An exception raised by the loader is raised to every waiter, and
+with `negative_ttl` it is also cached for that long, so a failing key is
+not hammered by every request.
+
+Values live in a `WeightedHashLinkedList` of `lru.py`, so they can expire
+after `ttl` seconds as well.
+
+Usage example
+================
+
+```
+cache = AsyncLoadingCache(10000, ttl=600)
+
+async def route(key):
+    start, end = key
+    return await search_route(start, end)
+
+path = await cache.get_or_load(('西单', '国贸'), route)
+```
+"""
+
+import sys
+import copy
+import time
+import asyncio
+
+from lru import WeightedHashLinkedList, CacheStats
+
+
+_MISSING = object()
+
+
+class _Failure(object):
+    """
+    An exception cached by the negative cache
+    """
+    def __init__(self, exc):
+        # A copy without the traceback, which would keep the frames of the
+        # load alive
+        self.exc = copy.copy(exc).with_traceback(None)
+
+    def error(self):
+        """
+        A fresh copy to raise, raising the cached exception again and again
+        would grow its traceback with the frames of every caller
+        """
+        return copy.copy(self.exc)
+
+
+class AsyncLoadingCache(object):
+    """
+    Async LRU cache running a single loader per missing key
+
+    :param int size: Capacity of the cache
+    :param float ttl: Seconds a loaded value stays valid, None never expires
+    :param float negative_ttl: Seconds a loader exception is cached, None
+                               does not cache exceptions
+    :param clock: Function returning the current time in seconds
+    """
+    def __init__(self, size, ttl=None, negative_ttl=None, clock=time.monotonic):
+        self.cache = WeightedHashLinkedList(
+            size, weigher=lambda key, value: 1, ttl=ttl, clock=clock)
+        self.negative_ttl = negative_ttl
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_load(self, key, coro_fn):
+        """
+        Get the value of `key`, loading it with `await coro_fn(key)` if it
+        is missing
+
+        :param key: The key
+        :param coro_fn: Coroutine function loading the value of a key
+        :returns: The cached or loaded value
+        :raises: Whatever the loader raised, for every waiting caller
+        """
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            if isinstance(value, _Failure):
+                raise value.error()
+            return value
+
+        task = self.inflight.get(key, None)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, coro_fn))
+            task.add_done_callback(_consume_exception)
+            self.inflight[key] = task
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    async def _load(self, key, coro_fn):
+        try:
+            value = await coro_fn(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            if self.negative_ttl is not None:
+                self.cache.set(key, _Failure(exc), ttl=self.negative_ttl)
+            raise
+        else:
+            self.cache[key] = value
+            return value
+        finally:
+            del self.inflight[key]
+
+    def invalidate(self, key):
+        """
+        Drop the cached value or failure of `key`, a load in flight still
+        completes and stores its result
+        """
+        self.cache.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def stats(self):
+        return CacheStats(
+            self.hits, self.misses, self.cache.evictions, len(self.cache), self.cache.size)
+
+
+def _consume_exception(task):
+    # Mark the exception as retrieved when every waiter was cancelled
+    if not task.cancelled():
+        task.exception()
+
+
+if __name__ == '__main__':
+    import unittest
+    import traceback
+
+    class Test(unittest.IsolatedAsyncioTestCase):
+        def setUp(self):
+            self.calls = []
+
+        async def slow_square(self, key):
+            self.calls.append(key)
+            await asyncio.sleep(0.01)
+            return key * key
+
+        async def test_coalesce(self):
+            cache = AsyncLoadingCache(10)
+            results = await asyncio.gather(*[cache.get_or_load(3, self.slow_square) for _ in range(100)])
+            self.assertEqual(results, [9] * 100)
+            self.assertEqual(self.calls, [3])
+            self.assertEqual(cache.coalesced, 99)
+
+            self.assertEqual(await cache.get_or_load(3, self.slow_square), 9)
+            self.assertEqual(cache.stats(), CacheStats(1, 1, 0, 1, 10))
+
+        async def test_failure(self):
+            cache = AsyncLoadingCache(10)
+
+            async def broken(key):
+                self.calls.append(key)
+                await asyncio.sleep(0.01)
+                raise ValueError(key)
+
+            results = await asyncio.gather(
+                *[cache.get_or_load('aa', broken) for _ in range(3)], return_exceptions=True)
+            self.assertTrue(all(isinstance(r, ValueError) for r in results))
+            self.assertEqual(self.calls, ['aa'])
+
+            # Not cached, the next call loads again
+            with self.assertRaises(ValueError):
+                await cache.get_or_load('aa', broken)
+            self.assertEqual(len(self.calls), 2)
+
+        async def test_negative_cache(self):
+            now = [0]
+            cache = AsyncLoadingCache(10, negative_ttl=5, clock=lambda: now[0])
+
+            async def broken(key):
+                self.calls.append(key)
+                raise KeyError(key)
+
+            raised = []
+            for _ in range(3):
+                with self.assertRaises(KeyError) as context:
+                    await cache.get_or_load('aa', broken)
+                raised.append(context.exception)
+            self.assertEqual(self.calls, ['aa'])
+            # Fresh copies, the traceback does not pile up
+            self.assertEqual(raised[1].args, ('aa',))
+            self.assertIsNot(raised[1], raised[2])
+            self.assertEqual(len(traceback.extract_tb(raised[1].__traceback__)),
+                             len(traceback.extract_tb(raised[2].__traceback__)))
+
+            now[0] = 5
+            with self.assertRaises(KeyError):
+                await cache.get_or_load('aa', broken)
+            self.assertEqual(self.calls, ['aa', 'aa'])
+
+        async def test_cancelled_caller(self):
+            cache = AsyncLoadingCache(10)
+            first = asyncio.ensure_future(cache.get_or_load(4, self.slow_square))
+            second = asyncio.ensure_future(cache.get_or_load(4, self.slow_square))
+            await asyncio.sleep(0)
+            first.cancel()
+            self.assertEqual(await second, 16)
+            self.assertIn(4, cache)
+
+    unittest.main(argv=sys.argv[:1])
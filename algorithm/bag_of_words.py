@@ -31,55 +31,404 @@ eg.,
 
 (1) [1, 2, 1, 1, 2, 1, 1, 0, 0, 0]
 (2) [1, 1, 1, 1, 0, 0, 0, 1, 1, 1]
+
+Sparse vectors
+================
+
+A sentence only has a few of the terms of the vocabulary, its dense vector
+is mostly zeros. `BagOfWords` freezes the term -> column index once, then
+transforms a batch of documents into one `scipy.sparse` CSR matrix in a
+single pass over their tokens, the work is the length of the documents,
+not the size of the vocabulary:
+
+    index:  {前: 0, 天: 1, 晚: 2, 上: 3, ...}
+
+    前天晚上    indptr  [0,          4, ...]
+                indices [0, 1, 2, 3, ...]
+                data    [1, 1, 1, 1, ...]
+
+Terms out of the vocabulary are dropped. The cosine similarity of two
+rows only touches their nonzero entries.
+
+Hashing trick
+================
+
+Ref: Weinberger et al., Feature Hashing for Large Scale Multitask
+Learning, 2009
+
+Building the vocabulary is one more pass over the corpus, and its index
+grows with it. `HashingVectorizer` has no vocabulary: the column of a term
+is a hash of it into 2^k columns, and another bit of the hash gives the
+sign it is counted with, so the collisions cancel out on average instead
+of adding up:
+
+    term --> splitmix64(key ^ seed) --> low k bits: column
+                                        top bit:    sign +1 / -1
+
+The key of a character is its code point, the one of a token its crc32,
+both the same in every process, unlike the salted `hash()` of python. The
+vectorizer is stateless, `iter_blocks` reads the corpus chunk by chunk and
+yields one CSR block per chunk, one row per `\\w+` run, and the blocks of
+shards vectorized in other processes are simply stacked.
+
+Usage example
+================
+
+```
+# Run the unit tests
+$ python algorithm/bag_of_words.py
+
+# The vocabulary of the novels, and the cosine similarities of the pairs
+$ python algorithm/bag_of_words.py ./data/chinese-novels
+
+# Hash the runs of the novels into 2^18 columns, no vocabulary
+$ python algorithm/bag_of_words.py ./data/chinese-novels --hashing --bits 18
+```
 """
 
-import re
+import os
 import sys
-import gzip
+import time
+import zlib
 import argparse
-from collections import Counter
+from collections import Counter, deque
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import sparse
+
+from corpus import CHUNK_SIZE, iter_text, iter_chunks, iter_runs, corpus_files
+from ngram_count import encode
+
+
+def bag_of_words(corpus, tokenizer=None):
+    """
+    Count the words of `corpus`, one string or an iterable of text pieces
+
+    :param tokenizer: Callable splitting a text into its terms, the
+                      characters by default
+    """
+    if isinstance(corpus, str):
+        corpus = [corpus]
+
+    bow = Counter()
+    for text in corpus:
+        bow.update(tokenizer(text) if tokenizer else text)
+    return bow
+
+
+def cosine_similarity(a, b):
+    """
+    Cosine similarities of the rows of two sparse matrices of one shape,
+    row i of a with row i of b, 0 for an empty row
+
+    :return: float64 array
+    """
+    a = sparse.csr_matrix(a, dtype=np.float64)
+    b = sparse.csr_matrix(b, dtype=np.float64)
+    dots = np.asarray(a.multiply(b).sum(axis=1)).ravel()
+    norms = np.sqrt(np.asarray(a.multiply(a).sum(axis=1)).ravel() * np.asarray(b.multiply(b).sum(axis=1)).ravel())
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+
+class BagOfWords(object):
+    """
+    Bag of words vectorizer over a frozen vocabulary
+
+    :param vocab: The terms, column j counts the term vocab[j]
+    :param tokenizer: Callable splitting a text into its terms, the
+                      characters by default
+    """
+    def __init__(self, vocab, tokenizer=None):
+        self.vocab = list(vocab)
+        self.index = {term: j for j, term in enumerate(self.vocab)}
+        self.tokenizer = tokenizer
+
+    @classmethod
+    def fit(cls, corpus, tokenizer=None, min_count=1):
+        """
+        The vocabulary of `corpus`, the most common terms first
+
+        :param int min_count: Drop the terms seen less often
+        """
+        bow = bag_of_words(corpus, tokenizer)
+        return cls([term for term, count in bow.most_common() if count >= min_count], tokenizer)
 
+    def __len__(self):
+        return len(self.vocab)
 
-def trim(x):
-    return ''.join(re.findall(r'\w+', x.replace('\\n', '')))
+    def transform(self, docs):
+        """
+        Count the terms of every document
 
+        :param docs: Iterable of texts
+        :return: CSR matrix of int32 counts, one row per document
+        """
+        index = self.index
+        indices = []
+        indptr = [0]
+        for doc in docs:
+            terms = self.tokenizer(doc) if self.tokenizer else doc
+            indices.extend(j for j in map(index.get, terms) if j is not None)
+            indptr.append(len(indices))
 
-def load_corpus(path):
-    fopen = open
-    if re.search(r'\S(.tar.gz)$', path):
-        fopen = gzip.open
+        indices = np.array(indices, dtype=np.int32)
+        data = np.ones(len(indices), dtype=np.int32)
+        matrix = sparse.csr_matrix((data, indices, np.array(indptr, dtype=np.int64)),
+                                   shape=(len(indptr) - 1, len(self.vocab)))
+        matrix.sum_duplicates()
+        return matrix
 
-    with fopen(path, 'r') as f:
-        raw = ''.join(re.findall(r'\w+', f.read().decode('utf-8').replace('\\n', '')))
-        return raw
+    def similarity(self, pairs):
+        """
+        Cosine similarities of the bags of words of sentence pairs
 
+        :param pairs: Iterable of (sentence, sentence)
+        :return: float64 array, one per pair
+        """
+        pairs = list(pairs)
+        return cosine_similarity(self.transform(a for a, _ in pairs), self.transform(b for _, b in pairs))
 
-def bag_of_words(corpus):
-    return Counter(corpus)
+
+def splitmix64(keys):
+    """
+    The splitmix64 finalizer of an uint64 array, every bit of the key
+    mixed into every bit of the hash
+    """
+    z = keys + np.uint64(0x9e3779b97f4a7c15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return z ^ (z >> np.uint64(31))
+
+
+class HashingVectorizer(object):
+    """
+    Signed feature hashing of the terms into 2^bits columns
+
+    :param int bits: log2 of the number of columns
+    :param tokenizer: Callable splitting a text into its terms, the
+                      characters by default
+    :param int seed: Seed of the hash, vectorizers of the same seed agree
+    """
+    def __init__(self, bits=20, tokenizer=None, seed=0):
+        if not 0 < bits <= 31:
+            raise ValueError('bits must be in 1..31, not {}'.format(bits))
+        self.bits = bits
+        self.tokenizer = tokenizer
+        self.seed = seed
+
+    @property
+    def n_features(self):
+        return 1 << self.bits
+
+    def keys(self, docs):
+        """
+        uint64 keys of the terms of the documents, and the row offsets
+        """
+        if self.tokenizer is None:
+            keys = encode(''.join(docs)).astype(np.uint64)
+            lengths = [len(doc) for doc in docs]
+        else:
+            keys = []
+            lengths = []
+            for doc in docs:
+                terms = list(self.tokenizer(doc))
+                keys.extend(zlib.crc32(term.encode('utf-8')) for term in terms)
+                lengths.append(len(terms))
+            keys = np.array(keys, dtype=np.uint64)
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        return keys, indptr
+
+    def transform(self, docs):
+        """
+        Signed counts of the hashed terms of every document
+
+        :param docs: Sequence of texts
+        :return: CSR matrix of int32, one row per document
+        """
+        docs = list(docs)
+        keys, indptr = self.keys(docs)
+        hashes = splitmix64(keys ^ np.uint64(self.seed))
+        indices = (hashes & np.uint64(self.n_features - 1)).astype(np.int32)
+        data = np.where(hashes >> np.uint64(63), -1, 1).astype(np.int32)
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(docs), self.n_features))
+        # Collisions of opposite signs in a row may cancel
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+        return matrix
+
+    def similarity(self, pairs):
+        """
+        Cosine similarities of the hashed sentence pairs, see `BagOfWords`
+        """
+        pairs = list(pairs)
+        return cosine_similarity(self.transform(a for a, _ in pairs), self.transform(b for _, b in pairs))
+
+    def iter_blocks(self, path, chunk_size=CHUNK_SIZE):
+        """
+        One CSR block per chunk of the corpus, one row per `\\w+` run
+        """
+        for runs in iter_corpus_runs(path, chunk_size):
+            yield self.transform(runs)
+
+    def transform_corpus(self, path, processes=None, chunk_size=CHUNK_SIZE):
+        """
+        The rows of all the runs of the corpus, the chunks vectorized in a
+        pool of processes
+
+        :param int processes: Size of the pool, all the cores when None, 1
+                              vectorizes in this process
+        """
+        if processes == 1:
+            blocks = list(self.iter_blocks(path, chunk_size))
+        else:
+            processes = processes or os.cpu_count()
+            blocks = []
+            with Pool(processes) as pool:
+                # Bounded, so only a few chunks of the stream are in memory
+                pending = deque()
+                limit = 2 * processes
+                for runs in iter_corpus_runs(path, chunk_size):
+                    pending.append(pool.apply_async(self.transform, (runs,)))
+                    if len(pending) >= limit:
+                        blocks.append(pending.popleft().get())
+                while pending:
+                    blocks.append(pending.popleft().get())
+
+        if not blocks:
+            return sparse.csr_matrix((0, self.n_features), dtype=np.int32)
+        return sparse.vstack(blocks, format='csr')
+
+
+def iter_corpus_runs(path, chunk_size=CHUNK_SIZE):
+    """
+    The lists of `\\w+` runs of the corpus, one per chunk
+    """
+    for name in corpus_files(path):
+        yield from iter_runs(iter_chunks(name, chunk_size))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('corpus', type=str, help='Corpus file path')
+    parser.add_argument('corpus', type=str, nargs='?', help='Corpus file path, run the unit tests when missing')
+    parser.add_argument('--hashing', action='store_true', help='Hash the runs of the corpus instead, no vocabulary')
+    parser.add_argument('--bits', type=int, default=20, help='log2 of the number of hashed columns')
+    parser.add_argument('--processes', type=int, default=None, help='Processes hashing the corpus, all cores by default')
     args = parser.parse_args(sys.argv[1:])
 
-    corpus = load_corpus(args.corpus)
-    bow = Counter(corpus)
-
-    pair1 = ('前天晚上吃晚饭的时候', '前天晚上吃早饭的时候')
-    pair2 = ('正是一个好看的小猫', '真是一个好看的小猫')
-    pair3 = ('我无言以对，简直', '我简直无言以对')
-
-    pair10_bow = Counter(pair1[0])
-    pair11_bow = Counter(pair1[1])
-    pair20_bow = Counter(pair1[0])
-    pair21_bow = Counter(pair1[1])
-    pair30_bow = Counter(pair1[0])
-    pair31_bow = Counter(pair1[1])
-
-    vec10 = [pair10_bow[k] if k in pair10_bow else 0 for k in bow]
-    vec11 = [pair11_bow[k] if k in pair11_bow else 0 for k in bow]
-    vec20 = [pair20_bow[k] if k in pair20_bow else 0 for k in bow]
-    vec21 = [pair21_bow[k] if k in pair21_bow else 0 for k in bow]
-    vec30 = [pair30_bow[k] if k in pair30_bow else 0 for k in bow]
-    vec31 = [pair31_bow[k] if k in pair31_bow else 0 for k in bow]
+    pairs = [
+        ('前天晚上吃晚饭的时候', '前天晚上吃早饭的时候'),
+        ('正是一个好看的小猫', '真是一个好看的小猫'),
+        ('我无言以对，简直', '我简直无言以对'),
+    ]
+
+    if args.corpus and args.hashing:
+        start = time.time()
+        vectorizer = HashingVectorizer(args.bits)
+        matrix = vectorizer.transform_corpus(args.corpus, args.processes)
+        print('{} runs x {} columns, {} nonzeros in {:.1f}s'.format(
+            matrix.shape[0], matrix.shape[1], matrix.nnz, time.time() - start))
+    elif args.corpus:
+        vectorizer = BagOfWords.fit(iter_text(args.corpus))
+        print('{} terms'.format(len(vectorizer)))
+
+    if args.corpus:
+        for (a, b), similarity in zip(pairs, vectorizer.similarity(pairs)):
+            print('{} / {} cosine similarity: {:.4f}'.format(a, b, similarity))
+        sys.exit(0)
+
+    import tempfile
+    import unittest
+
+    def dense_vector(sentence, bow):
+        counts = Counter(sentence)
+        return [counts[k] for k in bow]
+
+    class Test(unittest.TestCase):
+        def setUp(self):
+            self.bow = BagOfWords.fit([a + b for a, b in pairs])
+
+        def test_fit(self):
+            bow = BagOfWords.fit(['abcab', 'bx'], min_count=2)
+            self.assertEqual(bow.vocab, ['b', 'a'])
+            self.assertEqual(bow.index, {'b': 0, 'a': 1})
+            self.assertEqual(bag_of_words('a b', tokenizer=str.split), Counter({'a': 1, 'b': 1}))
+
+        def test_transform(self):
+            bow = self.bow
+            sentences = [s for pair in pairs for s in pair] + ['', '小猫小猫x']
+            matrix = bow.transform(sentences)
+            self.assertEqual(matrix.shape, (len(sentences), len(bow)))
+            self.assertTrue(matrix.has_canonical_format)
+            for row, sentence in zip(matrix.toarray().tolist(), sentences):
+                self.assertEqual(row, dense_vector(sentence, bow.vocab))
+
+        def test_similarity(self):
+            similarities = self.bow.similarity(pairs)
+            for (a, b), similarity in zip(pairs, similarities):
+                u = np.array(dense_vector(a, self.bow.vocab), dtype=float)
+                v = np.array(dense_vector(b, self.bow.vocab), dtype=float)
+                self.assertAlmostEqual(similarity, u.dot(v) / np.linalg.norm(u) / np.linalg.norm(v))
+            self.assertLess(similarities[2], 1.0)
+            # Same bag of characters, in another order
+            self.assertAlmostEqual(self.bow.similarity([('无言以对', '以对无言')])[0], 1.0)
+            self.assertEqual(self.bow.similarity([('', '小猫'), ('x', 'y')]).tolist(), [0.0, 0.0])
+
+        def test_tokenizer(self):
+            bow = BagOfWords.fit(['john likes movies', 'john likes football'], tokenizer=str.split)
+            matrix = bow.transform(['likes likes movies games'])
+            self.assertEqual(matrix[0, bow.index['likes']], 2)
+            self.assertEqual(matrix.sum(), 3)
+
+        def test_hashing(self):
+            vectorizer = HashingVectorizer(bits=4)
+            docs = [s for pair in pairs for s in pair] + ['']
+            matrix = vectorizer.transform(docs)
+            self.assertEqual(matrix.shape, (len(docs), 16))
+            keys = splitmix64(encode('林').astype(np.uint64))[0]
+            column, sign = int(keys & np.uint64(15)), -1 if keys >> np.uint64(63) else 1
+            self.assertEqual(vectorizer.transform(['林林'])[0, column], 2 * sign)
+            # The signed counts of a row add up to those of its characters
+            for row, doc in zip(matrix.toarray(), docs):
+                expected = np.zeros(16, dtype=np.int64)
+                for term, count in Counter(doc).items():
+                    expected += count * vectorizer.transform([term]).toarray()[0]
+                self.assertEqual(row.tolist(), expected.tolist())
+            self.assertEqual(matrix.nnz, np.count_nonzero(matrix.toarray()))
+            # Another seed, other columns
+            self.assertNotEqual((HashingVectorizer(4, seed=1).transform(docs) != matrix).nnz, 0)
+            self.assertAlmostEqual(HashingVectorizer().similarity([('无言以对', '以对无言')])[0], 1.0)
+            with self.assertRaises(ValueError):
+                HashingVectorizer(bits=40)
+
+        def test_hashing_tokenizer(self):
+            vectorizer = HashingVectorizer(bits=10, tokenizer=str.split)
+            matrix = vectorizer.transform(['john likes movies', 'movies john likes', 'football'])
+            self.assertEqual((matrix[0] != matrix[1]).nnz, 0)
+            self.assertEqual(abs(matrix[0]).sum(), 3)
+            # Tokenizers returning iterators, as BagOfWords takes them
+            lazy = HashingVectorizer(bits=10, tokenizer=lambda doc: iter(doc.split()))
+            self.assertEqual((lazy.transform(['john likes movies']) != matrix[0]).nnz, 0)
+            bow = BagOfWords.fit(['john likes movies'], tokenizer=lambda doc: iter(doc.split()))
+            self.assertEqual(bow.transform(['movies john']).sum(), 2)
+
+        def test_hashing_corpus(self):
+            text = '前天晚上，吃晚饭的时候。正是一个好看的小猫！我简直无言以对\n' * 50
+            vectorizer = HashingVectorizer(bits=12)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                for name in ('a.txt', 'b.txt'):
+                    with open(os.path.join(tmpdir, name), 'w', encoding='utf-8') as f:
+                        f.write(text)
+                blocks = list(vectorizer.iter_blocks(tmpdir, chunk_size=64))
+                serial = vectorizer.transform_corpus(tmpdir, processes=1, chunk_size=64)
+                pooled = vectorizer.transform_corpus(tmpdir, processes=2, chunk_size=64)
+            self.assertGreater(len(blocks), 2)
+            runs = [run for _ in range(2) for run in ['前天晚上', '吃晚饭的时候', '正是一个好看的小猫', '我简直无言以对'] * 50]
+            # Runs cut by a chunk boundary come out whole
+            expected = vectorizer.transform(runs)
+            for matrix in (serial, pooled, sparse.vstack(blocks, format='csr')):
+                self.assertEqual(matrix.shape, expected.shape)
+                self.assertEqual((matrix != expected).nnz, 0)
+
+    unittest.main(argv=sys.argv[:1])
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""
+=======================
+Streaming corpus reader
+=======================
+
+The language model scripts used to read the whole (gzipped) corpus into
+one string, then run `re.findall(r'\\w+')` and `''.join` over all of it,
+so the peak memory was several times the size of the corpus. The reader
+here decompresses, decodes and cleans the corpus in fixed size chunks:
+
+    file(s) --> gunzip --> utf-8 decode --> drop '\\n' --> \\w+ runs
+                  read `chunk_size` characters at a time
+
+Cleaning keeps the `\\w+` runs of the text, as before. A run, or an escaped
+'\\n' of the news corpus, may be cut in two by a chunk boundary, so the
+trailing run of a chunk (and a trailing backslash) is held back and glued
+to the front of the next chunk. The memory used is one chunk plus the
+longest run, whatever the size of the corpus.
+
+The path is a plain text file, a gzipped one (`.gz`, `.tar.gz`), or a
+directory whose files are read in name order.
+
+- `iter_tokens`: the `\\w+` runs one by one
+- `iter_text`: the cleaned text, as strings of about `chunk_size`
+  characters whose concatenation is the old `load_corpus` string
+- `iter_chars`: the characters of the cleaned text one by one
+- `load_corpus`: the whole cleaned text as one string, for small corpora
+
+Usage example
+================
+
+```
+from corpus import iter_text
+
+counter = Counter()
+for text in iter_text('./data/chinese-novels'):
+    counter.update(text)
+```
+"""
+
+import os
+import re
+import sys
+import gzip
+from itertools import chain
+
+
+CHUNK_SIZE = 1 << 20
+
+WORD = re.compile(r'\w+')
+
+# A run touching the end of the chunk may go on in the next one
+TRAILING_WORD = re.compile(r'\w+\Z')
+
+
+def trim(x):
+    return ''.join(WORD.findall(x.replace('\\n', '')))
+
+
+def corpus_files(path):
+    """
+    The files of the corpus, `path` itself or the files under directory `path`
+    """
+    if not os.path.isdir(path):
+        return [path]
+
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names))
+    return files
+
+
+def open_corpus(path):
+    """
+    Open a corpus file as utf-8 text, gunzipping it on the fly
+    """
+    if re.search(r'\S\.gz$', path):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    The raw text of one corpus file, `chunk_size` characters at a time
+    """
+    with open_corpus(path) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_runs(chunks):
+    """
+    Clean a stream of raw text chunks, yield the list of `\\w+` runs of
+    every chunk, a run cut by a chunk boundary comes out whole in the list
+    of the next chunk
+    """
+    pending = ''
+    for chunk in chunks:
+        text = pending + chunk
+        pending = ''
+        if text.endswith('\\'):
+            text, pending = text[:-1], '\\'
+        text = text.replace('\\n', '')
+
+        match = TRAILING_WORD.search(text)
+        if match is not None:
+            pending = match.group() + pending
+            text = text[:match.start()]
+
+        runs = WORD.findall(text)
+        if runs:
+            yield runs
+
+    if pending:
+        runs = WORD.findall(pending)
+        if runs:
+            yield runs
+
+
+def _iter_runs(path, chunk_size):
+    # Cleaned file by file, a run never goes on in the next file
+    for name in corpus_files(path):
+        yield from iter_runs(iter_chunks(name, chunk_size))
+
+
+def iter_tokens(path, chunk_size=CHUNK_SIZE):
+    """
+    The `\\w+` runs of the corpus
+    """
+    for runs in _iter_runs(path, chunk_size):
+        yield from runs
+
+
+def iter_text(path, chunk_size=CHUNK_SIZE):
+    """
+    The cleaned corpus text, in pieces of about `chunk_size` characters
+    """
+    for runs in _iter_runs(path, chunk_size):
+        yield ''.join(runs)
+
+
+def iter_chars(path, chunk_size=CHUNK_SIZE):
+    """
+    The characters of the cleaned corpus text
+    """
+    return chain.from_iterable(iter_text(path, chunk_size))
+
+
+def load_corpus(path):
+    """
+    The whole cleaned corpus text as one string
+    """
+    return ''.join(iter_text(path))
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    class Test(unittest.TestCase):
+        def setUp(self):
+            self.tmpdir = tempfile.TemporaryDirectory()
+            self.raw = '前天晚上，吃晚饭的时候\\n他说: hello world!\\n\\n好看的小猫。\n\n小猫\n' * 7
+
+        def tearDown(self):
+            self.tmpdir.cleanup()
+
+        def write(self, name, text, compress=False):
+            path = os.path.join(self.tmpdir.name, name)
+            with (gzip.open if compress else open)(path, 'wb') as f:
+                f.write(text.encode('utf-8'))
+            return path
+
+        def test_chunk_boundaries(self):
+            expected = WORD.findall(self.raw.replace('\\n', ''))
+            for chunk_size in range(1, 20):
+                chunks = [self.raw[i:i + chunk_size] for i in range(0, len(self.raw), chunk_size)]
+                runs = [run for runs in iter_runs(chunks) for run in runs]
+                self.assertEqual(runs, expected, chunk_size)
+
+        def test_iterators(self):
+            path = self.write('news.txt', self.raw)
+            self.assertEqual(load_corpus(path), trim(self.raw))
+            self.assertEqual(''.join(iter_text(path, chunk_size=5)), trim(self.raw))
+            self.assertEqual(''.join(iter_chars(path, chunk_size=3)), trim(self.raw))
+            self.assertEqual(list(iter_tokens(path, chunk_size=4)), WORD.findall(self.raw.replace('\\n', '')))
+            self.assertTrue(all(len(text) <= 5 + len('hello') for text in iter_text(path, chunk_size=5)))
+
+        def test_gzip_and_directory(self):
+            self.write('a.txt.gz', self.raw, compress=True)
+            self.write('b.txt', '林冲')
+            self.write('c.txt', '教头')
+            self.assertEqual(load_corpus(os.path.join(self.tmpdir.name, 'a.txt.gz')), trim(self.raw))
+            self.assertEqual(load_corpus(self.tmpdir.name), trim(self.raw) + '林冲教头')
+            self.assertEqual(list(iter_tokens(self.tmpdir.name))[-2:], ['林冲', '教头'])
+
+    unittest.main(argv=sys.argv[:1])
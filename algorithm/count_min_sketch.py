@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+"""
+================
+Count-min sketch
+================
+
+Ref: https://en.wikipedia.org/wiki/Count%E2%80%93min_sketch
+
+A count-min sketch estimates the frequency of items in a stream with a fixed
+amount of memory. It is a table of `depth` rows and `width` counters, every
+row owns a hash function that maps an item to one counter of the row:
+
+           0    1    2    3    4    5    6    7
+        +----+----+----+----+----+----+----+----+
+h1(x)   |    |    | +1 |    |    |    |    |    |
+        +----+----+----+----+----+----+----+----+
+h2(x)   |    |    |    |    |    | +1 |    |    |
+        +----+----+----+----+----+----+----+----+
+h3(x)   | +1 |    |    |    |    |    |    |    |
+        +----+----+----+----+----+----+----+----+
+
+Adding x increases the `depth` counters x is hashed to, the estimate of x is
+the minimum of them. Collisions only ever add to a counter, so the estimate
+never under counts, and with
+
+    width = ⌈e / ε⌉, depth = ⌈ln(1 / δ)⌉
+
+it over counts by more than ε * N (N the total count) with probability δ.
+
+Conservative update only raises the counters which are below the new
+estimate, which gives the same guarantee with a much smaller error on
+skewed streams.
+
+The row hashes are derived from one 64 bit mixed hash with double hashing:
+g(i) = h1 + i * h2.
+
+`add_many` and `estimate_many` do the same for a whole numpy array of
+non-negative integer keys at once. The keys of a batch are summed up
+first, then conservative update raises every counter to the largest new
+estimate of the keys hashed to it. The estimates are computed before
+the batch is applied, so they can be a little lower than when the keys
+are added one by one, and never lower than the true counts.
+"""
+
+import math
+from array import array
+
+import numpy as np
+
+
+MASK64 = (1 << 64) - 1
+
+# hash() of a non-negative int is the int modulo this prime
+HASH_MODULUS = (1 << 61) - 1
+
+
+def mix64(h):
+    """
+    64 bit finalizer of MurmurHash3, spreads the bits of `h`
+    """
+    h &= MASK64
+    h = ((h ^ (h >> 33)) * 0xff51afd7ed558ccd) & MASK64
+    h = ((h ^ (h >> 33)) * 0xc4ceb9fe1a85ec53) & MASK64
+    return h ^ (h >> 33)
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch with optional saturating counters
+
+    :param int width: Counters per row
+    :param int depth: Number of rows
+    :param int max_count: Counters saturate at this value, counters fit in
+                          one byte when it is not greater than 255, in four
+                          up to 2 ** 32 - 1
+    :param bool conservative: Use conservative update
+    """
+    def __init__(self, width, depth, max_count=None, conservative=False):
+        if width < 1 or depth < 1:
+            raise ValueError('width and depth must be positive')
+
+        self.width = width
+        self.depth = depth
+        self.max_count = max_count
+        self.conservative = conservative
+        if max_count is None or max_count > 0xffffffff:
+            self.typecode = 'Q'
+        elif max_count > 255:
+            self.typecode = 'I'
+        else:
+            self.typecode = 'B'
+        self.table = array(self.typecode, [0]) * (width * depth)
+        self.offsets = [(row, row * width) for row in range(depth)]
+        self.total = 0
+
+    @classmethod
+    def from_error(cls, epsilon, delta, **kwargs):
+        """
+        Create a sketch which over counts by more than `epsilon` * total
+        with probability `delta`
+        """
+        width = int(math.ceil(math.e / epsilon))
+        depth = int(math.ceil(math.log(1 / delta)))
+        return cls(width, depth, **kwargs)
+
+    @property
+    def nbytes(self):
+        return self.table.itemsize * len(self.table)
+
+    def _indexes(self, key):
+        # mix64 inlined, this runs on every add/estimate
+        h = hash(key) & MASK64
+        h = ((h ^ (h >> 33)) * 0xff51afd7ed558ccd) & MASK64
+        h = ((h ^ (h >> 33)) * 0xc4ceb9fe1a85ec53) & MASK64
+        h ^= h >> 33
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [offset + (h1 + row * h2) % width for row, offset in self.offsets]
+
+    def add(self, key, count=1):
+        """
+        Add `count` occurrences of `key`
+
+        :returns: The new estimate of `key`
+        """
+        table = self.table
+        indexes = self._indexes(key)
+        self.total += count
+
+        if self.conservative:
+            new = min(table[i] for i in indexes) + count
+            if self.max_count is not None and new > self.max_count:
+                new = self.max_count
+            for i in indexes:
+                if table[i] < new:
+                    table[i] = new
+            return new
+
+        for i in indexes:
+            value = table[i] + count
+            if self.max_count is not None and value > self.max_count:
+                value = self.max_count
+            table[i] = value
+        return min(table[i] for i in indexes)
+
+    def estimate(self, key):
+        """
+        Estimated count of `key`, never lower than the true count unless
+        the counters saturated or were halved
+        """
+        table = self.table
+        return min(table[i] for i in self._indexes(key))
+
+    __getitem__ = estimate
+
+    def _indexes_many(self, keys):
+        # Vectorized _indexes of non-negative int keys, (depth, len(keys))
+        h = np.asarray(keys, dtype=np.uint64) % np.uint64(HASH_MODULUS)
+        h = (h ^ (h >> np.uint64(33))) * np.uint64(0xff51afd7ed558ccd)
+        h = (h ^ (h >> np.uint64(33))) * np.uint64(0xc4ceb9fe1a85ec53)
+        h ^= h >> np.uint64(33)
+        h1 = h & np.uint64(0xffffffff)
+        h2 = (h >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        offsets = rows * np.uint64(self.width)
+        return (offsets + (h1 + rows * h2) % np.uint64(self.width)).astype(np.int64)
+
+    def _counters(self):
+        # numpy view of the table, writes go to the table
+        return np.frombuffer(self.table, dtype=self.typecode)
+
+    def add_many(self, keys, counts=None):
+        """
+        Add `counts` occurrences of every key of an array of non-negative
+        integers, 1 when None
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        if counts is None:
+            keys, counts = np.unique(keys, return_counts=True)
+        else:
+            keys, inverse = np.unique(keys, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        if not len(keys):
+            return
+
+        table = self._counters()
+        indexes = self._indexes_many(keys)
+        self.total += int(counts.sum())
+
+        if self.conservative:
+            new = table[indexes].min(axis=0).astype(np.int64) + counts
+            if self.max_count is not None:
+                new = np.minimum(new, self.max_count)
+            np.maximum.at(table, indexes.ravel(), np.broadcast_to(new, indexes.shape).ravel().astype(table.dtype))
+            return
+
+        cells, inverse = np.unique(indexes.ravel(), return_inverse=True)
+        added = np.bincount(inverse, weights=np.broadcast_to(counts, indexes.shape).ravel()).astype(np.int64)
+        values = table[cells].astype(np.int64) + added
+        if self.max_count is not None:
+            values = np.minimum(values, self.max_count)
+        table[cells] = values
+
+    def estimate_many(self, keys):
+        """
+        Estimates of an array of non-negative integer keys
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        if not len(keys):
+            return np.zeros(0, dtype=np.int64)
+        return self._counters()[self._indexes_many(keys)].min(axis=0).astype(np.int64)
+
+    def halve(self):
+        """
+        Divide all the counters by two, used to age old frequencies out
+        """
+        self.table = array(self.typecode, (c >> 1 for c in self.table))
+        self.total >>= 1
+
+
+if __name__ == '__main__':
+    import sys
+    import random
+    import unittest
+    from collections import Counter
+
+    class Test(unittest.TestCase):
+        def setUp(self):
+            rnd = random.Random(0)
+            self.stream = [int(rnd.paretovariate(1.2)) * 7919 + (1 << 62) * rnd.randrange(2) for _ in range(20000)]
+            self.counts = Counter(self.stream)
+
+        def test_never_under_counts(self):
+            for conservative in (False, True):
+                sketch = CountMinSketch(200, 4, conservative=conservative)
+                for key in self.stream:
+                    sketch.add(key)
+                self.assertEqual(sketch.total, len(self.stream))
+                for key, count in self.counts.items():
+                    self.assertGreaterEqual(sketch[key], count)
+
+        def test_add_many(self):
+            for conservative in (False, True):
+                one = CountMinSketch(200, 4, conservative=conservative)
+                many = CountMinSketch(200, 4, conservative=conservative)
+                for key in self.stream:
+                    one.add(key)
+                for start in range(0, len(self.stream), 1000):
+                    many.add_many(np.array(self.stream[start:start + 1000], dtype=np.uint64))
+                keys = np.array(list(self.counts), dtype=np.uint64)
+                estimates = many.estimate_many(keys)
+                self.assertEqual(many.total, len(self.stream))
+                self.assertEqual(estimates.tolist(), [many[int(key)] for key in keys])
+                self.assertTrue(np.all(estimates >= np.array([self.counts[int(k)] for k in keys])))
+                if not conservative:
+                    self.assertEqual(many.table, one.table)
+
+        def test_saturation(self):
+            sketch = CountMinSketch(16, 2, max_count=15, conservative=True)
+            sketch.add_many(np.array([3] * 40, dtype=np.uint64))
+            sketch.add_many(np.array([3, 4]), counts=np.array([300, 1]))
+            self.assertEqual(sketch[3], 15)
+            plain = CountMinSketch(16, 2, max_count=255)
+            plain.add_many(np.array([3, 3]), counts=np.array([200, 200]))
+            self.assertEqual(plain.estimate_many(np.array([3])).tolist(), [255])
+
+    unittest.main(argv=sys.argv[:1])
@@ -35,7 +35,8 @@ Refs:
 import sys
 import time
 import argparse
-import functools
+
+from lru import memoize
 
 
 def weight_insertion(ch):
@@ -59,7 +60,7 @@ def weight_substitution(ch1, ch2):
     return 2
 
 
-@functools.lru_cache(maxsize=20)
+@memoize(size=4096)
 def edit_distance(seq1, seq2):
     """
     Calculate edit distance between string `seq1` and `seq2`
@@ -84,15 +85,16 @@ def edit_distance(seq1, seq2):
     )
 
 
-def edit_distance_with_solution(cache):
+def edit_distance_with_solution(cache, cache_size=4096):
     """
     A function to calculate edit distance between string `seq1` and `seq2`
 
     :param str seq1: String 1
     :param str seq2: String 2
+    :param int cache_size: The memorization cache size
     :return int: The edit distance calculation function
     """
-    @functools.lru_cache(maxsize=20)
+    @memoize(size=cache_size)
     def wrapper(seq1, seq2):
         key = '{}:{}'.format(seq1, seq2)
         if seq1 == seq2:
@@ -138,12 +140,15 @@ if __name__ == '__main__':
         args.seq2,
         dist
     ))
+    print('Cache: {}'.format(edit_distance.cache_stats()))
 
     cache = {}
-    dist = edit_distance_with_solution(cache)(args.seq1, args.seq2)
+    edit_distance_fn = edit_distance_with_solution(cache)
+    dist = edit_distance_fn(args.seq1, args.seq2)
     print('Min edit distance between "{}" and "{}" is {}'.format(
         args.seq1,
         args.seq2,
         dist
     ))
     print(cache)
+    print('Cache: {}'.format(edit_distance_fn.cache_stats()))
@@ -36,59 +36,229 @@ For a group of items which occur r times, the probability would be:
 
 (1 + r) * Nr+1 / N
 
+Simple Good-Turing
+================
+
+Ref: Gale & Sampson, Good-Turing Frequency Estimation Without Tears, 1995
+
+The raw estimate is useless for large r, where Nr+1 is often 0. The
+Simple Good-Turing estimator smooths the Nr first:
+
+1. All the Nr in one pass over the counts, `np.bincount`
+2. Zr = 2 Nr / (r'' - r'), r' and r'' the seen counts around r, spreads
+   Nr over the unseen counts of the gap
+3. Least squares fit of log Zr = a + b log r, S(r) = exp(a + b log r)
+4. r* = (r + 1) Nr+1 / Nr, the Turing estimate, while it differs from
+   the smoothed (r + 1) S(r + 1) / S(r) by more than 1.96 standard
+   deviations, the smoothed one for r from there on
+5. p(r) = (1 - N1 / N) r* / Σ Nr r*, so the seen items leave N1 / N to
+   the unseen ones
+
+`prob(r)` takes an array of counts, so scoring many items is one lookup.
+
+Usage example
+================
+
+```
+# Fit the counts of the trigrams of the novels
+$ python algorithm/good_turning_estimate.py ./data/chinese-novels --order 3
+
+# Plot Nr and the fitted line, matplotlib is only imported then
+$ python algorithm/good_turning_estimate.py ./data/chinese-novels --order 3 --plot
+```
 """
 
-import re
 import sys
-import gzip
 import argparse
-from collections import Counter
-from matplotlib import pyplot as plt
 
+import numpy as np
 
-def trim(x):
-    return ''.join(re.findall(r'\w+', x.replace('\\n', '')))
+from corpus import iter_text
+from ngram_count import NgramCounts
 
 
-def load_corpus(path):
-    fopen = open
-    if re.search(r'\S(.tar.gz)$', path):
-        fopen = gzip.open
+def frequency_of_frequencies(counts):
+    """
+    Nr = |{xj : #(xj) = r}| for r in 0..max(counts), in one pass
 
-    with fopen(path, 'r') as f:
-        raw = ''.join(re.findall(r'\w+', f.read().decode('utf-8').replace('\\n', '')))
-        return raw
+    :param counts: The count of every item, an iterable (e.g. the values
+                   of a dict) or an array
+    :return: int64 array, N0 being the number of counts of 0
+    """
+    if not isinstance(counts, np.ndarray):
+        counts = np.fromiter(counts, dtype=np.int64)
+    return np.bincount(counts.astype(np.int64, copy=False))
 
 
-def get_nr(vocb: Counter, r: int):
+class SimpleGoodTuring(object):
     """
-    Get number of items with occurring r times in vocabularies
-    vocb = {'w1': r1, 'w2': r2, ..., 'wn': rn}
+    Simple Good-Turing estimator of the probability of an item seen r times
 
-    Nr = |{xj : #(xj ) = r}|
+    :param counts: The count of every item seen, an iterable or an array,
+                   or a mapping of them (a dict, `NgramCounts`)
+    :param int unseen: The number of items never seen, `prob(0)` gives
+                       each a share of the unseen mass when known
+    :param float confidence: Number of standard deviations the Turing
+                             estimate has to be off the smoothed one
     """
-    return sum(1 if item[1] == r else 0 for item in vocb.items())
+    def __init__(self, counts, unseen=None, confidence=1.96):
+        if hasattr(counts, 'values'):
+            counts = counts.values()
+        nr = frequency_of_frequencies(counts)
+        nr[:1] = 0
+        r = np.flatnonzero(nr)
+        if len(r) < 2:
+            raise ValueError('Can not fit the counts of less than two different values')
+
+        n = nr[r].astype(np.float64)
+        self.nr = nr
+        self.total = int((r * n).sum())
+        self.unseen = unseen
+
+        # Nr spread over the gap to the next seen counts
+        before = np.concatenate(([0], r[:-1]))
+        after = np.concatenate((r[1:], [2 * r[-1] - before[-1]]))
+        z = 2 * n / (after - before)
+        self.slope, self.intercept = np.polyfit(np.log(r), np.log(z), 1)
+
+        next_n = np.append(nr, 0)[r + 1].astype(np.float64)
+        turing = (r + 1) * next_n / n
+        smoothed = self._smoothed(r)
+        spread = confidence * np.sqrt((r + 1) ** 2 * next_n / n ** 2 * (1 + next_n / n))
+        differs = (next_n > 0) & (np.abs(turing - smoothed) > spread)
+        # Turing estimates up to the first r they stop differing at
+        switch = len(r) if differs.all() else int(np.argmin(differs))
+        adjusted = np.where(np.arange(len(r)) < switch, turing, smoothed)
+
+        self.p0 = nr[1] / self.total
+        self.norm = (n * adjusted).sum()
+        # r* of every count up to the largest one, the smoothed one for
+        # the counts never seen
+        self.table = self._smoothed(np.arange(len(nr)))
+        self.table[r] = adjusted
+
+    def _smoothed(self, r):
+        # (r + 1) S(r + 1) / S(r)
+        r = np.maximum(np.asarray(r, dtype=np.float64), 1)
+        return (r + 1) * (1 + 1 / r) ** self.slope
+
+    def adjusted(self, r):
+        """
+        r*, the adjusted count of every count in `r`
+        """
+        r = np.asarray(r, dtype=np.int64)
+        inside = r < len(self.table)
+        adjusted = np.where(inside, self.table[np.where(inside, r, 0)], self._smoothed(r))
+        return np.where(r > 0, adjusted, 0.0)
+
+    def prob(self, r):
+        """
+        Probability of an item seen r times, for a count or an array of
+        them. An unseen item gets its share of `prob_unseen()` when the
+        number of unseen items is known, else all of it
+        """
+        r = np.asarray(r, dtype=np.int64)
+        unseen = self.prob_unseen() / (self.unseen or 1)
+        return np.where(r > 0, (1 - self.p0) * self.adjusted(r) / self.norm, unseen)
+
+    def prob_unseen(self):
+        """
+        Probability of all the unseen items together, N1 / N
+        """
+        return self.p0
+
+    def discount(self, r):
+        """
+        r* / r, the ratio a count of r is discounted by
+        """
+        r = np.asarray(r, dtype=np.int64)
+        return self.adjusted(r) / np.maximum(r, 1)
+
+    def plot(self, max_r=1000):
+        """
+        Plot log Nr and the fitted log Zr line
+        """
+        from matplotlib import pyplot as plt
+
+        r = np.flatnonzero(self.nr[:max_r])
+        plt.loglog(r, self.nr[r], '.', label='Nr')
+        plt.loglog(r, np.exp(self.intercept + self.slope * np.log(r)), label='fitted Zr')
+        plt.xlabel('r')
+        plt.ylabel('Nr')
+        plt.legend()
+        plt.show()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('corpus', type=str, help='Corpus file path')
+    parser.add_argument('corpus', type=str, nargs='?', help='Corpus file path, run the unit tests when missing')
+    parser.add_argument('--order', type=int, default=1, help='Order of the n-grams counted')
+    parser.add_argument('--plot', action='store_true', help='Plot Nr and the fitted line with matplotlib')
     args = parser.parse_args(sys.argv[1:])
 
-    corpus = load_corpus(args.corpus)
-    vocb = Counter(corpus)
-
-    nrs = []
-    max_freq = 1000  # max = vocb.most_common(1)[0][1]
-    for i in range(max_freq):
-        print('Processing r = %d' % i)
-        if i == 0:
-            nr = get_nr(vocb, 1)
-        else:
-            nr = get_nr(vocb, i)
-        nrs.append(nr)
-
-    plt.plot(range(max_freq), nrs)
-    plt.xlabel('r')
-    plt.ylabel('Nr')
-    plt.show()
+    if args.corpus:
+        counts = NgramCounts.from_texts(iter_text(args.corpus), args.order)
+        estimator = SimpleGoodTuring(counts.counts)
+        print('{} {}-grams, N = {}, slope {:.3f}, unseen mass {:.6f}'.format(
+            len(counts), args.order, estimator.total, estimator.slope, estimator.prob_unseen()))
+        r = np.arange(1, 11)
+        for count, nr, adjusted, prob in zip(r, estimator.nr[r], estimator.adjusted(r), estimator.prob(r)):
+            print('r = {:2d}  Nr = {:8d}  r* = {:8.4f}  p = {:.3e}'.format(count, nr, adjusted, prob))
+        if args.plot:
+            estimator.plot()
+        sys.exit(0)
+
+    import unittest
+    from collections import Counter
+
+    def get_nr(vocb, r):
+        return sum(1 if item[1] == r else 0 for item in vocb.items())
+
+    class Test(unittest.TestCase):
+        def setUp(self):
+            rnd = np.random.RandomState(0)
+            # Zipf like, many rare items and a few frequent ones
+            self.vocb = Counter(rnd.zipf(1.5, 20000).tolist())
+            self.estimator = SimpleGoodTuring(self.vocb, unseen=100)
+
+        def test_frequency_of_frequencies(self):
+            nr = frequency_of_frequencies(list(self.vocb.values()))
+            for r in range(50):
+                self.assertEqual(nr[r], get_nr(self.vocb, r))
+            self.assertEqual(frequency_of_frequencies([1, 2, 2, 0]).tolist(), [1, 1, 2])
+            self.assertEqual(frequency_of_frequencies(self.vocb.values()).tolist(), nr.tolist())
+
+        def test_count_sources(self):
+            text = ''.join(chr(0x4e00 + int(k) % 500) for k in np.random.RandomState(1).zipf(1.3, 20000))
+            estimator = SimpleGoodTuring(Counter(text))
+            for counts in (NgramCounts.from_text(text, 1), np.array(list(Counter(text).values()))):
+                self.assertEqual(SimpleGoodTuring(counts).nr.tolist(), estimator.nr.tolist())
+
+        def test_normalized(self):
+            estimator = self.estimator
+            counts = np.array(list(self.vocb.values()))
+            self.assertEqual(estimator.total, counts.sum())
+            self.assertAlmostEqual(estimator.prob_unseen(), get_nr(self.vocb, 1) / counts.sum())
+            self.assertAlmostEqual(estimator.prob(counts).sum() + estimator.prob_unseen(), 1.0)
+            self.assertAlmostEqual(estimator.prob(0) * 100, estimator.prob_unseen())
+
+        def test_estimates(self):
+            estimator = self.estimator
+            self.assertLess(estimator.slope, -1)
+            # Turing estimate at r = 1, it differs from the smoothed one there
+            nr = estimator.nr
+            self.assertAlmostEqual(estimator.adjusted(1), 2 * nr[2] / nr[1])
+            r = np.arange(1, 3000)
+            adjusted = estimator.adjusted(r)
+            self.assertTrue((adjusted < r).all())
+            self.assertTrue((estimator.discount(r) < 1).all())
+            self.assertTrue(np.all(np.diff(estimator.prob(r[10:])) > 0))
+            # Scalars and arrays alike, counts past the largest one too
+            self.assertAlmostEqual(float(estimator.prob(5)), estimator.prob([5, 7])[0])
+            self.assertGreater(estimator.prob(10 ** 6), estimator.prob(10 ** 5))
+
+        def test_too_few(self):
+            with self.assertRaises(ValueError):
+                SimpleGoodTuring([1, 1, 1])
+
+    unittest.main(argv=sys.argv[:1])
@@ -62,8 +62,187 @@ not excceeding the list limit:
 +------+    +------+    +------+    +------+
 | Val3 |--->| Val4 |--->| Val2 |--->| Val5 |
 +------+    +------+    +------+    +------+
+
+=======================
+Array Hash Linked List
+=======================
+
+The pointer version allocates one node object per entry. With a fixed
+capacity we can instead keep keys, values and the prev/next links in
+preallocated arrays indexed by slot number, the hash table only maps a
+key to its slot:
+
+slot       0      1      2      3      4 (sentinel)
+        +------+------+------+------+------+
+key     | Key1 | Key2 | Key3 | Key4 |      |
+        +------+------+------+------+------+
+prev    |  4   |  0   |  1   |  2   |  3   |
+        +------+------+------+------+------+
+nxt     |  1   |  2   |  3   |  4   |  0   |
+        +------+------+------+------+------+
+
+The sentinel slot closes the list into a ring, so the head (least recently
+used) is `nxt[sentinel]` and the tail is `prev[sentinel]`. When the list is
+full, the head slot is handed over to the new key and moved to the tail,
+so nothing is allocated after the arrays are created.
+
+====================
+Weight and TTL limit
+====================
+
+Counting entries is a poor budget when their sizes differ by orders of
+magnitude. `WeightedHashLinkedList` keeps the total weight of the entries
+(bytes by default) and evicts from the head until the total fits.
+
+Entries can also carry a time to live. An expired entry is missed on
+access, and a timing wheel sweeps the expired entries nobody asks for:
+
+          tick 0   tick 1   tick 2         tick n-1
+        +--------+--------+--------+-----+--------+
+        | k3, k7 |        |   k1   | ... |   k5   |
+        +--------+--------+--------+-----+--------+
+                     ^
+                  current
+
+A key expiring at t lives in bucket `t // tick % n`, and every write moves
+`current` forward over the elapsed buckets, removing their expired keys.
+
+=================
+Snapshot and load
+=================
+
+A restarted process starts with a cold cache. `dump(path)` writes the
+entries from the most to the least recently used, pickled in chunks, and
+`load(path, hottest=k)` reads back only the chunks holding the k hottest
+ones and links them into the list in one pass, without going through a
+`__setitem__` per entry.
+
+Usage example
+================
+
+```
+# Run the unit tests
+$ python algorithm/lru.py
+
+# Compare memory per entry and ops/sec of the implementations
+$ python algorithm/lru.py --benchmark --entries 1000000
+```
 """
 
+import sys
+import time
+import pickle
+import random
+import argparse
+import functools
+import tracemalloc
+from collections import OrderedDict, namedtuple
+
+
+# Counters reported by the caches built on top of the hash linked lists
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'evictions', 'size', 'capacity'])
+
+# First bytes of the files written by `dump`
+SNAPSHOT_MAGIC = b'LRUSNAP1'
+
+
+class MappingMixin(object):
+    """
+    Mapping helpers shared by the hash linked lists
+
+    Subclasses provide `hash_table`, `__getitem__`, `__setitem__`,
+    `_remove(key)`, `peek(key, default)`, `popitem()`, `items()` and
+    `_rebuild(items)`.
+    """
+    def __len__(self):
+        return len(self.hash_table)
+
+    def __contains__(self, key):
+        return key in self.hash_table
+
+    def __delitem__(self, key):
+        self._remove(key)
+
+    def get(self, key, default=None):
+        """
+        Get the value of `key` and mark it as recently used
+
+        :param key: The key to look up
+        :param default: Returned when the key is absent
+        """
+        if key not in self.hash_table:
+            return default
+        return self[key]
+
+    def pop(self, key, *default):
+        """
+        Remove `key` and return its value
+
+        :param key: The key to remove
+        :param default: Returned when the key is absent, otherwise
+                        `KeyError` is raised
+        """
+        if key not in self.hash_table:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return self._remove(key)
+
+    def get_many(self, keys, default=None):
+        """
+        Get the values of `keys` in order, absent keys give `default`
+        """
+        return [self.get(key, default) for key in keys]
+
+    def set_many(self, items):
+        """
+        Set the (key, value) pairs of `items`, which may also be a dict
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        for key, value in items:
+            self[key] = value
+
+    def dump(self, path, chunk_size=1024):
+        """
+        Write the entries to `path`, from the most to the least recently used
+
+        The file is `SNAPSHOT_MAGIC`, the pickled number of entries, and the
+        entries pickled in chunks of `chunk_size` (key, value) pairs, so a
+        partial `load` stops reading after the chunks it needs.
+        """
+        items = self.items()
+        items.reverse()
+        with open(path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler.dump(len(items))
+            for start in range(0, len(items), chunk_size):
+                pickler.dump(items[start:start + chunk_size])
+
+    def load(self, path, hottest=None):
+        """
+        Replace the entries with the ones dumped to `path`
+
+        :param str path: The snapshot file
+        :param int hottest: Only restore the `hottest` most recently used
+                            entries, the size of the list caps it anyway
+        """
+        limit = self.size if hottest is None else min(hottest, self.size)
+        items = []
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError('{} is not a LRU snapshot'.format(path))
+            unpickler = pickle.Unpickler(f)
+            limit = min(limit, unpickler.load())
+            while len(items) < limit:
+                items.extend(unpickler.load())
+
+        # Snapshots are hottest first, the lists are coldest first
+        del items[limit:]
+        items.reverse()
+        self._rebuild(items)
+
 
 class PtNode(object):
     """
@@ -82,7 +261,7 @@ class PtNode(object):
         return self.key
 
 
-class PtHashLinkedList(object):
+class PtHashLinkedList(MappingMixin):
     """
     Pointer version
     """
@@ -101,51 +280,109 @@ class PtHashLinkedList(object):
         return node.value
 
     def __setitem__(self, key, value):
-        prev = self.tail
-        node = PtNode(key, prev, None, value)
+        node = self.hash_table.get(key, None)
+        if node is not None:
+            # Update in place, the node only moves to the tail
+            node.value = value
+            self._refresh_node(node)
+            return
+
+        node = PtNode(key, None, None, value)
         self.hash_table[key] = node
-        self.tail = node
+        self._append_node(node)
 
-        if prev is not None:
-            prev.nxt = node
+        self._purge_list()
 
-        if self.head is None:
-            self.head = node
+    def _remove(self, key):
+        node = self.hash_table.pop(key)
+        self._unlink_node(node)
+        return node.value
 
-        self._purge_list()
+    def peek(self, key, default=None):
+        """
+        Get the value of `key` without marking it as recently used
+        """
+        node = self.hash_table.get(key, None)
+        if node is None:
+            return default
+        return node.value
+
+    def popitem(self):
+        """
+        Remove and return the least recently used (key, value) pair
+        """
+        if self.head is None:
+            raise KeyError('popitem(): list is empty')
+        key = self.head.key
+        return key, self._remove(key)
 
     def _purge_list(self):
-        if len(self.hash_table) > self.size:
+        while len(self.hash_table) > self.size:
             head_node = self.head
-            if head_node is not None:
-                nxt_node = head_node.nxt
-                self.head = nxt_node
-                nxt_node.prev = None
-                del self.hash_table[head_node.key]
-
-    def _refresh_node(self, node):
-        if node == self.tail:
-            return
+            self._unlink_node(head_node)
+            del self.hash_table[head_node.key]
 
+    def _unlink_node(self, node):
         prev_node = node.prev
         nxt_node = node.nxt
 
-        if self.head == node:
+        if prev_node is None:
             self.head = nxt_node
-
-        if prev_node is not None:
+        else:
             prev_node.nxt = nxt_node
 
-        if nxt_node is not None:
+        if nxt_node is None:
+            self.tail = prev_node
+        else:
             nxt_node.prev = prev_node
 
-        last_node = self.tail
-        last_node.nxt = node
+        node.prev = None
+        node.nxt = None
 
+    def _append_node(self, node):
+        last_node = self.tail
+        node.prev = last_node
         node.nxt = None
-        node.prev = self.tail
+        if last_node is None:
+            self.head = node
+        else:
+            last_node.nxt = node
         self.tail = node
 
+    def _refresh_node(self, node):
+        if node is self.tail:
+            return
+
+        self._unlink_node(node)
+        self._append_node(node)
+
+    def _rebuild(self, items):
+        # Link the nodes in order, `items` goes from the least recently used
+        self.hash_table = {}
+        self.head = None
+        self.tail = None
+        prev = None
+        for key, value in items:
+            node = PtNode(key, prev, None, value)
+            self.hash_table[key] = node
+            if prev is None:
+                self.head = node
+            else:
+                prev.nxt = node
+            prev = node
+        self.tail = prev
+
+    def items(self):
+        """
+        (key, value) pairs from the least to the most recently used
+        """
+        res = []
+        node = self.head
+        while node is not None:
+            res.append((node.key, node.value))
+            node = node.nxt
+        return res
+
     def __str__(self):
         head = self.head
         res = 'HEAD'
@@ -169,7 +406,7 @@ class Node(object):
             self.prev, self.nxt, self.value)
 
 
-class HashLinkedList(object):
+class HashLinkedList(MappingMixin):
     def __init__(self, size):
         self.size = size
         self.hash_table = {}
@@ -188,57 +425,113 @@ class HashLinkedList(object):
         if key == self.tail:
             return
 
-        # Deal with the head pointer
-        if key == self.head:
+        self._unlink_node(key, node)
+        self._append_node(key, node)
+
+    def _unlink_node(self, key, node):
+        # Deal with prev node and the head pointer
+        if node.prev is None:
             self.head = node.nxt
+        else:
+            self.hash_table[node.prev].nxt = node.nxt
 
-        # Deal with prev node
-        if node.prev is not None:
-            prev_node = self.hash_table[node.prev]
-            prev_node.nxt = node.nxt
+        # Deal with next node and the tail pointer
+        if node.nxt is None:
+            self.tail = node.prev
+        else:
+            self.hash_table[node.nxt].prev = node.prev
 
-        # Deal with next node
-        if node.nxt is not None:
-            nxt_node = self.hash_table[node.nxt]
-            nxt_node.prev = node.prev
+        node.prev = None
+        node.nxt = None
 
+    def _append_node(self, key, node):
         # Deal with current node
-        node.nxt = None
         node.prev = self.tail
+        node.nxt = None
 
         # Deal with the last node
-        last_node = self.hash_table[self.tail]
-        last_node.nxt = key
+        if self.tail is None:
+            self.head = key
+        else:
+            self.hash_table[self.tail].nxt = key
 
         # Deal with tail pointer
         self.tail = key
 
     def _purge_list(self):
-        if len(self.hash_table) > self.size:
-            if self.head is not None:
-                head_node = self.hash_table[self.head]      # first node
-                nxt_key = head_node.nxt                     # second node
-                if nxt_key is not None:
-                    nxt_node = self.hash_table[nxt_key]
-                    # second node become first node
-                    nxt_node.prev = None
-                    del self.hash_table[self.head]
-                    self.head = nxt_key
+        while len(self.hash_table) > self.size:
+            head_key = self.head
+            self._unlink_node(head_key, self.hash_table[head_key])
+            del self.hash_table[head_key]
+
+    def _remove(self, key):
+        node = self.hash_table[key]
+        self._unlink_node(key, node)
+        del self.hash_table[key]
+        return node.value
 
-    def __setitem__(self, key, value):
-        node = Node(self.tail, None, value)
-        self.hash_table[key] = node
-        prev_node = self.hash_table.get(self.tail, None)
-        if prev_node is not None:
-            prev_node.nxt = key
+    def peek(self, key, default=None):
+        """
+        Get the value of `key` without marking it as recently used
+        """
+        node = self.hash_table.get(key, None)
+        if node is None:
+            return default
+        return node.value
 
-        if len(self.hash_table) == 1:
-            self.head = key
+    def popitem(self):
+        """
+        Remove and return the least recently used (key, value) pair
+        """
+        if self.head is None:
+            raise KeyError('popitem(): list is empty')
+        key = self.head
+        return key, self._remove(key)
 
-        self.tail = key
+    def __setitem__(self, key, value):
+        node = self.hash_table.get(key, None)
+        if node is not None:
+            # Update in place, the node only moves to the tail
+            node.value = value
+            self._refresh_node(key, node)
+            return
+
+        node = Node(None, None, value)
+        self.hash_table[key] = node
+        self._append_node(key, node)
 
         self._purge_list()
 
+    def _rebuild(self, items):
+        # Link the nodes in order, `items` goes from the least recently used
+        self.hash_table = {}
+        self.head = None
+        self.tail = None
+        prev_key = None
+        prev_node = None
+        for key, value in items:
+            node = Node(prev_key, None, value)
+            self.hash_table[key] = node
+            if prev_node is None:
+                self.head = key
+            else:
+                prev_node.nxt = key
+            prev_key = key
+            prev_node = node
+        self.tail = prev_key
+
+    def items(self):
+        """
+        (key, value) pairs from the least to the most recently used
+        """
+        res = []
+        pt = self.head
+        while pt is not None:
+            node = self.hash_table[pt]
+            res.append((pt, node.value))
+            pt = node.nxt
+        return res
+
     def __str__(self):
         pt = self.head
         res = 'HEAD'
@@ -249,10 +542,553 @@ class HashLinkedList(object):
         return res
 
 
+class ArrayHashLinkedList(MappingMixin):
+    """
+    Array version, keys/values/links live in preallocated slot arrays
+    """
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('size must be positive, got {}'.format(size))
+
+        self.size = size
+        self.hash_table = {}
+        self.keys = [None] * size
+        self.values = [None] * size
+        # Slot `size` is the sentinel, an empty ring points to itself.
+        # Plain lists rather than `array.array`: reading an array item
+        # boxes a new int, while a list hands back the stored slot object.
+        self.prev = [size] * (size + 1)
+        self.nxt = [size] * (size + 1)
+        self.used = 0
+        # Slots released by deletion, reused before fresh ones
+        self.free = []
+
+    def __getitem__(self, key):
+        slot = self.hash_table.get(key, None)
+        if slot is None:
+            return None
+
+        self._refresh_slot(slot)
+        return self.values[slot]
+
+    def __setitem__(self, key, value):
+        slot = self.hash_table.get(key, None)
+        if slot is not None:
+            self.values[slot] = value
+            self._refresh_slot(slot)
+            return
+
+        if self.free or self.used < self.size:
+            # Take a free slot and link it after the tail
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = self.used
+                self.used += 1
+            sentinel = self.size
+            tail = self.prev[sentinel]
+            self.prev[slot] = tail
+            self.nxt[slot] = sentinel
+            self.nxt[tail] = slot
+            self.prev[sentinel] = slot
+        else:
+            # Reuse the head slot, moving it to the tail evicts the old key
+            slot = self.nxt[self.size]
+            del self.hash_table[self.keys[slot]]
+            self._refresh_slot(slot)
+
+        self.keys[slot] = key
+        self.values[slot] = value
+        self.hash_table[key] = slot
+
+    def _remove(self, key):
+        slot = self.hash_table.pop(key)
+        value = self.values[slot]
+
+        prev_slot = self.prev[slot]
+        nxt_slot = self.nxt[slot]
+        self.nxt[prev_slot] = nxt_slot
+        self.prev[nxt_slot] = prev_slot
+
+        self.keys[slot] = None
+        self.values[slot] = None
+        self.free.append(slot)
+        return value
+
+    def peek(self, key, default=None):
+        """
+        Get the value of `key` without marking it as recently used
+        """
+        slot = self.hash_table.get(key, None)
+        if slot is None:
+            return default
+        return self.values[slot]
+
+    def popitem(self):
+        """
+        Remove and return the least recently used (key, value) pair
+        """
+        if not self.hash_table:
+            raise KeyError('popitem(): list is empty')
+        key = self.keys[self.nxt[self.size]]
+        return key, self._remove(key)
+
+    def _refresh_slot(self, slot):
+        sentinel = self.size
+        prev = self.prev
+        nxt = self.nxt
+        tail = prev[sentinel]
+        if slot == tail:
+            return
+
+        # Pull the slot out of the ring
+        prev_slot = prev[slot]
+        nxt_slot = nxt[slot]
+        nxt[prev_slot] = nxt_slot
+        prev[nxt_slot] = prev_slot
+
+        # Insert it between the tail and the sentinel
+        prev[slot] = tail
+        nxt[slot] = sentinel
+        nxt[tail] = slot
+        prev[sentinel] = slot
+
+    def _rebuild(self, items):
+        # Slot i holds the i-th least recently used entry
+        size = self.size
+        n = len(items)
+        self.hash_table = {}
+        self.keys = [None] * size
+        self.values = [None] * size
+        for slot, (key, value) in enumerate(items):
+            self.hash_table[key] = slot
+            self.keys[slot] = key
+            self.values[slot] = value
+        self.prev = [size] * (size + 1)
+        self.nxt = [size] * (size + 1)
+        for slot in range(1, n):
+            self.prev[slot] = slot - 1
+            self.nxt[slot - 1] = slot
+        if n:
+            self.nxt[size] = 0
+            self.prev[size] = n - 1
+        self.used = n
+        self.free = []
+
+    def items(self):
+        """
+        (key, value) pairs from the least to the most recently used
+        """
+        res = []
+        slot = self.nxt[self.size]
+        while slot != self.size:
+            res.append((self.keys[slot], self.values[slot]))
+            slot = self.nxt[slot]
+        return res
+
+    def __str__(self):
+        slot = self.nxt[self.size]
+        res = 'HEAD'
+        while slot != self.size:
+            res += ' <-> {}'.format(self.keys[slot])
+            slot = self.nxt[slot]
+        return res
+
+
+def estimate_weight(value):
+    """
+    Approximate size of `value` in bytes
+
+    `sys.getsizeof` of the object plus everything reachable through the
+    builtin containers (dict, list, tuple, set), shared objects are only
+    counted once.
+    """
+    seen = set()
+    pending = [value]
+    total = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+    return total
+
+
+class TimerWheel(object):
+    """
+    Hashed timing wheel
+
+    The time is cut in ticks of `tick` seconds, and a key expiring at time t
+    is put in the bucket `t // tick % slots`. Advancing the wheel visits each
+    bucket whose tick has elapsed once, so every key is looked at once per
+    rotation of the wheel, O(1) amortized for TTLs shorter than
+    `tick * slots`.
+
+    :param float tick: Seconds per bucket
+    :param int slots: Number of buckets
+    :param float now: Current time
+    """
+    def __init__(self, tick, slots, now):
+        self.tick = tick
+        self.slots = slots
+        self.buckets = [{} for _ in range(slots)]
+        self.current = int(now // tick)
+
+    def _bucket(self, expire_at):
+        return self.buckets[int(expire_at // self.tick) % self.slots]
+
+    def schedule(self, key, expire_at):
+        self._bucket(expire_at)[key] = expire_at
+
+    def cancel(self, key, expire_at):
+        self._bucket(expire_at).pop(key, None)
+
+    def advance(self, now, exact=False):
+        """
+        Move the wheel to `now` and return the keys expired so far
+
+        :param bool exact: Also look at the bucket of the running tick, so
+                           no expired key is left behind
+        """
+        target = int(now // self.tick)
+        expired = []
+        steps = min(target - self.current + exact, self.slots)
+        for step in range(steps):
+            bucket = self.buckets[(self.current + step) % self.slots]
+            # Keys of later rotations share the bucket and are kept
+            for key, expire_at in list(bucket.items()):
+                if expire_at <= now:
+                    expired.append(key)
+                    del bucket[key]
+        self.current = max(self.current, target)
+        return expired
+
+
+class WeightedHashLinkedList(PtHashLinkedList):
+    """
+    Pointer version with a weight budget and per-entry TTL
+
+    Eviction drops the least recently used entries until both the number of
+    entries fits `size` and their total weight fits `max_weight`. Expired
+    entries are missed on access (lazy expiry) and also swept by a timer
+    wheel on every write, so the ones never accessed again do not hold
+    memory until they are evicted. `len`, `items` and `dump` sweep the
+    running tick of the wheel too, so they never see an expired entry.
+
+    :param size: Maximum number of entries, `float('inf')` for no limit
+    :param max_weight: Budget for the total weight, None for no limit
+    :param weigher: Function `weigher(key, value)` returning the weight of
+                    an entry, defaults to `estimate_weight(value)`
+    :param float ttl: Default time to live in seconds, None never expires
+    :param float tick: Resolution of the timer wheel in seconds
+    :param int wheel_slots: Number of buckets in the timer wheel
+    :param clock: Function returning the current time in seconds
+    """
+    def __init__(self, size, max_weight=None, weigher=None, ttl=None,
+                 tick=1.0, wheel_slots=512, clock=time.monotonic):
+        super(WeightedHashLinkedList, self).__init__(size)
+        self.max_weight = max_weight
+        self.weigher = weigher or (lambda key, value: estimate_weight(value))
+        self.ttl = ttl
+        self.clock = clock
+        self.wheel = TimerWheel(tick, wheel_slots, clock())
+        self.weight = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, node):
+        return node.expire_at is not None and node.expire_at <= self.clock()
+
+    def _live_node(self, key):
+        # The node of `key`, None when absent or expired, which drops it
+        node = self.hash_table.get(key, None)
+        if node is not None and self._expired(node):
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return node
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __contains__(self, key):
+        node = self.hash_table.get(key, None)
+        return node is not None and not self._expired(node)
+
+    def __len__(self):
+        self.expire(exact=True)
+        return len(self.hash_table)
+
+    def get(self, key, default=None):
+        node = self._live_node(key)
+        if node is None:
+            return default
+        self._refresh_node(node)
+        return node.value
+
+    def pop(self, key, *default):
+        if self._live_node(key) is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return self._remove(key)
+
+    def items(self):
+        self.expire(exact=True)
+        return super(WeightedHashLinkedList, self).items()
+
+    def peek(self, key, default=None):
+        if key not in self:
+            return default
+        return self.hash_table[key].value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, weight=None, ttl=None):
+        """
+        Set `key` to `value`
+
+        :param weight: Weight of the entry, computed by the weigher if None
+        :param ttl: Time to live in seconds, the default ttl if None
+        """
+        if weight is None:
+            weight = self.weigher(key, value)
+        if ttl is None:
+            ttl = self.ttl
+        now = self.clock()
+
+        if key in self.hash_table:
+            self._remove(key)
+
+        if self.max_weight is not None and weight > self.max_weight:
+            # Would flush the whole cache and still not fit
+            return
+
+        node = PtNode(key, None, None, value)
+        node.weight = weight
+        node.expire_at = None if ttl is None else now + ttl
+        self.hash_table[key] = node
+        self._append_node(node)
+        self.weight += weight
+        if node.expire_at is not None:
+            self.wheel.schedule(key, node.expire_at)
+
+        self.expire(now)
+        self._purge_list()
+
+    def _remove(self, key):
+        node = self.hash_table.pop(key)
+        self._unlink_node(node)
+        self.weight -= node.weight
+        if node.expire_at is not None:
+            self.wheel.cancel(key, node.expire_at)
+        return node.value
+
+    def _purge_list(self):
+        while len(self.hash_table) > self.size or (
+                self.max_weight is not None and self.weight > self.max_weight):
+            self._remove(self.head.key)
+            self.evictions += 1
+
+    def _rebuild(self, items):
+        # Weights and expiry are not in the snapshot, set computes them
+        # again and restored entries get the default ttl
+        self.hash_table = {}
+        self.head = None
+        self.tail = None
+        self.weight = 0
+        self.wheel = TimerWheel(self.wheel.tick, self.wheel.slots, self.clock())
+        for key, value in items:
+            self.set(key, value)
+
+    def expire(self, now=None, exact=False):
+        """
+        Sweep the expired entries out of the timer wheel
+
+        :param bool exact: Also the ones of the running tick, writes leave
+                           them to the next sweep
+        :returns: Number of entries removed
+        """
+        expired = self.wheel.advance(self.clock() if now is None else now, exact)
+        for key in expired:
+            # The wheel already forgot the key, do not cancel it again
+            node = self.hash_table.pop(key)
+            self._unlink_node(node)
+            self.weight -= node.weight
+        self.expirations += len(expired)
+        return len(expired)
+
+
+def memoize(size=1024, key=None, cache_cls=ArrayHashLinkedList):
+    """
+    Cache the results of a function in a LRU cache of this module
+
+    The default key is the tuple of the positional arguments (plus the
+    sorted keyword arguments), so nothing is formatted into strings. The
+    decorated function gets `cache_stats()` returning a `CacheStats`,
+    `cache_clear()` and the `cache` itself.
+
+    :param int size: Capacity of the cache
+    :param key: Function of the call arguments returning the cache key
+    :param cache_cls: The LRU class holding the results
+    """
+    def decorator(func):
+        missing = object()
+        # hits, misses, evictions
+        counters = [0, 0, 0]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if key is not None:
+                k = key(*args, **kwargs)
+            elif kwargs:
+                k = args + tuple(sorted(kwargs.items()))
+            else:
+                k = args
+
+            cache = wrapper.cache
+            value = cache.get(k, missing)
+            if value is not missing:
+                counters[0] += 1
+                return value
+
+            counters[1] += 1
+            value = func(*args, **kwargs)
+            # Checked after the call, recursive calls may fill the cache
+            if k not in cache and len(cache) >= cache.size:
+                counters[2] += 1
+            cache[k] = value
+            return value
+
+        def cache_stats():
+            cache = wrapper.cache
+            return CacheStats(counters[0], counters[1], counters[2], len(cache), cache.size)
+
+        def cache_clear():
+            wrapper.cache = cache_cls(size)
+            counters[:] = [0, 0, 0]
+
+        wrapper.cache = cache_cls(size)
+        wrapper.cache_stats = cache_stats
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+
+class OrderedDictLRU(object):
+    """
+    `collections.OrderedDict` version, used as the benchmark baseline
+    """
+    def __init__(self, size):
+        self.size = size
+        self.hash_table = OrderedDict()
+
+    def __getitem__(self, key):
+        try:
+            self.hash_table.move_to_end(key)
+        except KeyError:
+            return None
+        return self.hash_table[key]
+
+    def __setitem__(self, key, value):
+        self.hash_table[key] = value
+        self.hash_table.move_to_end(key)
+        if len(self.hash_table) > self.size:
+            self.hash_table.popitem(last=False)
+
+
+def measure_memory(cls, keys):
+    """
+    Fill a `cls` cache with `keys` and return the traced bytes per entry
+
+    :param cls: The LRU class to measure
+    :param list keys: Keys to insert, also used as the values
+    :returns: Bytes allocated per entry
+    """
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    cache = cls(len(keys))
+    for key in keys:
+        cache[key] = key
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cache
+    return (end - start) / len(keys)
+
+
+def measure_ops(cls, keys, rounds=1):
+    """
+    Measure set and get throughput of a full `cls` cache
+
+    Sets insert twice as many keys as the capacity, so the second half
+    evicts on every call. Gets hit the resident keys in random order.
+
+    :param cls: The LRU class to measure
+    :param list keys: Keys to insert, the capacity is half of them
+    :param int rounds: Number of passes of gets over the resident keys
+    :returns: (set ops/sec, get ops/sec)
+    """
+    cache = cls(len(keys) // 2)
+
+    start = time.perf_counter()
+    for key in keys:
+        cache[key] = key
+    set_elapse = time.perf_counter() - start
+
+    resident = keys[len(keys) // 2:]
+    random.Random(0).shuffle(resident)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for key in resident:
+            cache[key]
+    get_elapse = time.perf_counter() - start
+
+    return len(keys) / set_elapse, rounds * len(resident) / get_elapse
+
+
+def benchmark(entries):
+    """
+    Print memory per entry and ops/sec of all the LRU implementations
+    """
+    implementations = [
+        PtHashLinkedList,
+        HashLinkedList,
+        ArrayHashLinkedList,
+        OrderedDictLRU,
+    ]
+    # Build the keys first, so that they are not counted as cache memory
+    keys = list(range(entries, entries * 3))
+
+    print('{:<20} {:>12} {:>14} {:>14}'.format(
+        'Implementation', 'Bytes/entry', 'Set ops/sec', 'Get ops/sec'))
+    for cls in implementations:
+        memory = measure_memory(cls, keys[:entries])
+        set_ops, get_ops = measure_ops(cls, keys)
+        print('{:<20} {:>12.1f} {:>14,.0f} {:>14,.0f}'.format(
+            cls.__name__, memory, set_ops, get_ops))
+
+
 if __name__ == '__main__':
+    import os
+    import tempfile
     import unittest
 
     class Test(unittest.TestCase):
+        @classmethod
+        def setUpClass(cls):
+            cls.tmpdir = tempfile.TemporaryDirectory()
+
+        @classmethod
+        def tearDownClass(cls):
+            cls.tmpdir.cleanup()
+
         def setUp(self):
             self.hl = HashLinkedList(4)
 
@@ -294,4 +1130,295 @@ if __name__ == '__main__':
             self.assertEqual(self.hl['ee'], 5)
             self.assertEqual(self.hl['ff'], 6)
 
-    unittest.main()
+        def test_update_item(self):
+            self.hl['aa'] = 1
+            self.hl['bb'] = 2
+            self.hl['aa'] = 3
+            self.hl['cc'] = 4
+            self.hl['dd'] = 5
+            self.hl['ee'] = 6
+
+            self.assertIsNone(self.hl['bb'])
+            self.assertEqual(self.hl['aa'], 3)
+            self.assertEqual(len(self.hl), 4)
+
+        def test_update_keeps_size(self):
+            for i in range(100):
+                self.hl['aa'] = i
+            self.assertEqual(len(self.hl), 1)
+            self.assertEqual(self.hl.items(), [('aa', 99)])
+
+        def test_contains_and_len(self):
+            self.hl['aa'] = 1
+            self.hl['bb'] = None
+            self.assertIn('aa', self.hl)
+            self.assertIn('bb', self.hl)
+            self.assertNotIn('cc', self.hl)
+            self.assertEqual(len(self.hl), 2)
+
+        def test_get(self):
+            self.hl['aa'] = None
+            self.assertIsNone(self.hl.get('aa', 1))
+            self.assertEqual(self.hl.get('bb', 1), 1)
+            self.assertIsNone(self.hl.get('bb'))
+
+        def test_del_item(self):
+            self.hl['aa'] = 1
+            self.hl['bb'] = 2
+            self.hl['cc'] = 3
+            del self.hl['bb']
+            self.assertNotIn('bb', self.hl)
+            self.assertEqual(self.hl.items(), [('aa', 1), ('cc', 3)])
+            with self.assertRaises(KeyError):
+                del self.hl['bb']
+
+            del self.hl['aa']
+            del self.hl['cc']
+            self.assertEqual(len(self.hl), 0)
+            self.assertEqual(self.hl.items(), [])
+
+            self.hl['dd'] = 4
+            self.assertEqual(self.hl.items(), [('dd', 4)])
+
+        def test_pop(self):
+            self.hl['aa'] = 1
+            self.assertEqual(self.hl.pop('aa'), 1)
+            self.assertEqual(self.hl.pop('aa', 2), 2)
+            with self.assertRaises(KeyError):
+                self.hl.pop('aa')
+
+        def test_items_recency_order(self):
+            self.hl['aa'] = 1
+            self.hl['bb'] = 2
+            self.hl['cc'] = 3
+            self.hl['aa']
+            self.hl['bb'] = 4
+            self.assertEqual(self.hl.items(), [('cc', 3), ('aa', 1), ('bb', 4)])
+
+        def test_many(self):
+            self.hl.set_many({'aa': 1, 'bb': 2})
+            self.hl.set_many([('cc', 3), ('dd', 4), ('ee', 5)])
+            self.assertEqual(self.hl.get_many(['aa', 'bb', 'ee'], 0), [0, 2, 5])
+            self.assertEqual(len(self.hl), 4)
+
+        def test_eviction_after_delete(self):
+            self.hl.set_many([('aa', 1), ('bb', 2), ('cc', 3), ('dd', 4)])
+            del self.hl['bb']
+            self.hl['ee'] = 5
+            self.hl['ff'] = 6
+            self.assertEqual(
+                [k for k, _ in self.hl.items()], ['cc', 'dd', 'ee', 'ff'])
+
+        def test_peek(self):
+            self.hl['aa'] = 1
+            self.hl['bb'] = 2
+            self.assertEqual(self.hl.peek('aa'), 1)
+            self.assertEqual(self.hl.peek('cc', 3), 3)
+            self.assertEqual(self.hl.items(), [('aa', 1), ('bb', 2)])
+
+        def test_popitem(self):
+            self.hl['aa'] = 1
+            self.hl['bb'] = 2
+            self.hl['aa']
+            self.assertEqual(self.hl.popitem(), ('bb', 2))
+            self.assertEqual(self.hl.popitem(), ('aa', 1))
+            with self.assertRaises(KeyError):
+                self.hl.popitem()
+
+        def test_snapshot(self):
+            path = os.path.join(self.tmpdir.name, 'snapshot')
+            for i in range(10):
+                self.hl[i] = i * i
+            self.hl[7]
+            self.hl.dump(path, chunk_size=3)
+
+            restored = type(self.hl)(4)
+            restored.load(path)
+            self.assertEqual(restored.items(), self.hl.items())
+            self.assertEqual(restored.items(), [(6, 36), (8, 64), (9, 81), (7, 49)])
+
+            restored.load(path, hottest=2)
+            self.assertEqual(restored.items(), [(9, 81), (7, 49)])
+            restored[1] = 1
+            restored[2] = 4
+            restored[3] = 9
+            self.assertEqual(restored.items(), [(7, 49), (1, 1), (2, 4), (3, 9)])
+            del restored[2]
+            restored[0] = 0
+            self.assertEqual(len(restored), 4)
+
+            type(self.hl)(4).dump(path)
+            restored.load(path)
+            self.assertEqual(restored.items(), [])
+            restored['aa'] = 1
+            self.assertEqual(restored.items(), [('aa', 1)])
+
+            with open(path, 'wb') as f:
+                f.write(b'garbage')
+            with self.assertRaises(ValueError):
+                restored.load(path)
+
+    class PtTest(Test):
+        def setUp(self):
+            self.hl = PtHashLinkedList(4)
+
+    class WeightedTest(Test):
+        def setUp(self):
+            self.now = 0
+            self.hl = WeightedHashLinkedList(4, clock=lambda: self.now)
+
+        def test_max_weight(self):
+            hl = WeightedHashLinkedList(float('inf'), max_weight=10, weigher=lambda k, v: v)
+            hl['aa'] = 4
+            hl['bb'] = 4
+            hl['aa']
+            hl['cc'] = 5
+            self.assertEqual(hl.items(), [('aa', 4), ('cc', 5)])
+            self.assertEqual(hl.weight, 9)
+            self.assertEqual(hl.evictions, 1)
+
+            hl['aa'] = 1
+            self.assertEqual(hl.weight, 6)
+
+            # Heavier than the whole budget, dropped without flushing
+            hl['dd'] = 11
+            self.assertNotIn('dd', hl)
+            self.assertEqual(len(hl), 2)
+
+        def test_explicit_weight(self):
+            hl = WeightedHashLinkedList(float('inf'), max_weight=10)
+            hl.set('aa', 'x' * 100, weight=6)
+            hl.set('bb', 'y', weight=6)
+            self.assertEqual(hl.items(), [('bb', 'y')])
+
+        def test_estimate_weight(self):
+            self.assertGreater(estimate_weight(['a' * 100]), estimate_weight(['a']))
+            shared = 'a' * 1000
+            self.assertLess(estimate_weight([shared, shared]), 2 * sys.getsizeof(shared))
+
+        def test_lazy_expiry(self):
+            self.hl.set('aa', 1, ttl=5)
+            self.hl['bb'] = 2
+            self.now = 4
+            self.assertEqual(self.hl['aa'], 1)
+            self.now = 5
+            self.assertIsNone(self.hl['aa'])
+            self.assertNotIn('aa', self.hl)
+            self.assertEqual(self.hl['bb'], 2)
+            self.assertEqual(self.hl.expirations, 1)
+
+        def test_sweep(self):
+            self.hl.set('aa', 1, ttl=2)
+            self.hl.set('bb', 2, ttl=600)
+            self.hl.set('cc', 3, ttl=1000)
+            self.now = 3
+            self.assertEqual(self.hl.expire(), 1)
+            self.assertEqual(len(self.hl), 2)
+
+            # Past a full rotation of the 512 slots wheel
+            self.now = 900
+            self.assertEqual(self.hl.expire(), 1)
+            self.assertEqual(self.hl.items(), [('cc', 3)])
+            # Swept once its tick has elapsed, missed lazily before that
+            self.now = 1000
+            self.assertNotIn('cc', self.hl)
+            self.now = 1001
+            self.hl['dd'] = 4
+            self.assertEqual(self.hl.items(), [('dd', 4)])
+
+        def test_expired_views(self):
+            hl = WeightedHashLinkedList(4, ttl=1.0, clock=lambda: self.now)
+            hl['aa'] = 1
+            hl['bb'] = 2
+            hl.set('cc', 3, ttl=100)
+            # Expired within the tick the wheel is still in
+            self.now = 1.5
+            self.assertNotIn('aa', hl)
+            self.assertIsNone(hl.pop('aa', None))
+            with self.assertRaises(KeyError):
+                hl.pop('bb')
+            self.assertEqual(len(hl), 1)
+            self.assertEqual(hl.items(), [('cc', 3)])
+            self.assertEqual(hl.get_many(['aa', 'cc'], 0), [0, 3])
+            self.assertEqual(hl.pop('cc'), 3)
+            self.assertEqual(hl.weight, 0)
+
+            hl['dd'] = 4
+            self.now = 3
+            self.assertEqual(hl.get_many(['dd']), [None])
+            self.assertEqual(len(hl.hash_table), 0)
+            self.assertEqual(hl.expirations, 3)
+
+        def test_default_ttl(self):
+            hl = WeightedHashLinkedList(4, ttl=10, clock=lambda: self.now)
+            hl['aa'] = 1
+            hl['aa'] = 2
+            self.now = 10
+            self.assertIsNone(hl['aa'])
+            self.assertEqual(len(hl), 0)
+
+    class MemoizeTest(unittest.TestCase):
+        def test_stats(self):
+            @memoize(size=2)
+            def square(x):
+                return x * x
+
+            square(1)
+            square(1)
+            square(2)
+            square(3)
+            self.assertEqual(square(3), 9)
+            self.assertEqual(square.cache_stats(), CacheStats(2, 3, 1, 2, 2))
+
+            square.cache_clear()
+            self.assertEqual(square.cache_stats(), CacheStats(0, 0, 0, 0, 2))
+
+        def test_recursion(self):
+            @memoize(size=100)
+            def fib(n):
+                return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+            self.assertEqual(fib(80), 23416728348467685)
+            self.assertEqual(fib.cache_stats().misses, 81)
+
+        def test_key(self):
+            calls = []
+
+            @memoize(key=lambda seq, scale=1: len(seq))
+            def weight(seq, scale=1):
+                calls.append(seq)
+                return len(seq) * scale
+
+            weight('ab')
+            weight('cd')
+            self.assertEqual(calls, ['ab'])
+
+        def test_kwargs(self):
+            @memoize(cache_cls=PtHashLinkedList)
+            def add(x, y=0):
+                return x + y
+
+            self.assertEqual(add(1, y=2), 3)
+            self.assertEqual(add(1, y=3), 4)
+            self.assertEqual(add(1, y=2), 3)
+            self.assertEqual(add.cache_stats().hits, 1)
+
+    class ArrayTest(Test):
+        def setUp(self):
+            self.hl = ArrayHashLinkedList(4)
+
+        def test_str(self):
+            self.hl['aa'] = 1
+            self.hl['bb'] = 2
+            self.hl['aa']
+            self.assertEqual(str(self.hl), 'HEAD <-> bb <-> aa')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true', help='Compare the LRU implementations')
+    parser.add_argument('--entries', type=int, default=1000000, help='Number of entries for benchmark')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.benchmark:
+        benchmark(args.entries)
+    else:
+        unittest.main(argv=sys.argv[:1])
@@ -29,74 +29,166 @@ q(wi|wi-2, wi-1) = Count(wi-2, wi-1, wi) / Count(wi-2, wi-1)
 
 eg., q(laughs|the, dog) = Count(the, dog, laughs) / Count(the, dog)
 
+The models below multiply raw probabilities, which underflows on long
+sentences. `ngram_model.py` has smoothed models of any order, scoring
+batches of sentences in log space.
+
 Usage example
 ================
 
 ```
 $ python algorithm/ngram.py ./data/corpus/80k.tar.gz
+
+# A directory of text files works as well, the corpus is streamed
+$ python algorithm/ngram.py ./data/chinese-novels
+
+# Approximate counts in count-min sketches, for corpora too large for
+# exact tables
+$ python algorithm/ngram.py ./data/chinese-novels --approximate --epsilon 1e-6
+
+# Simple Good-Turing probabilities instead of the raw counts, the unseen
+# n-grams share N1 / N, see `good_turning_estimate.py`
+$ python algorithm/ngram.py ./data/chinese-novels --good-turing
 ```
 
 Output
 ================
 ```
+$ python algorithm/ngram.py ./data/chinese-novels
+============= Unigram =============
+前天晚上吃晚饭的时候 with probability: 7.001297035928706e-29
+前天晚上吃早饭的时候 with probability: 1.57274487781624e-28
+
+正是一个好看的小猫 with probability: 7.990099717895693e-23
+真是一个好看的小猫 with probability: 3.9011163449898603e-23
+
+我无言以对，简直 with probability: 2.0069493792360348e-29
+我简直无言以对 with probability: 2.104823483782866e-22
+
+============= Bigram =============
+前天晚上吃晚饭的时候 with probability: 3.887942519314912e-20
+前天晚上吃早饭的时候 with probability: 1.598372197589099e-21
+
+正是一个好看的小猫 with probability: 8.580302220719514e-19
+真是一个好看的小猫 with probability: 4.5023731972497e-19
+
+我无言以对，简直 with probability: 3.027074461501039e-20
+我简直无言以对 with probability: 1.6008893112993477e-21
+
+============= Trigram =============
+前天晚上吃晚饭的时候 with probability: 3.7561250704050966e-17
+前天晚上吃早饭的时候 with probability: 3.0062373963012153e-17
+
+正是一个好看的小猫 with probability: 2.58111436003085e-19
+真是一个好看的小猫 with probability: 7.591512823620147e-20
+
+我无言以对，简直 with probability: 3.2252087859251e-12
+我简直无言以对 with probability: 6.450416956802768e-12
+
+# The sketches only overestimate. With the default --epsilon 1e-5 the
+# unigrams and bigrams come out as above, the sparser trigrams are
+# inflated; --epsilon 1e-6 gives back the exact numbers on this corpus
+$ python algorithm/ngram.py ./data/chinese-novels --approximate
+============= Trigram =============
+前天晚上吃晚饭的时候 with probability: 3.94201714558595e-15
+前天晚上吃早饭的时候 with probability: 6.811520328291756e-15
+
+正是一个好看的小猫 with probability: 1.9874580572237548e-17
+真是一个好看的小猫 with probability: 6.1377381178968886e-18
+
+我无言以对，简直 with probability: 5.224838233198665e-09
+我简直无言以对 with probability: 3.870250174081662e-10
+
+$ python algorithm/ngram.py ./data/chinese-novels --good-turing
 ============= Unigram =============
-前天晚上吃晚饭的时候 with probability: 1.4955028266700104e-31
-前天晚上吃早饭的时候 with probability: 1.7401916983572983e-31
+前天晚上吃晚饭的时候 with probability: 7.006729704265628e-29
+前天晚上吃早饭的时候 with probability: 1.5740165770238276e-28
 
-正是一个好看的小猫 with probability: 3.905027711320239e-25
-真是一个好看的小猫 with probability: 1.226996189634442e-25
+正是一个好看的小猫 with probability: 7.99215954319235e-23
+真是一个好看的小猫 with probability: 3.9020649661427483e-23
 
-我无言以对，简直 with probability: 1.4806644228892432e-29
-我简直无言以对 with probability: 4.314094808416538e-22
+我无言以对，简直 with probability: 9.044089748258295e-27
+我简直无言以对 with probability: 2.1031370952251568e-22
 
 ============= Bigram =============
-前天晚上吃晚饭的时候 with probability: 3.830655537670635e-21
-前天晚上吃早饭的时候 with probability: 9.780656732199309e-21
+前天晚上吃晚饭的时候 with probability: 6.220752802578354e-20
+前天晚上吃早饭的时候 with probability: 2.493814379608231e-21
 
-正是一个好看的小猫 with probability: 1.373904336105732e-16
-真是一个好看的小猫 with probability: 2.9521067147550675e-17
+正是一个好看的小猫 with probability: 5.7951922836269895e-21
+真是一个好看的小猫 with probability: 3.0397814829352878e-21
 
-我无言以对，简直 with probability: 8.204354844489807e-20
-我简直无言以对 with probability: 1.7361296679197174e-17
+我无言以对，简直 with probability: 1.775413451414643e-27
+我简直无言以对 with probability: 6.569651524986592e-24
 
 ============= Trigram =============
-前天晚上吃晚饭的时候 with probability: 0.002522635332263671
-前天晚上吃早饭的时候 with probability: 0.0015135811993582026
+前天晚上吃晚饭的时候 with probability: 3.842345037964138e-34
+前天晚上吃早饭的时候 with probability: 1.3098905774895673e-38
 
-正是一个好看的小猫 with probability: 18.387976551092837
-真是一个好看的小猫 with probability: 13.79098241331963
+正是一个好看的小猫 with probability: 6.463547317993329e-30
+真是一个好看的小猫 with probability: 7.99991212291581e-30
 
-我无言以对，简直 with probability: 3.4321564434566185e-08
-我简直无言以对 with probability: 8.237174898870543e-07
+我无言以对，简直 with probability: 4.1513811856023337e-35
+我简直无言以对 with probability: 2.4128506059633217e-33
 ```
 """
 
-import re
 import sys
-import gzip
 import argparse
 from functools import reduce, partial
 from collections import Counter
 
+from corpus import iter_text
+from ngram_count import NgramCounts, SketchCounts, build_counts, build_sketches
+from good_turning_estimate import SimpleGoodTuring
 
-def trim(x):
-    return ''.join(re.findall(r'\w+', x.replace('\\n', '')))
 
+def count_ngrams(corpus, n):
+    """
+    Count the n-grams of `corpus`, the cleaned text as one string or as an
+    iterable of text pieces (e.g. `iter_text`), n-grams across two pieces
+    included
 
-def load_corpus(path):
-    fopen = open
-    if re.search(r'\S(.tar.gz)$', path):
-        fopen = gzip.open
+    The Counter of python strings, `NgramCounts.from_texts` counts the same
+    much faster over numpy arrays.
+    """
+    if isinstance(corpus, str):
+        corpus = [corpus]
+
+    counter = Counter()
+    tail = ''
+    for piece in corpus:
+        text = tail + piece
+        if n == 1:
+            counter.update(text)
+        else:
+            counter.update(text[i:i + n] for i in range(len(text) - n + 1))
+            tail = text[-(n - 1):]
+    return counter
+
+
+def get_probability_wrapper(corpus, count_fn, good_turing=False, unseen=None):
+    """
+    :param bool good_turing: Simple Good-Turing probabilities instead of
+                             the relative frequencies, exact counts only
+    :param int unseen: Number of the n-grams never seen, sharing the unseen
+                       mass under Good-Turing
+    """
+    occurrencies = count_fn(corpus)
+    if good_turing:
+        estimator = SimpleGoodTuring(occurrencies, unseen=unseen)
 
-    with fopen(path, 'r') as f:
-        raw = ''.join(re.findall(r'\w+', f.read().decode('utf-8').replace('\\n', '')))
-        return raw
+        def smoothed(word):
+            return float(estimator.prob(occurrencies.get(word, 0)))
 
+        return smoothed
 
-def get_probability_wrapper(corpus, count_fn):
-    occurrencies = count_fn(corpus)
-    min_value = min(occurrencies.values())
-    total = sum(occurrencies.values())
+    if isinstance(occurrencies, SketchCounts):
+        # Any n-gram seen is estimated at least once
+        min_value = 1
+        total = occurrencies.total
+    else:
+        min_value = min(occurrencies.values())
+        total = sum(occurrencies.values())
 
     def wrapper(word):
         return occurrencies.get(word, min_value) / total
@@ -107,20 +199,20 @@ def get_probability_wrapper(corpus, count_fn):
 # Each word's occurrency probability
 get_one_word_prob = partial(
     get_probability_wrapper,
-    count_fn=lambda corpus: Counter(corpus)
+    count_fn=partial(NgramCounts.from_texts, n=1)
 )
 
 
 # Two conjunction words's occurrency probability
 get_two_words_prob = partial(
     get_probability_wrapper,
-    count_fn=lambda corpus: Counter((corpus[i:i + 2] for i in range(len(corpus) - 1)))
+    count_fn=partial(NgramCounts.from_texts, n=2)
 )
 
 # There conjunction words's occurrency probability
 get_three_words_prob = partial(
     get_probability_wrapper,
-    count_fn=lambda corpus: Counter((corpus[i:i + 3] for i in range(len(corpus) - 2)))
+    count_fn=partial(NgramCounts.from_texts, n=3)
 )
 
 
@@ -153,7 +245,7 @@ def bigram_model(sentence, word_prob_fn, two_words_prob_fn):
     """
     first_word_prob = word_prob_fn(sentence[0])
     prob = first_word_prob
-    for i in range(1, len(sentence) - 1):
+    for i in range(1, len(sentence)):
         prob *= two_words_prob_fn(sentence[i - 1:i + 1]) / word_prob_fn(sentence[i - 1])
     return prob
 
@@ -167,7 +259,7 @@ def trigram_model(sentence, word_prob_fn, two_words_prob_fn, three_words_prob_fn
     first_word_prob = word_prob_fn(sentence[0])
     second_words_prob = two_words_prob_fn(sentence[0:2]) / first_word_prob
     prob = first_word_prob * second_words_prob
-    for i in range(2, len(sentence) - 2):
+    for i in range(2, len(sentence)):
         prob *= three_words_prob_fn(sentence[i - 2:i + 1]) / two_words_prob_fn(sentence[i - 2:i])
     return prob
 
@@ -175,12 +267,28 @@ def trigram_model(sentence, word_prob_fn, two_words_prob_fn, three_words_prob_fn
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('corpus', type=str, help='Corpus file path')
+    parser.add_argument('--processes', type=int, default=None, help='Processes counting the corpus, all cores by default')
+    parser.add_argument('--approximate', action='store_true', help='Count in count-min sketches of a fixed size')
+    parser.add_argument('--epsilon', type=float, default=1e-5, help='Relative error bound of the approximate counts')
+    parser.add_argument('--delta', type=float, default=0.01, help='Probability to exceed the error bound')
+    parser.add_argument('--good-turing', action='store_true', help='Simple Good-Turing probabilities of the exact counts')
     args = parser.parse_args(sys.argv[1:])
+    if args.approximate and args.good_turing:
+        parser.error('--good-turing needs the exact counts, not --approximate')
+
+    # One pass over the corpus for the three orders
+    if args.approximate:
+        counts = build_sketches(iter_text(args.corpus), (1, 2, 3), args.epsilon, args.delta)
+    else:
+        counts = build_counts(iter_text(args.corpus), orders=(1, 2, 3), processes=args.processes)
 
-    corpus = load_corpus(args.corpus)
+    def get_probability(n):
+        # The unseen n-grams over the characters seen
+        unseen = len(counts[1]) ** n - len(counts[n]) if args.good_turing else None
+        return get_probability_wrapper(counts[n], count_fn=lambda c: c, good_turing=args.good_turing, unseen=unseen)
 
     # Unigram
-    get_one_word_probability = get_one_word_prob(corpus)
+    get_one_word_probability = get_probability(1)
     unigram_model_fn = partial(unigram_model, prob_fn=get_one_word_probability)
 
     pair1 = ('前天晚上吃晚饭的时候', '前天晚上吃早饭的时候')
@@ -194,7 +302,7 @@ if __name__ == '__main__':
 
     # Bigram
     print('============= Bigram =============')
-    get_two_words_probability = get_two_words_prob(corpus)
+    get_two_words_probability = get_probability(2)
     bigram_model_fn = partial(
         bigram_model,
         word_prob_fn=get_one_word_probability,
@@ -207,11 +315,11 @@ if __name__ == '__main__':
 
     # Trigram
     print('============= Trigram =============')
-    get_three_words_probability = get_three_words_prob(corpus)
+    get_three_words_probability = get_probability(3)
     trigram_model_fn = partial(
         trigram_model,
         word_prob_fn=get_one_word_probability,
-        two_words_prob_fn=get_one_word_probability,
+        two_words_prob_fn=get_two_words_probability,
         three_words_prob_fn=get_three_words_probability,
     )
 
@@ -0,0 +1,758 @@
+#!/usr/bin/env python3
+
+"""
+============================
+Vectorized n-gram counting
+============================
+
+Counting n-grams with `Counter(corpus[i:i + n] for i in ...)` allocates one
+python string per position of the corpus, which dominates the build time
+of the n-gram model. Here the corpus becomes a numpy array of uint32 code
+points, and every n-gram is packed into one uint64 key, `bits` bits per
+character, the first character in the high bits:
+
+    text     前   天   晚   上
+    codes  0x524d 0x5929 0x665a 0x4e0a
+
+    2-gram keys (bits = 21)
+    前天 = 0x524d << 21 | 0x5929
+    天晚 = 0x5929 << 21 | 0x665a
+    晚上 = 0x665a << 21 | 0x4e0a
+
+Unicode code points need 21 bits, so a key holds up to 3 characters. With
+a vocabulary (the sorted code points of the corpus) characters map to the
+dense ids 1..V instead, 0 standing for the unknown characters, and keys of
+`V.bit_length()` bits per character fit `64 // bits` characters, e.g. 4
+for the ~6000 characters of the novels.
+
+The keys of all positions are built with a few shifts and ors over the
+whole array, then sorted and reduced to (unique keys, counts). Lookups
+search the sorted key array with `np.searchsorted`, for a whole array of
+queries at once.
+
+Sorted keys are in the lexicographic order of the n-grams, so all the
+n-grams sharing the context c (their first n-1 characters) make up the
+contiguous range [c << bits, (c + 1) << bits) of the key array.
+
+Parallel build
+================
+
+`build_counts` counts several orders in a pool of processes. The corpus
+is streamed in shards, every shard carries the last N-1 characters of
+the previous one (N the highest order) so the n-grams across the seam
+are seen:
+
+    shard 1:           [ text 1 ........... ]
+    shard 2:                          [ov][ text 2 ........... ]
+    shard 3:                                               [ov][ text 3 ...
+
+A worker encodes its shard once and counts every order on it. For order
+n it skips the overlap positions whose n-gram was complete in the
+previous shard, so nothing is counted twice and the merged counts are
+the ones of the serial path. The partial tables are summed by key as
+the workers return them, with a bounded number of shards in flight.
+
+Approximate counts
+================
+
+The exact tables of the higher orders grow with the corpus, nearly one
+entry per position. `SketchCounts` keeps the counts of one order in a
+count-min sketch (`count_min_sketch.py`) of a fixed size instead, with
+conservative update. An estimate is never below the true count, and
+over counts by more than ε * N with probability δ, N the number of
+n-grams counted. The n-grams are hashed to 64 bits (a polynomial hash
+of their characters), so any order works.
+
+An optional heavy hitters table keeps the `top_k` n-grams with the
+largest estimates, for `most_common`. On skewed text those estimates are
+close to exact, the error ε * N being small next to their counts.
+
+Usage example
+================
+
+```
+# Run the unit tests
+$ python algorithm/ngram_count.py
+
+# Compare with the Counter of python substrings
+$ python algorithm/ngram_count.py --benchmark ./data/chinese-novels
+
+# Time the parallel build of the 1, 2 and 3-gram counts
+$ python algorithm/ngram_count.py --build ./data/chinese-novels --processes 1 2 4
+
+# Accuracy of the count-min sketch counts against the exact ones
+$ python algorithm/ngram_count.py --sketch ./data/zhwiki --orders 3 5 --epsilon 1e-5 1e-4
+```
+"""
+
+import os
+import sys
+import math
+import time
+import argparse
+from collections import Counter, deque
+from multiprocessing import Pool
+
+import numpy as np
+
+from corpus import iter_text
+from count_min_sketch import CountMinSketch
+
+
+# Bits of an unicode code point
+CODE_BITS = 21
+
+# Multiplier of the polynomial n-gram hash
+HASH_PRIME = 0x100000001b3
+
+
+def encode(text):
+    """
+    Code points of `text` as an uint32 array
+    """
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+
+def decode(codes):
+    """
+    The text of an array of code points
+    """
+    return np.asarray(codes, dtype='<u4').tobytes().decode('utf-32-le')
+
+
+def vocab_bits(vocab):
+    """
+    Bits per character of the ids of `vocab`, 0 included
+    """
+    return max(1, len(vocab).bit_length())
+
+
+def to_ids(codes, vocab):
+    """
+    Map code points to their 1-based index in the sorted `vocab` array,
+    the code points missing from it to 0
+    """
+    codes = np.asarray(codes, dtype=np.uint32)
+    if not len(vocab):
+        return np.zeros(len(codes), dtype=np.uint32)
+    idx = np.minimum(np.searchsorted(vocab, codes), len(vocab) - 1)
+    return np.where(vocab[idx] == codes, idx + 1, 0).astype(np.uint32)
+
+
+def pack(codes, n, bits=CODE_BITS):
+    """
+    Keys of the n-grams starting at every position of `codes`
+
+    :param codes: Array of character codes, each below 2 ** bits
+    :param int n: Order of the n-grams
+    :param int bits: Bits per character in a key
+    :returns: uint64 array of len(codes) - n + 1 keys
+    """
+    if n < 1 or n * bits > 64:
+        raise ValueError('{} characters of {} bits do not fit in 64 bits'.format(n, bits))
+
+    codes = np.asarray(codes, dtype=np.uint64)
+    size = len(codes) - n + 1
+    if size <= 0:
+        return np.empty(0, dtype=np.uint64)
+
+    keys = codes[:size].copy()
+    shift = np.uint64(bits)
+    for j in range(1, n):
+        keys <<= shift
+        keys |= codes[j:j + size]
+    return keys
+
+
+def ngram_hash(codes, n):
+    """
+    64 bit polynomial hash of the n-grams starting at every position of
+    `codes`, for orders whose characters do not fit in a key
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    size = len(codes) - n + 1
+    if size <= 0:
+        return np.empty(0, dtype=np.uint64)
+
+    keys = np.zeros(size, dtype=np.uint64)
+    prime = np.uint64(HASH_PRIME)
+    for j in range(n):
+        keys *= prime
+        keys += codes[j:j + size]
+    return keys
+
+
+def unpack(keys, n, bits=CODE_BITS):
+    """
+    Character codes of `keys`, an array of shape (len(keys), n)
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    mask = np.uint64((1 << bits) - 1)
+    codes = np.empty((len(keys), n), dtype=np.uint32)
+    for j in range(n):
+        codes[:, j] = (keys >> np.uint64(bits * (n - 1 - j))) & mask
+    return codes
+
+
+def pack_rows(codes, bits=CODE_BITS):
+    """
+    Keys of the rows of a (len(keys), n) array of codes, the inverse of
+    `unpack`
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    keys = np.zeros(len(codes), dtype=np.uint64)
+    shift = np.uint64(bits)
+    for j in range(codes.shape[1]):
+        keys <<= shift
+        keys |= codes[:, j]
+    return keys
+
+
+def reduce_counts(keys, counts=None):
+    """
+    Sum the counts of equal keys
+
+    :param keys: uint64 array, in any order
+    :param counts: Counts of `keys`, every key counts once when None
+    :returns: (sorted unique keys, int64 counts)
+    """
+    if counts is None:
+        uniq, counts = np.unique(keys, return_counts=True)
+        return uniq, counts.astype(np.int64)
+
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    counts = np.asarray(counts, dtype=np.int64)[order]
+    if not len(keys):
+        return keys, counts
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+class NgramCounts(object):
+    """
+    Counts of the n-grams of one order in sorted key/count arrays
+
+    It reads like a Counter of n-gram strings (`counts['前天']`, `get`,
+    `values`, `most_common`), `lookup` answers whole arrays of keys.
+
+    :param keys: Sorted unique uint64 keys
+    :param counts: int64 count of every key
+    :param int n: Order of the n-grams
+    :param vocab: Sorted code points the keys are made of ids of, the keys
+                  are made of code points when None
+    """
+    def __init__(self, keys, counts, n, vocab=None):
+        self.keys = keys
+        self.counts = counts
+        self.n = n
+        self.vocab = vocab
+        self.bits = CODE_BITS if vocab is None else vocab_bits(vocab)
+
+    @classmethod
+    def from_codes(cls, codes, n):
+        keys, counts = reduce_counts(pack(codes, n))
+        return cls(keys, counts, n)
+
+    @classmethod
+    def from_text(cls, text, n):
+        return cls.from_codes(encode(text), n)
+
+    @classmethod
+    def from_texts(cls, texts, n):
+        """
+        Count a string or a stream of text pieces (e.g. `iter_text`),
+        n-grams across two pieces included
+        """
+        if isinstance(texts, str):
+            return cls.from_text(texts, n)
+
+        parts = []
+        tail = np.empty(0, dtype=np.uint32)
+        for text in texts:
+            codes = np.concatenate((tail, encode(text)))
+            parts.append(cls.from_codes(codes, n))
+            if n > 1:
+                tail = codes[-(n - 1):]
+            # Keeps the number of partial tables small
+            if len(parts) >= 8:
+                parts = [cls.merge(parts)]
+        if not parts:
+            return cls.from_codes(tail, n)
+        return cls.merge(parts)
+
+    @classmethod
+    def merge(cls, parts):
+        """
+        Sum several count tables of the same order
+        """
+        first = parts[0]
+        if len(parts) == 1:
+            return first
+        keys, counts = reduce_counts(
+            np.concatenate([part.keys for part in parts]),
+            np.concatenate([part.counts for part in parts]))
+        return cls(keys, counts, first.n, first.vocab)
+
+    def codes(self, text):
+        """
+        The code points or ids of `text` the keys are made of
+        """
+        codes = encode(text)
+        return codes if self.vocab is None else to_ids(codes, self.vocab)
+
+    def key(self, ngram):
+        """
+        Key of an n-gram string
+        """
+        return int(pack(self.codes(ngram), self.n, self.bits)[0])
+
+    def lookup(self, keys):
+        """
+        Counts of an array of keys, 0 for the missing ones
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[idx] == keys, self.counts[idx], 0)
+
+    def get(self, ngram, default=None):
+        if len(ngram) != self.n:
+            return default
+        key = np.uint64(self.key(ngram))
+        idx = np.searchsorted(self.keys, key)
+        if idx < len(self.keys) and self.keys[idx] == key:
+            return int(self.counts[idx])
+        return default
+
+    def __getitem__(self, ngram):
+        return self.get(ngram, 0)
+
+    def __contains__(self, ngram):
+        return self.get(ngram) is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def values(self):
+        return self.counts
+
+    def ngrams(self, keys=None):
+        """
+        The n-gram strings of `keys`, all the keys when None
+        """
+        codes = unpack(self.keys if keys is None else keys, self.n, self.bits).ravel()
+        if self.vocab is not None:
+            # Unknown ids come out as U+FFFD
+            codes = np.concatenate(([0xfffd], self.vocab))[codes]
+        text = decode(codes)
+        n = self.n
+        return [text[i:i + n] for i in range(0, len(text), n)]
+
+    def most_common(self, k=None):
+        order = np.argsort(-self.counts, kind='stable')[:k]
+        return list(zip(self.ngrams(self.keys[order]), self.counts[order].tolist()))
+
+    def to_counter(self):
+        return Counter(dict(zip(self.ngrams(), self.counts.tolist())))
+
+
+def count_shard(shard):
+    """
+    Count the n-grams of one shard for every order
+
+    :param shard: (text, overlap, orders, vocab), `overlap` being the end
+                  of the text of the previous shards
+    :returns: {n: (keys, counts)}
+    """
+    text, overlap, orders, vocab = shard
+    codes = encode(overlap + text)
+    bits = CODE_BITS
+    if vocab is not None:
+        codes = to_ids(codes, vocab)
+        bits = vocab_bits(vocab)
+    result = {}
+    for n in orders:
+        # n-grams starting before `skip` ended in the previous shard
+        skip = max(0, len(overlap) - (n - 1))
+        result[n] = reduce_counts(pack(codes[skip:], n, bits))
+    return result
+
+
+def iter_shards(texts, orders, vocab=None):
+    """
+    (text, overlap, orders, vocab) shards of a stream of text pieces
+    """
+    keep = max(orders) - 1
+    overlap = ''
+    for text in texts:
+        yield text, overlap, orders, vocab
+        if keep:
+            overlap = (overlap + text)[-keep:]
+
+
+def build_counts(texts, orders=(1, 2, 3), processes=None, vocab=None):
+    """
+    Count the n-grams of several orders in a pool of processes
+
+    :param texts: The cleaned text, one string or a stream of pieces
+                  (e.g. `iter_text`), a piece is a shard
+    :param orders: Orders to count
+    :param int processes: Size of the pool, all the cores when None, 1
+                          counts in this process
+    :param vocab: Sorted code points, count n-grams of their ids rather
+                  than of code points
+    :returns: {n: NgramCounts}
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    orders = tuple(sorted(set(orders)))
+    parts = {n: [] for n in orders}
+
+    def collect(result):
+        for n, (keys, counts) in result.items():
+            parts[n].append(NgramCounts(keys, counts, n, vocab))
+            if len(parts[n]) >= 8:
+                parts[n] = [NgramCounts.merge(parts[n])]
+
+    shards = iter_shards(texts, orders, vocab)
+    if processes == 1:
+        for shard in shards:
+            collect(count_shard(shard))
+    else:
+        processes = processes or os.cpu_count()
+        with Pool(processes) as pool:
+            # Bounded, so only a few shards of the stream are in memory
+            pending = deque()
+            limit = 2 * processes
+            for shard in shards:
+                pending.append(pool.apply_async(count_shard, (shard,)))
+                if len(pending) >= limit:
+                    collect(pending.popleft().get())
+            while pending:
+                collect(pending.popleft().get())
+
+    empty = np.empty(0, dtype=np.uint64)
+    return {
+        n: NgramCounts.merge(parts[n]) if parts[n] else NgramCounts(empty, np.empty(0, dtype=np.int64), n, vocab)
+        for n in orders
+    }
+
+
+class SketchCounts(object):
+    """
+    Approximate counts of the n-grams of one order in a count-min sketch
+
+    :param int n: Order of the n-grams
+    :param int width: Counters per row of the sketch
+    :param int depth: Rows of the sketch
+    :param int top_k: Size of the heavy hitters table, none when 0
+    """
+    def __init__(self, n, width, depth, top_k=0):
+        self.n = n
+        self.sketch = CountMinSketch(width, depth, max_count=0xffffffff, conservative=True)
+        self.top_k = top_k
+        self.top_keys = np.empty(0, dtype=np.uint64)
+        self.top_ngrams = []
+
+    @classmethod
+    def from_error(cls, n, epsilon, delta, top_k=0):
+        """
+        Sketch over counting by more than `epsilon` * total with
+        probability `delta`
+        """
+        width = int(math.ceil(math.e / epsilon))
+        depth = int(math.ceil(math.log(1 / delta)))
+        return cls(n, width, depth, top_k)
+
+    @classmethod
+    def from_memory(cls, n, nbytes, depth=4, top_k=0):
+        """
+        Sketch of about `nbytes` bytes of counters
+        """
+        return cls(n, max(1, nbytes // (4 * depth)), depth, top_k)
+
+    @classmethod
+    def from_texts(cls, texts, n, epsilon=1e-5, delta=0.01, top_k=0):
+        """
+        Count a string or a stream of text pieces (e.g. `iter_text`)
+        """
+        return build_sketches(texts, (n,), epsilon, delta, top_k)[n]
+
+    @property
+    def nbytes(self):
+        return self.sketch.nbytes
+
+    @property
+    def total(self):
+        return self.sketch.total
+
+    def add_codes(self, codes):
+        """
+        Count the n-grams of an array of code points
+        """
+        keys = ngram_hash(codes, self.n)
+        if not len(keys):
+            return
+        keys, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+        self.sketch.add_many(keys, counts)
+        if self.top_k:
+            self._update_top(keys, starts, codes)
+
+    def _update_top(self, keys, starts, codes):
+        # Estimates of the table went up as well, rank all of them again
+        fresh = ~np.isin(keys, self.top_keys)
+        keys = np.concatenate((self.top_keys, keys[fresh]))
+        ngrams = self.top_ngrams + [None] * int(fresh.sum())
+        estimates = self.sketch.estimate_many(keys)
+        order = np.argsort(-estimates, kind='stable')[:self.top_k]
+
+        # Decode the n-grams of the new heavy hitters only
+        offset = len(self.top_ngrams)
+        fresh_starts = starts[fresh]
+        n = self.n
+        for i in order:
+            if ngrams[i] is None:
+                start = fresh_starts[i - offset]
+                ngrams[i] = decode(codes[start:start + n])
+        self.top_keys = keys[order]
+        self.top_ngrams = [ngrams[i] for i in order]
+
+    def key(self, ngram):
+        return int(ngram_hash(encode(ngram), self.n)[0])
+
+    def lookup(self, keys):
+        """
+        Estimated counts of an array of keys
+        """
+        return self.sketch.estimate_many(keys)
+
+    def get(self, ngram, default=None):
+        if len(ngram) != self.n:
+            return default
+        return self.sketch.estimate(self.key(ngram)) or default
+
+    def __getitem__(self, ngram):
+        return self.get(ngram, 0)
+
+    def __contains__(self, ngram):
+        return self.get(ngram) is not None
+
+    def most_common(self, k=None):
+        """
+        The heavy hitters and their estimates, largest first
+        """
+        estimates = self.sketch.estimate_many(self.top_keys).tolist()
+        return sorted(zip(self.top_ngrams, estimates), key=lambda item: -item[1])[:k]
+
+
+def build_sketches(texts, orders, epsilon=1e-5, delta=0.01, top_k=0):
+    """
+    Count the n-grams of several orders in sketches, in one pass over a
+    string or a stream of text pieces
+
+    :returns: {n: SketchCounts}
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    sketches = {n: SketchCounts.from_error(n, epsilon, delta, top_k) for n in orders}
+    keep = max(orders) - 1
+    tail = np.empty(0, dtype=np.uint32)
+    for text in texts:
+        codes = np.concatenate((tail, encode(text)))
+        for n, sketch in sketches.items():
+            # Like `count_shard`, skip the n-grams of the previous piece
+            sketch.add_codes(codes[max(0, len(tail) - (n - 1)):])
+        if keep:
+            tail = codes[-keep:]
+    return sketches
+
+
+def benchmark_sketch(path, orders, epsilons, delta=0.01, top_k=100):
+    """
+    Compare the sketch estimates with the exact counts of every n-gram
+    """
+    codes = np.concatenate([encode(text) for text in iter_text(path)])
+    print('Corpus: {:,} characters'.format(len(codes)))
+    print('{:<3} {:>8} {:>12} {:>12} {:>8} {:>10} {:>10} {:>10} {:>8}'.format(
+        'n', 'epsilon', 'exact bytes', 'sketch bytes', 'exact %', 'mean err', 'max err', 'top err %', 'top hit'))
+    for n in orders:
+        keys, counts = reduce_counts(ngram_hash(codes, n))
+        # Keys and counts of a sorted array table
+        exact_bytes = keys.nbytes + counts.nbytes
+        true_top = set(keys[np.argsort(-counts, kind='stable')[:top_k]].tolist())
+        for epsilon in epsilons:
+            sketches = build_sketches(iter_text(path), (n,), epsilon, delta, top_k)
+            sketch = sketches[n]
+            errors = sketch.lookup(keys) - counts
+            assert np.all(errors >= 0)
+            top_idx = np.searchsorted(keys, sketch.top_keys)
+            top_errors = errors[top_idx] / counts[top_idx]
+            print('{:<3} {:>8g} {:>12,} {:>12,} {:>8.2f} {:>10.2f} {:>10,} {:>10.4f} {:>8}'.format(
+                n, epsilon, exact_bytes, sketch.nbytes, 100 * np.mean(errors == 0), errors.mean(),
+                int(errors.max()), 100 * top_errors.max(), len(true_top & set(sketch.top_keys.tolist()))))
+
+
+def benchmark_build(path, processes, orders=(1, 2, 3)):
+    """
+    Time `build_counts` with every pool size of `processes`
+    """
+    start = time.perf_counter()
+    serial = {n: NgramCounts.from_texts(iter_text(path), n) for n in orders}
+    print('{:<10} {:>10.3f}s'.format('serial', time.perf_counter() - start))
+    for size in processes:
+        start = time.perf_counter()
+        counts = build_counts(iter_text(path), orders, processes=size)
+        print('{:<10} {:>10.3f}s'.format('{} procs'.format(size), time.perf_counter() - start))
+        for n in orders:
+            assert np.array_equal(counts[n].keys, serial[n].keys)
+            assert np.array_equal(counts[n].counts, serial[n].counts)
+
+
+def benchmark(texts, orders=(1, 2, 3), queries=100000, seed=0):
+    """
+    Time counting and lookups of `Counter` and `NgramCounts`
+    """
+    from ngram import count_ngrams
+
+    text = ''.join(texts)
+    rnd = np.random.RandomState(seed)
+    print('Corpus: {:,} characters'.format(len(text)))
+    print('{:<3} {:>12} {:>12} {:>10} {:>12} {:>12}'.format(
+        'n', 'Counter', 'numpy', 'distinct', 'Counter get', 'searchsorted'))
+    for n in orders:
+        start = time.perf_counter()
+        counter = count_ngrams(text, n)
+        counter_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        counts = NgramCounts.from_text(text, n)
+        numpy_time = time.perf_counter() - start
+        assert len(counts) == len(counter)
+
+        positions = rnd.randint(0, len(text) - n + 1, queries)
+        words = [text[i:i + n] for i in positions]
+        start = time.perf_counter()
+        expected = [counter.get(w, 0) for w in words]
+        get_time = time.perf_counter() - start
+
+        keys = pack(encode(text), n)[positions]
+        start = time.perf_counter()
+        found = counts.lookup(keys)
+        lookup_time = time.perf_counter() - start
+        assert found.tolist() == expected
+
+        print('{:<3} {:>11.3f}s {:>11.3f}s {:>10,} {:>11.3f}s {:>11.3f}s'.format(
+            n, counter_time, numpy_time, len(counts), get_time, lookup_time))
+
+
+if __name__ == '__main__':
+    import unittest
+
+    class Test(unittest.TestCase):
+        text = '前天晚上吃晚饭的时候前天晚上吃早饭的时候abcab'
+
+        def test_pack(self):
+            codes = encode('前天晚上')
+            self.assertEqual(decode(codes), '前天晚上')
+            keys = pack(codes, 2)
+            self.assertEqual(int(keys[0]), ord('前') << 21 | ord('天'))
+            self.assertEqual(unpack(keys, 2).tolist(), [[ord(a), ord(b)] for a, b in ['前天', '天晚', '晚上']])
+            self.assertTrue(np.array_equal(pack_rows(unpack(keys, 2)), keys))
+            self.assertEqual(len(pack(codes, 5, bits=8)), 0)
+            with self.assertRaises(ValueError):
+                pack(codes, 4)
+
+        def test_counts(self):
+            for n in (1, 2, 3):
+                counts = NgramCounts.from_text(self.text, n)
+                expected = Counter(self.text[i:i + n] for i in range(len(self.text) - n + 1))
+                self.assertEqual(counts.to_counter(), expected)
+                self.assertEqual(counts.total, sum(expected.values()))
+                self.assertTrue(np.all(counts.keys[1:] > counts.keys[:-1]))
+            counts = NgramCounts.from_text(self.text, 2)
+            self.assertEqual(counts['前天'], 2)
+            self.assertEqual(counts['天前'], 0)
+            self.assertIsNone(counts.get('前'))
+            self.assertIn('ab', counts)
+            self.assertEqual(NgramCounts.from_text(self.text, 1).most_common(1), [('晚', 3)])
+
+        def test_lookup(self):
+            counts = NgramCounts.from_text(self.text, 2)
+            keys = pack(encode('前天吃饭ab￿￿'), 2)
+            self.assertEqual(counts.lookup(keys).tolist(), [2, 0, 0, 0, 2, 0, 0])
+            self.assertEqual(NgramCounts.from_text('', 2).lookup(keys).tolist(), [0] * 7)
+
+        def test_from_texts(self):
+            pieces = [self.text[i:i + 4] for i in range(0, len(self.text), 4)]
+            for n in (1, 2, 3):
+                self.assertEqual(
+                    NgramCounts.from_texts(iter(pieces), n).to_counter(),
+                    NgramCounts.from_text(self.text, n).to_counter())
+            self.assertEqual(len(NgramCounts.from_texts(iter([]), 2)), 0)
+
+        def test_build_counts(self):
+            # Pieces shorter than the overlap too
+            pieces = ['前', '天晚', '上吃晚饭的时', '候', '前天晚上吃早饭的时候', 'ab', 'c', 'ab']
+            for processes in (1, 2):
+                counts = build_counts(iter(pieces), orders=(3, 1, 2), processes=processes)
+                self.assertEqual(sorted(counts), [1, 2, 3])
+                for n in (1, 2, 3):
+                    self.assertEqual(counts[n].to_counter(), NgramCounts.from_text(self.text, n).to_counter())
+            self.assertEqual(len(build_counts([], processes=1)[2]), 0)
+
+        def test_vocab(self):
+            vocab = NgramCounts.from_text(self.text, 1).keys.astype(np.uint32)
+            self.assertEqual(vocab_bits(vocab), 4)
+            self.assertEqual(to_ids(encode('a前x'), vocab).tolist(), [1, 6, 0])
+            counts = build_counts([self.text], orders=(1, 4), processes=1, vocab=vocab)
+            for n in (1, 4):
+                self.assertEqual(counts[n].bits, 4)
+                self.assertEqual(counts[n].to_counter(), Counter(self.text[i:i + n] for i in range(len(self.text) - n + 1)))
+            self.assertEqual(counts[4]['前天晚上'], 2)
+            self.assertEqual(counts[4].get('前天晚x'), None)
+            self.assertEqual(counts[1].ngrams(np.array([0], dtype=np.uint64)), ['\ufffd'])
+
+        def test_sketch(self):
+            text = self.text * 3 + '前天晚上吃晚饭'
+            pieces = [text[i:i + 5] for i in range(0, len(text), 5)]
+            sketches = build_sketches(iter(pieces), (1, 3, 6), epsilon=0.01, delta=0.01, top_k=3)
+            for n in (1, 3, 6):
+                sketch = sketches[n]
+                expected = Counter(text[i:i + n] for i in range(len(text) - n + 1))
+                self.assertEqual(sketch.total, sum(expected.values()))
+                for ngram, count in expected.items():
+                    self.assertGreaterEqual(sketch[ngram], count)
+                self.assertEqual([count for _, count in sketch.most_common()], [c for _, c in expected.most_common(3)])
+            self.assertEqual(sketches[6]['前天晚上吃晚'], 4)
+            self.assertEqual(sketches[3].most_common(1), [('前天晚', 7)])
+            self.assertIsNone(sketches[3].get('前天'))
+
+            small = SketchCounts.from_memory(2, 1024)
+            self.assertEqual(small.nbytes, 1024)
+            small.add_codes(encode(text))
+            self.assertEqual(small.most_common(), [])
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', type=str, metavar='CORPUS', help='Benchmark against Counter on a corpus')
+    parser.add_argument('--queries', type=int, default=100000, help='Number of lookups')
+    parser.add_argument('--build', type=str, metavar='CORPUS', help='Benchmark the parallel build on a corpus')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4], help='Pool sizes to compare')
+    parser.add_argument('--sketch', type=str, metavar='CORPUS', help='Accuracy of the sketch counts on a corpus')
+    parser.add_argument('--orders', type=int, nargs='+', default=[3, 5], help='Orders of the sketch benchmark')
+    parser.add_argument('--epsilon', type=float, nargs='+', default=[1e-5, 1e-4], help='Error bounds of the sketches')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.benchmark:
+        benchmark(iter_text(args.benchmark), queries=args.queries)
+    elif args.build:
+        benchmark_build(args.build, args.processes)
+    elif args.sketch:
+        benchmark_sketch(args.sketch, args.orders, args.epsilon)
+    else:
+        unittest.main(argv=sys.argv[:1])
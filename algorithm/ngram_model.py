@@ -0,0 +1,974 @@
+#!/usr/bin/env python3
+
+"""
+=================================
+Order-N Kneser-Ney n-gram model
+=================================
+
+Ref: Chen & Goodman, An Empirical Study of Smoothing Techniques for
+Language Modeling, 1998
+
+`ngram.py` hard codes the 1, 2 and 3-gram models and gives unseen n-grams
+the smallest count of their table. This model takes any order N (as long
+as N characters fit in a 64 bit key, see `ngram_count.py`) and smooths
+with interpolated Kneser-Ney:
+
+    p(w|h) = max(a(hw) - D, 0) / Σ a(h•) + γ(h) * p(w|h')
+
+    γ(h) = D * |{w : a(hw) > 0}| / Σ a(h•)
+
+h' is h without its first character. a() are the raw counts at order N
+and the continuation counts below, a(hw) = |{u : uhw seen}|, so a
+character is likely in a short context if it follows many different
+characters, not merely if it is frequent. The discount of every order is
+D = n1 / (n1 + 2 * n2), n1 and n2 the numbers of n-grams with an
+(adjusted) count of 1 and 2. The unigram level interpolates with the
+uniform distribution over the vocabulary plus an unknown character.
+
+Everything is computed once at build time and kept in the backoff form of
+ARPA files, sorted arrays per order:
+
+    order n:  keys[n - 1]      sorted uint64 keys of the seen n-grams
+              logprobs[n - 1]  ln p(w|h) of every n-gram, interpolated
+              logbows[n - 1]   ln γ of every n-gram as a context, 0 if
+                               it never is one
+
+An unseen hw gives 0 to the first term, so
+
+    p(w|h) = p(hw)        if hw was seen
+           = γ(h) p(w|h') otherwise, γ(h) = 1 for an unseen h
+
+and a query is at most N searches for the n-gram plus N - 1 for the
+contexts, whatever the order, instead of dict probes at every order.
+
+Batch scoring
+================
+
+`score_batch` scores many sentences at once in log space, so long ones
+do not underflow. The sentences are joined and mapped to ids in one go,
+then every order is handled for all the positions together: one
+`searchsorted` over the n-gram keys ending at every position, and one over
+their contexts for the positions that back off.
+
+Text generation
+================
+
+`generate` samples texts from the model, one character after the other.
+A context h keeps a Walker alias table over the characters seen after it
+plus one slot for the backoff, of mass γ(h) Σ p(w|h') over the others:
+
+    slot     0      1      2      3        draw a slot i uniformly,
+    probs    1.0    0.6    0.9    0.3      keep it with probability
+    aliases  -      0      0      1        probs[i], else take aliases[i]
+
+so a draw costs two random numbers, whatever the size of the table. The
+backoff slot draws from the table of h' until the character is not one
+seen after h, γ(h) draws on average. The tables are built on first use
+and the hot ones kept in an LRU cache, see `lru.py`.
+
+File format
+================
+
+`save` writes the arrays into one file, each aligned on 64 bytes, the
+probabilities and weights as float32, the raw counts as int64:
+
+    +-------+------------+-------------+-------+------------+---------------+---
+    | magic | header len | JSON header | vocab | keys order | logprobs / .. |
+    |  8 B  |  uint32    | (offsets,   | u32   | 1, u64     | f32, counts   |
+    |       |            |  tail)      |       |            | i64           |
+    +-------+------------+-------------+-------+------------+---------------+---
+
+`load` maps the file and views the arrays in place with `np.frombuffer`,
+so it takes milliseconds whatever the size of the model, pages are only
+read when a lookup touches them, and all the processes of a host loading
+the same file share them through the page cache.
+
+`to_arpa` exports the model in the ARPA text format read by SRILM, KenLM,
+etc, characters being the words, the unknown one `<unk>`. The corpus has no
+sentence boundaries, so there are no `<s>` and `</s>`.
+
+Incremental updates
+================
+
+The model keeps the raw counts of every order next to the keys, and the
+last N - 1 characters of the corpus, both saved with it. `update(text)`
+counts the new text after that tail, so the n-grams across the seam are
+counted once, and merges the counts into the tables:
+
+    corpus ...林冲|教头  +  text 风雪山神庙
+                 `----------------'  the n-grams starting in the tail
+                                     and ending in the text
+
+A new character grows the vocabulary, the old keys are packed again with
+the new ids, which keeps them sorted. The discounts, probabilities and
+backoff weights depend on the counts of the whole corpus, they are not
+touched by `update` but computed again from the merged counts on their
+first use, so many updates in a row only cost the merges, and the model
+is exactly the one a full rebuild on the concatenated corpus gives.
+
+Usage example
+================
+
+```
+# Run the unit tests
+$ python algorithm/ngram_model.py
+
+# Score the sample sentences with a 4-gram model of the novels
+$ python algorithm/ngram_model.py ./data/chinese-novels --order 4
+
+# Time score_batch against scoring one sentence after the other
+$ python algorithm/ngram_model.py ./data/chinese-novels --benchmark 10000
+
+# Build once, then load the saved model
+$ python algorithm/ngram_model.py ./data/chinese-novels --order 4 --save novels.4gram --arpa novels.arpa
+$ python algorithm/ngram_model.py --model novels.4gram
+
+# Sample 10 texts of 30 characters
+$ python algorithm/ngram_model.py --model novels.4gram --generate 10 --max-len 30
+
+# Add one day of news to a saved model
+$ python algorithm/ngram_model.py --model news.3gram --update ./data/news-today.txt --save news.3gram
+```
+"""
+
+import sys
+import json
+import math
+import mmap
+import time
+import random
+import struct
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from lru import PtHashLinkedList
+from corpus import iter_text, load_corpus
+from ngram_count import (
+    NgramCounts, build_counts, encode, to_ids, pack, pack_rows, unpack, vocab_bits, reduce_counts)
+
+
+# First bytes of the files written by `NgramModel.save`
+MODEL_MAGIC = b'NGRAMKN1'
+
+# Arrays of the file start on multiples of it
+ALIGN = 64
+
+
+# Slot of an alias table backing off to the shorter context
+BACKOFF = -1
+
+Scores = namedtuple('Scores', ['logprobs', 'perplexities'])
+
+AliasTable = namedtuple('AliasTable', ['probs', 'aliases', 'words', 'seen'])
+
+
+def _tail(text, order):
+    # The last order - 1 characters, the context of the next n-grams
+    return text[max(0, len(text) - order + 1):]
+
+
+def alias_table(weights):
+    """
+    Walker's alias table of a discrete distribution, by Vose's method
+
+    :param weights: Non negative weights, not all 0
+    :returns: (probs, aliases) lists, see `draw`
+    """
+    size = len(weights)
+    total = float(sum(weights))
+    probs = [w * size / total for w in weights]
+    aliases = list(range(size))
+    small = [i for i, p in enumerate(probs) if p < 1]
+    large = [i for i, p in enumerate(probs) if p >= 1]
+    while small and large:
+        i = small.pop()
+        j = large.pop()
+        # Slot i is topped up with j
+        aliases[i] = j
+        probs[j] -= 1 - probs[i]
+        (small if probs[j] < 1 else large).append(j)
+    # Left over by rounding errors, full already
+    for i in small + large:
+        probs[i] = 1.0
+    return probs, aliases
+
+
+def draw(probs, aliases, rnd):
+    """
+    Index drawn from an alias table in O(1)
+    """
+    i = int(rnd.random() * len(probs))
+    return i if rnd.random() < probs[i] else aliases[i]
+
+
+def discount(adjusted):
+    """
+    Absolute discount estimated from the count of count 1 and 2
+    """
+    n1 = np.count_nonzero(adjusted == 1)
+    n2 = np.count_nonzero(adjusted == 2)
+    if n1 == 0 or n2 == 0:
+        return 0.5
+    return n1 / (n1 + 2 * n2)
+
+
+class NgramModel(object):
+    """
+    Interpolated Kneser-Ney character n-gram model in sorted arrays
+
+    :param vocab: Sorted code points of the vocabulary, character ids are
+                  their 1-based index and 0 is the unknown character
+    :param keys: keys[n - 1] sorted uint64 keys of the n-grams of order n
+    :param logprobs: logprobs[n - 1] ln p(w|h) of every key of order n
+    :param logbows: logbows[n - 1] ln γ of every key of order n as a context
+    :param discounts: Discount of every order
+    :param counts: counts[n - 1] raw count of every key of order n, needed
+                   by `update`, the probabilities are computed from them
+                   when not given
+    :param str tail: The last order - 1 characters of the counted corpus
+    """
+    # Alias tables of the contexts kept for `generate`
+    alias_cache_size = 1 << 16
+
+    # What the ids stand for, saved in the file
+    kind = 'chars'
+
+    def __init__(self, vocab, keys, logprobs=None, logbows=None, discounts=None, counts=None, tail=''):
+        self.keys = keys
+        if logprobs is not None:
+            self.logprobs = logprobs
+            self.logbows = logbows
+            self.discounts = discounts
+        self.counts = counts
+        self.tail = tail
+        self.order = len(keys)
+        self._set_vocab(vocab)
+        self.alias_tables = PtHashLinkedList(self.alias_cache_size)
+
+    def __getattr__(self, name):
+        # Dropped by `update`, computed again on first use
+        if name in ('logprobs', 'logbows', 'discounts'):
+            if self.__dict__.get('counts') is None:
+                raise AttributeError(name)
+            self._smooth()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    @classmethod
+    def build(cls, path, order=3, processes=None):
+        """
+        Build the model of a corpus, read twice: once for the vocabulary,
+        once for the counts of every order
+        """
+        return cls._build(lambda: iter_text(path), order, processes)
+
+    @classmethod
+    def from_text(cls, text, order=3):
+        return cls._build(lambda: [text], order, processes=1)
+
+    @classmethod
+    def _build(cls, make_texts, order, processes):
+        unigrams = NgramCounts.from_texts(make_texts(), 1)
+        vocab = unigrams.keys.astype(np.uint32)
+        if order * vocab_bits(vocab) > 64:
+            raise ValueError('{} characters of {} bits do not fit in 64 bits'.format(order, vocab_bits(vocab)))
+
+        tail = ''
+
+        def texts():
+            nonlocal tail
+            for text in make_texts():
+                tail = _tail(tail + text, order)
+                yield text
+
+        counts = build_counts(texts(), range(1, order + 1), processes=processes, vocab=vocab)
+        return cls.from_counts(counts, vocab, tail)
+
+    @classmethod
+    def from_counts(cls, counts, vocab, tail=''):
+        """
+        Compute the Kneser-Ney probabilities and backoff weights
+
+        :param counts: {n: NgramCounts} of ids of `vocab` for n in 1..N
+        :param vocab: Sorted code points
+        :param str tail: The end of the counted text, for `update`
+        """
+        order = max(counts)
+        if not counts[1].total:
+            raise ValueError('Can not build a model of an empty corpus')
+
+        # Unigrams, all the ids 0..V so the lookup never misses
+        size = len(vocab) + 1
+        unigrams = np.zeros(size, dtype=np.int64)
+        unigrams[counts[1].keys.astype(np.int64)] = counts[1].counts
+        keys = [np.arange(size, dtype=np.uint64)] + [counts[n].keys for n in range(2, order + 1)]
+        model = cls(vocab, keys, counts=[unigrams] + [counts[n].counts for n in range(2, order + 1)], tail=tail)
+        model._smooth()
+        return model
+
+    def _smooth(self):
+        """
+        Discounts, probabilities and backoff weights of the counts
+        """
+        order = self.order
+        bits = self.bits
+
+        # Continuation counts of the orders below N
+        adjusted = {order: self.counts[order - 1]}
+        for n in range(order - 1, 0, -1):
+            suffixes = self.keys[n] & np.uint64((1 << (n * bits)) - 1)
+            suffixes, continuations = reduce_counts(suffixes)
+            adjusted[n] = np.zeros(len(self.keys[n - 1]), dtype=np.int64)
+            adjusted[n][np.searchsorted(self.keys[n - 1], suffixes)] = continuations
+        discounts = [discount(adjusted[n]) for n in range(1, order + 1)]
+
+        # The unknown and unseen characters have a count of 0
+        size = len(self.vocab) + 1
+        a = adjusted[1]
+        d = discounts[0]
+        total = a.sum()
+        probs = d * np.count_nonzero(a) / size / total + np.maximum(a - d, 0) / total
+        keys = [self.keys[0]]
+        logprobs = [np.log(probs)]
+        logbows = [np.zeros(size)]
+
+        for n in range(2, order + 1):
+            ngram_keys = self.keys[n - 1]
+            a = adjusted[n]
+            d = discounts[n - 1]
+
+            # Keys are sorted, so are their contexts
+            contexts = ngram_keys >> np.uint64(bits)
+            starts = np.flatnonzero(np.concatenate(([True], contexts[1:] != contexts[:-1])))
+            lengths = np.diff(np.append(starts, len(contexts)))
+            sums = np.add.reduceat(a, starts) if len(a) else a
+            types = np.add.reduceat((a > 0).astype(np.int64), starts) if len(a) else a
+            with np.errstate(divide='ignore', invalid='ignore'):
+                gammas = np.where(sums > 0, d * types / sums, 1.0)
+                firsts = np.where(sums > 0, 1.0 / sums, 0.0)
+
+            lower = ngram_keys & np.uint64((1 << ((n - 1) * bits)) - 1)
+            lower_probs = np.exp(logprobs[-1][np.searchsorted(keys[-1], lower)])
+            probs = np.maximum(a - d, 0) * np.repeat(firsts, lengths) + np.repeat(gammas, lengths) * lower_probs
+
+            logbows[-1][np.searchsorted(keys[-1], contexts[starts])] = np.log(gammas)
+            keys.append(ngram_keys)
+            logprobs.append(np.log(probs))
+            logbows.append(np.zeros(len(ngram_keys)))
+
+        self.logprobs = logprobs
+        self.logbows = logbows
+        self.discounts = discounts
+
+    def update(self, text):
+        """
+        Add the counts of `text`, the continuation of the counted corpus.
+        The probabilities are computed again on their next use
+
+        :param str text: Cleaned text, see `corpus.py`
+        :return: The model itself
+        """
+        if self.counts is None:
+            raise ValueError('The model has no counts to update')
+        text = self._split(text)
+        if not len(text):
+            return self
+
+        vocab, mapping = self._extend_vocab(text)
+        bits = vocab_bits(vocab)
+        if self.order * bits > 64:
+            raise ValueError('{} symbols of {} bits do not fit in 64 bits'.format(self.order, bits))
+
+        seen = np.flatnonzero(self.counts[0])
+        tables = [(mapping[seen], self.counts[0][seen])]
+        for n in range(2, self.order + 1):
+            keys = self.keys[n - 1]
+            if len(vocab) != len(self.vocab):
+                keys = pack_rows(mapping[unpack(keys, n, self.bits)], bits)
+            tables.append((keys, self.counts[n - 1]))
+
+        self._set_vocab(vocab)
+        ids = self.ids(self.tail + text)
+        keys = [np.arange(len(vocab) + 1, dtype=np.uint64)]
+        counts = [None] * self.order
+        counts[0] = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for n, (old_keys, old_counts) in enumerate(tables, 1):
+            # The n-grams starting before `skip` were counted already
+            skip = max(0, len(self.tail) - (n - 1))
+            new_keys, new_counts = reduce_counts(pack(ids[skip:], n, bits))
+            merged_keys, merged_counts = reduce_counts(
+                np.concatenate([old_keys, new_keys]),
+                np.concatenate([old_counts, new_counts]).astype(np.int64))
+            if n == 1:
+                counts[0][merged_keys.astype(np.int64)] = merged_counts
+            else:
+                keys.append(merged_keys)
+                counts[n - 1] = merged_counts
+
+        self.keys = keys
+        self.counts = counts
+        self.tail = _tail(self.tail + text, self.order)
+        for name in ('logprobs', 'logbows', 'discounts'):
+            self.__dict__.pop(name, None)
+        self.alias_tables = PtHashLinkedList(self.alias_cache_size)
+        return self
+
+    def _set_vocab(self, vocab):
+        self.vocab = vocab
+        self.bits = vocab_bits(vocab)
+
+    def _extend_vocab(self, text):
+        """
+        The vocabulary with the new characters of `text`, and the array
+        mapping the old ids to the new ones
+        """
+        vocab = np.union1d(self.vocab, encode(text)).astype(np.uint32)
+        # Increasing, so the keys stay sorted
+        mapping = np.zeros(len(self.vocab) + 1, dtype=np.uint64)
+        mapping[1:] = np.searchsorted(vocab, self.vocab) + 1
+        return vocab, mapping
+
+    def _split(self, text):
+        # The sequence of symbols of a text
+        return text
+
+    def _join(self, symbols):
+        return ''.join(symbols)
+
+    def _symbols(self):
+        # The symbol of every id
+        return ['<unk>'] + [chr(c) for c in self.vocab]
+
+    def ids(self, text):
+        """
+        Character ids of `text`, 0 for the unknown characters
+        """
+        return to_ids(encode(text), self.vocab)
+
+    def _key(self, ids):
+        key = 0
+        for i in ids:
+            key = key << self.bits | int(i)
+        return key
+
+    def _find(self, n, key):
+        keys = self.keys[n - 1]
+        idx = int(np.searchsorted(keys, np.uint64(key)))
+        if idx < len(keys) and keys[idx] == key:
+            return idx
+        return -1
+
+    def _logprob(self, ids):
+        # ln p(ids[-1] | ids[:-1]), len(ids) <= order
+        backoff = 0.0
+        for n in range(len(ids), 1, -1):
+            idx = self._find(n, self._key(ids[-n:]))
+            if idx >= 0:
+                return backoff + float(self.logprobs[n - 1][idx])
+            idx = self._find(n - 1, self._key(ids[-n:-1]))
+            if idx >= 0:
+                backoff += float(self.logbows[n - 2][idx])
+        return backoff + float(self.logprobs[0][ids[-1]])
+
+    def logprob(self, word, context=''):
+        """
+        ln p(word | context), only the last order - 1 characters of the
+        context matter
+        """
+        context = context[-(self.order - 1):] if self.order > 1 else ''
+        return self._logprob(self.ids(context + word))
+
+    def sentence_logprob(self, sentence):
+        """
+        ln p(sentence), the sum of ln p(c | previous order - 1 characters)
+        """
+        return self._sentence_logprob(self.ids(sentence))
+
+    def _sentence_logprob(self, ids):
+        return sum(self._logprob(ids[max(0, i - self.order + 1):i + 1]) for i in range(len(ids)))
+
+    def perplexity(self, sentence):
+        ids = self.ids(sentence)
+        return math.exp(-self._sentence_logprob(ids) / max(1, len(ids)))
+
+    def save(self, path):
+        """
+        Write the model to `path` in the format `load` maps
+        """
+        arrays = [('vocab', self._vocab_array())]
+        for n in range(1, self.order + 1):
+            arrays.append(('keys{}'.format(n), self.keys[n - 1].astype(np.uint64)))
+            arrays.append(('logprobs{}'.format(n), self.logprobs[n - 1].astype(np.float32)))
+            arrays.append(('logbows{}'.format(n), self.logbows[n - 1].astype(np.float32)))
+            if self.counts is not None:
+                arrays.append(('counts{}'.format(n), self.counts[n - 1].astype(np.int64)))
+
+        # Offsets are relative to the end of the header, its size is not
+        # known until they are in it
+        offsets = []
+        offset = 0
+        for name, array in arrays:
+            offsets.append([name, array.dtype.str, offset, len(array)])
+            offset += -(-array.nbytes // ALIGN) * ALIGN
+        header = json.dumps({
+            'kind': self.kind, 'order': self.order, 'discounts': self.discounts, 'tail': self.tail,
+            'arrays': offsets}).encode('utf-8')
+        start = -(-(len(MODEL_MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+
+        with open(path, 'wb') as f:
+            f.write(MODEL_MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for (name, dtype, offset, length), (_, array) in zip(offsets, arrays):
+                f.write(b'\0' * (start + offset - f.tell()))
+                array.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map a model written by `save`, its arrays are read-only views of
+        the file
+        """
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[:len(MODEL_MAGIC)] != MODEL_MAGIC:
+            raise ValueError('{} is not a n-gram model file'.format(path))
+
+        size, = struct.unpack_from('<I', buf, len(MODEL_MAGIC))
+        header_end = len(MODEL_MAGIC) + 4 + size
+        header = json.loads(buf[len(MODEL_MAGIC) + 4:header_end].decode('utf-8'))
+        if header.get('kind', 'chars') != cls.kind:
+            raise ValueError('{} is a model of {}, not of {}'.format(path, header.get('kind', 'chars'), cls.kind))
+        start = -(-header_end // ALIGN) * ALIGN
+        arrays = {
+            name: np.frombuffer(buf, dtype=dtype, count=length, offset=start + offset)
+            for name, dtype, offset, length in header['arrays']
+        }
+        orders = range(1, header['order'] + 1)
+        return cls(
+            cls._vocab_from_array(arrays['vocab']),
+            [arrays['keys{}'.format(n)] for n in orders],
+            [arrays['logprobs{}'.format(n)] for n in orders],
+            [arrays['logbows{}'.format(n)] for n in orders],
+            header['discounts'],
+            [arrays['counts{}'.format(n)] for n in orders] if 'counts1' in arrays else None,
+            header.get('tail', ''))
+
+    def _vocab_array(self):
+        return self.vocab.astype(np.uint32)
+
+    @staticmethod
+    def _vocab_from_array(array):
+        return array
+
+    def to_arpa(self, path, batch=100000):
+        """
+        Export the model in the ARPA format, log10 probabilities and
+        backoff weights
+        """
+        words = np.array(self._symbols(), dtype=object)
+        scale = 1 / math.log(10)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\\data\\\n')
+            for n in range(1, self.order + 1):
+                f.write('ngram {}={}\n'.format(n, len(self.keys[n - 1])))
+
+            for n in range(1, self.order + 1):
+                f.write('\n\\{}-grams:\n'.format(n))
+                keys = self.keys[n - 1]
+                for lo in range(0, len(keys), batch):
+                    ids = unpack(keys[lo:lo + batch], n, self.bits)
+                    ngrams = words[ids[:, 0]]
+                    for j in range(1, n):
+                        ngrams = ngrams + ' ' + words[ids[:, j]]
+                    logprobs = self.logprobs[n - 1][lo:lo + batch] * scale
+                    logbows = self.logbows[n - 1][lo:lo + batch] * scale
+                    lines = []
+                    for ngram, logprob, logbow in zip(ngrams, logprobs.tolist(), logbows.tolist()):
+                        if logbow:
+                            lines.append('{:.6f}\t{}\t{:.6f}\n'.format(logprob, ngram, logbow))
+                        else:
+                            lines.append('{:.6f}\t{}\n'.format(logprob, ngram))
+                    f.write(''.join(lines))
+            f.write('\n\\end\\\n')
+
+    def _lookup(self, n, keys):
+        # Index of every key in the keys of order n, -1 when missing
+        table = self.keys[n - 1]
+        if not len(table):
+            return np.full(len(keys), -1)
+        idx = np.minimum(np.searchsorted(table, keys), len(table) - 1)
+        return np.where(table[idx] == keys, idx, -1)
+
+    def _ending_keys(self, ids, n):
+        # Key of the n-gram ending at every position, 0 before n - 1
+        keys = np.zeros(len(ids), dtype=np.uint64)
+        keys[n - 1:] = pack(ids, n, self.bits)
+        return keys
+
+    def _join_ids(self, sentences):
+        # Ids of all the sentences in one array, and their lengths
+        lengths = np.array([len(s) for s in sentences], dtype=np.int64)
+        return self.ids(''.join(sentences)), lengths
+
+    def score_batch(self, sentences):
+        """
+        Score many sentences at once
+
+        :param sentences: List of strings
+        :returns: Scores of arrays: ln p of every sentence, and its
+                  perplexity exp(-ln p / length)
+        """
+        ids, lengths = self._join_ids(sentences)
+        starts = np.cumsum(lengths) - lengths
+        # Position of every character in its sentence
+        offsets = np.arange(len(ids)) - np.repeat(starts, lengths)
+
+        logprobs = np.zeros(len(ids))
+        backoff = np.zeros(len(ids))
+        todo = np.ones(len(ids), dtype=bool)
+        ending = {n: self._ending_keys(ids, n) for n in range(1, self.order + 1)}
+        for n in range(self.order, 1, -1):
+            pos = np.flatnonzero(todo & (offsets >= n - 1))
+            idx = self._lookup(n, ending[n][pos])
+            found = idx >= 0
+            logprobs[pos[found]] = backoff[pos[found]] + self.logprobs[n - 1][idx[found]]
+            todo[pos[found]] = False
+
+            pos = pos[~found]
+            idx = self._lookup(n - 1, ending[n - 1][pos - 1])
+            found = idx >= 0
+            backoff[pos[found]] += self.logbows[n - 2][idx[found]]
+
+        pos = np.flatnonzero(todo)
+        logprobs[pos] = backoff[pos] + self.logprobs[0][ids[pos]]
+
+        totals = np.bincount(np.repeat(np.arange(len(sentences)), lengths), weights=logprobs, minlength=len(sentences))
+        return Scores(totals, np.exp(-totals / np.maximum(lengths, 1)))
+
+    def _alias_table(self, context):
+        table = self.alias_tables.get(context)
+        if table is None:
+            table = self._make_alias_table(context)
+            self.alias_tables[context] = table
+        return table
+
+    def _make_alias_table(self, context):
+        n = len(context) + 1
+        if n == 1:
+            probs = np.exp(self.logprobs[0].astype(np.float64)).tolist()
+            # Never the unknown character
+            probs[0] = 0.0
+            words = list(range(len(probs)))
+        else:
+            # The n-grams starting with the context are contiguous
+            mask = (1 << self.bits) - 1
+            first = self._key(context) << self.bits
+            keys = self.keys[n - 1]
+            lo = int(keys.searchsorted(np.uint64(first)))
+            hi = int(keys.searchsorted(np.uint64(first | mask), side='right'))
+            words = (keys[lo:hi] & np.uint64(mask)).tolist()
+            probs = np.exp(self.logprobs[n - 1][lo:hi].astype(np.float64)).tolist()
+            # The mass of the characters not seen after the context, but
+            # the unknown one, none left once all of them were seen
+            backoff = 1.0 - sum(probs) - math.exp(self._logprob(context + (0,)))
+            if backoff > 0 and len(words) < len(self.logprobs[0]) - 1:
+                words.append(BACKOFF)
+                probs.append(backoff)
+        probs, aliases = alias_table(probs)
+        return AliasTable(probs, aliases, words, frozenset(words))
+
+    def _sample(self, context, rnd):
+        # Character id drawn from p(•|context)
+        table = self._alias_table(context)
+        word = table.words[draw(table.probs, table.aliases, rnd)]
+        if word != BACKOFF:
+            return word
+        while True:
+            word = self._sample(context[1:], rnd)
+            if word not in table.seen:
+                return word
+
+    def generate(self, n, max_len, seed=None):
+        """
+        Sample texts from the model. The corpus has no sentence boundaries,
+        so all of them are `max_len` characters long
+
+        :param int n: Number of texts
+        :param int max_len: Characters per text
+        :param seed: Seed of the random generator, for the same texts again
+        :return: List of strings
+        """
+        rnd = random.Random(seed)
+        symbols = self._symbols()
+        keep = self.order - 1
+        texts = []
+        for _ in range(n):
+            ids = []
+            for _ in range(max_len):
+                ids.append(self._sample(tuple(ids[max(0, len(ids) - keep):]), rnd))
+            texts.append(self._join(symbols[i] for i in ids))
+        return texts
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import unittest
+    from collections import Counter
+
+    class Test(unittest.TestCase):
+        text = '前天晚上吃晚饭的时候我们前天晚上吃早饭的时候他们吃晚饭的时候前天'
+
+        def test_normalized(self):
+            for order in (1, 2, 3, 4):
+                model = NgramModel.from_text(self.text, order)
+                self.assertEqual(model.order, order)
+                chars = [chr(c) for c in model.vocab] + ['x']
+                for context in ['', '晚', '前天', '吃晚饭', '吃晚x', 'xx', '们吃早']:
+                    total = sum(math.exp(model.logprob(c, context)) for c in chars)
+                    self.assertAlmostEqual(total, 1.0, msg='{} {}'.format(order, context))
+
+        def test_smoothing(self):
+            model = NgramModel.from_text(self.text, 3)
+            self.assertGreater(model.logprob('饭', '吃晚'), model.logprob('饭', '吃早') - 1e-9)
+            self.assertGreater(model.logprob('晚', '吃'), model.logprob('早', '吃'))
+            self.assertGreater(model.logprob('天', '前'), model.logprob('天', '后'))
+            self.assertLess(model.logprob('x', '前天'), model.logprob('晚', 'x'))
+            self.assertTrue(all(0 < d < 1 for d in model.discounts))
+
+        def test_sentence(self):
+            model = NgramModel.from_text(self.text, 3)
+            self.assertGreater(model.sentence_logprob('前天晚上吃晚饭'), model.sentence_logprob('晚饭前天吃晚上'))
+            self.assertAlmostEqual(
+                model.sentence_logprob('前天晚'),
+                model.logprob('前') + model.logprob('天', '前') + model.logprob('晚', '前天'))
+            self.assertLess(model.perplexity('前天晚上吃晚饭'), model.perplexity('晚饭前天吃晚上'))
+
+        def test_score_batch(self):
+            sentences = ['前天晚上吃晚饭的时候', '', '晚饭前天吃晚上', 'x', '前', '他们吃早饭x的时候前天晚上', '们吃']
+            for order in (1, 2, 3, 4):
+                model = NgramModel.from_text(self.text, order)
+                scores = model.score_batch(sentences)
+                for i, sentence in enumerate(sentences):
+                    self.assertAlmostEqual(scores.logprobs[i], model.sentence_logprob(sentence))
+                    self.assertAlmostEqual(scores.perplexities[i], model.perplexity(sentence))
+            self.assertEqual(len(model.score_batch([]).logprobs), 0)
+
+            # No underflow on long sentences
+            self.assertTrue(np.isfinite(model.score_batch([self.text * 100]).logprobs[0]))
+
+        def test_save_load(self):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'model')
+                model = NgramModel.from_text(self.text, 3)
+                model.save(path)
+                loaded = NgramModel.load(path)
+                self.assertEqual(loaded.order, 3)
+                self.assertEqual(loaded.discounts, model.discounts)
+                self.assertTrue(np.array_equal(loaded.vocab, model.vocab))
+                for n in range(3):
+                    self.assertTrue(np.array_equal(loaded.keys[n], model.keys[n]))
+                    self.assertFalse(loaded.keys[n].flags.writeable)
+                    self.assertEqual(loaded.keys[n].ctypes.data % ALIGN, 0)
+                sentences = ['前天晚上吃晚饭的时候', '晚饭前天吃晚上x']
+                self.assertTrue(np.allclose(loaded.score_batch(sentences).logprobs, model.score_batch(sentences).logprobs))
+                self.assertAlmostEqual(loaded.logprob('饭', '吃晚'), model.logprob('饭', '吃晚'), places=5)
+
+                with open(path, 'wb') as f:
+                    f.write(b'garbage')
+                with self.assertRaises(ValueError):
+                    NgramModel.load(path)
+
+        def test_arpa(self):
+            model = NgramModel.from_text(self.text, 3)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'model.arpa')
+                model.to_arpa(path, batch=7)
+                with open(path, encoding='utf-8') as f:
+                    lines = f.read().split('\n')
+
+            # Query the ARPA entries the way an ARPA reader does
+            probs = {}
+            bows = {}
+            for line in lines:
+                fields = line.split('\t')
+                if len(fields) > 1:
+                    probs[fields[1]] = float(fields[0])
+                    if len(fields) == 3:
+                        bows[fields[1]] = float(fields[2])
+
+            def arpa_logprob(words):
+                ngram = ' '.join(words)
+                if ngram in probs:
+                    return probs[ngram]
+                return bows.get(' '.join(words[:-1]), 0.0) + arpa_logprob(words[1:])
+
+            self.assertEqual(lines[0], '\\data\\')
+            self.assertEqual(lines[1], 'ngram 1={}'.format(len(model.vocab) + 1))
+            self.assertEqual(lines[-2], '\\end\\')
+            self.assertIn('<unk>', probs)
+            for context, word in [('吃晚', '饭'), ('吃早', '晚'), ('晚', '上'), ('们', '前'), ('前x', '天'), ('', 'x')]:
+                words = [c if c in probs else '<unk>' for c in context + word]
+                self.assertAlmostEqual(arpa_logprob(words) * math.log(10), model.logprob(word, context), places=4)
+
+        def assertSameModel(self, model, expected):
+            self.assertEqual(model.order, expected.order)
+            self.assertEqual(model.tail, expected.tail)
+            self.assertTrue(np.array_equal(model.vocab, expected.vocab))
+            self.assertEqual(model.discounts, expected.discounts)
+            for n in range(expected.order):
+                self.assertTrue(np.array_equal(model.keys[n], expected.keys[n]))
+                self.assertTrue(np.array_equal(model.counts[n], expected.counts[n]))
+                self.assertTrue(np.allclose(model.logprobs[n], expected.logprobs[n]))
+                self.assertTrue(np.allclose(model.logbows[n], expected.logbows[n]))
+
+        def test_update(self):
+            new = '林冲吃晚饭的时候风雪山神庙前天'
+            for order in (1, 2, 3, 4):
+                expected = NgramModel.from_text(self.text + new, order)
+                for cut in (1, 5, len(new)):
+                    model = NgramModel.from_text(self.text, order)
+                    # Pieces shorter than the tail, new characters
+                    for i in range(0, len(new), cut):
+                        model.update(new[i:i + cut])
+                    self.assertSameModel(model, expected)
+                    self.assertAlmostEqual(model.logprob('庙', '山神'), expected.logprob('庙', '山神'))
+
+            model = NgramModel.from_text(self.text, 3)
+            self.assertIs(model.update(''), model)
+            self.assertSameModel(model, NgramModel.from_text(self.text, 3))
+            with self.assertRaises(ValueError):
+                NgramModel(model.vocab, model.keys, model.logprobs, model.logbows, model.discounts).update(new)
+
+        def test_update_saved(self):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'model')
+                NgramModel.from_text(self.text, 3).save(path)
+                model = NgramModel.load(path)
+                self.assertEqual(model.tail, '前天')
+                model.update('林冲').update('教头').save(path)
+                model = NgramModel.load(path).update('吃晚饭')
+                self.assertSameModel(model, NgramModel.from_text(self.text + '林冲教头吃晚饭', 3))
+
+        def test_alias_table(self):
+            for weights in [[1], [1, 1], [0.1, 0.6, 0.3], [5, 0, 1, 2, 0, 9], [1e-9, 1, 1e9]]:
+                probs, aliases = alias_table(weights)
+                # Probability of every outcome over the uniform slot choice
+                drawn = [0.0] * len(weights)
+                for i, (p, alias) in enumerate(zip(probs, aliases)):
+                    drawn[i] += p / len(weights)
+                    drawn[alias] += (1 - p) / len(weights)
+                for got, weight in zip(drawn, weights):
+                    self.assertAlmostEqual(got, weight / sum(weights))
+
+        def test_generate(self):
+            model = NgramModel.from_text(self.text, 3)
+            texts = model.generate(5, 12, seed=1)
+            self.assertEqual(len(texts), 5)
+            self.assertTrue(all(len(text) == 12 for text in texts))
+            self.assertTrue(set(''.join(texts)) <= set(self.text))
+            self.assertEqual(model.generate(5, 12, seed=1), texts)
+            self.assertEqual(model.generate(0, 12), [])
+            self.assertEqual([len(text) for text in NgramModel.from_text(self.text, 1).generate(2, 3, seed=0)], [3, 3])
+
+            # The draws follow p(w|h), backoff included
+            rnd = random.Random(0)
+            chars = [chr(c) for c in model.vocab]
+            for context in ['吃晚', '上吃', '候们', '前']:
+                ids = tuple(int(i) for i in model.ids(context))
+                draws = 20000
+                counts = Counter(model._sample(ids, rnd) for _ in range(draws))
+                for i, char in enumerate(chars, 1):
+                    expected = math.exp(model.logprob(char, context))
+                    self.assertAlmostEqual(counts[i] / draws, expected, delta=4 * math.sqrt(expected / draws) + 1e-3)
+
+            # Every character was seen after 'a' and 'b', no backoff slot
+            # to draw from while all of them are rejected
+            texts = NgramModel.from_text('abbaab' * 5, 2).generate(50, 40, seed=0)
+            self.assertEqual(len(texts), 50)
+            self.assertTrue(set(''.join(texts)) <= set('ab'))
+
+            self.assertGreater(len(model.alias_tables), 0)
+            model.update('林冲')
+            self.assertEqual(len(model.alias_tables), 0)
+
+        def test_build(self):
+            with self.assertRaises(ValueError):
+                NgramModel.from_text('', 2)
+            with self.assertRaises(ValueError):
+                NgramModel.from_text(self.text, 17)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', type=str, nargs='?', help='Corpus file path, run the unit tests when missing')
+    parser.add_argument('--order', type=int, default=3, help='Order of the model')
+    parser.add_argument('--processes', type=int, default=None, help='Processes counting the corpus, all cores by default')
+    parser.add_argument('--model', type=str, help='Load the model saved to this file instead of building one')
+    parser.add_argument('--update', type=str, help='Add the counts of this corpus to the model')
+    parser.add_argument('--save', type=str, help='Save the model to this file')
+    parser.add_argument('--arpa', type=str, help='Export the model in ARPA format to this file')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='Time the scoring of N sentences of the corpus')
+    parser.add_argument('--generate', type=int, metavar='N', help='Sample N texts from the model')
+    parser.add_argument('--max-len', type=int, default=30, help='Characters of the sampled texts')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the sampling')
+    args = parser.parse_args(sys.argv[1:])
+
+    if not args.corpus and not args.model:
+        unittest.main(argv=sys.argv[:1])
+        sys.exit()
+    if args.benchmark and not args.corpus:
+        parser.error('--benchmark samples its sentences from the corpus')
+
+    start = time.perf_counter()
+    if args.model:
+        model = NgramModel.load(args.model)
+        print('Loaded in {:.1f}ms'.format((time.perf_counter() - start) * 1000))
+    else:
+        model = NgramModel.build(args.corpus, args.order, args.processes)
+        print('Built in {:.1f}s'.format(time.perf_counter() - start))
+    if args.update:
+        start = time.perf_counter()
+        model.update(load_corpus(args.update))
+        print('Updated in {:.1f}s'.format(time.perf_counter() - start))
+    if args.save:
+        model.save(args.save)
+    if args.arpa:
+        model.to_arpa(args.arpa)
+
+    if args.generate:
+        start = time.perf_counter()
+        texts = model.generate(args.generate, args.max_len, args.seed)
+        elapsed = time.perf_counter() - start
+        for text in texts[:20]:
+            print(text)
+        print('{} characters sampled in {:.3f}s, {} alias tables cached'.format(
+            args.generate * args.max_len, elapsed, len(model.alias_tables)))
+    elif args.benchmark:
+        text = next(iter_text(args.corpus))
+        rnd = np.random.RandomState(0)
+        sentences = [
+            text[i:i + length]
+            for i, length in zip(rnd.randint(0, len(text) - 30, args.benchmark), rnd.randint(5, 30, args.benchmark))
+        ]
+        start = time.perf_counter()
+        expected = [model.sentence_logprob(sentence) for sentence in sentences]
+        print('One by one: {:.3f}s'.format(time.perf_counter() - start))
+        start = time.perf_counter()
+        scores = model.score_batch(sentences)
+        print('Batch:      {:.3f}s'.format(time.perf_counter() - start))
+        assert np.allclose(scores.logprobs, expected)
+    else:
+        pairs = [
+            ('前天晚上吃晚饭的时候', '前天晚上吃早饭的时候'),
+            ('正是一个好看的小猫', '真是一个好看的小猫'),
+            ('我无言以对，简直', '我简直无言以对'),
+        ]
+        sentences = [sentence for pair in pairs for sentence in pair]
+        scores = model.score_batch(sentences)
+        for i, sentence in enumerate(sentences):
+            print('{} with log probability: {:.4f}, perplexity: {:.2f}'.format(
+                sentence, scores.logprobs[i], scores.perplexities[i]))
+            if i % 2:
+                print()
@@ -15,6 +15,8 @@ import argparse
 import functools
 from collections import defaultdict
 
+from lru import memoize
+
 
 def benchmark(func):
     """
@@ -32,23 +34,13 @@ def benchmark(func):
 
 def memo(func):
     """
-    Cache the result for given function
+    Cache the result for given function in a bounded LRU cache,
+    keyed on the argument tuple
     """
-    cache = {}
-
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        key = str(args) + str(kwargs)
-        try:
-            return cache[key]
-        except KeyError:
-            rc = func(*args, **kwargs)
-            cache[key] = rc
-            return rc
-    return wrapper
+    return memoize()(func)
 
 
-def memo_rod_cutting(price_table, cache_size=20):
+def memo_rod_cutting(price_table, cache_size=1024):
     """
     Memorization version of rod cutting
 
@@ -57,8 +49,7 @@ def memo_rod_cutting(price_table, cache_size=20):
     :param int cache_size: The cache size
     :returns: Solutions for the cutting and the optimal revenue
     """
-    @functools.lru_cache(maxsize=cache_size)
-    # @memo
+    @memoize(size=cache_size, key=lambda n: n)
     def wrapper(n):
         if n == 0:
             return 0
@@ -70,7 +61,7 @@ def memo_rod_cutting(price_table, cache_size=20):
     return wrapper
 
 
-def memo_rod_cutting_with_solution(price_table, cache, cache_size=20):
+def memo_rod_cutting_with_solution(price_table, cache, cache_size=1024):
     """
     Memorization version of rod cutting with solution
 
@@ -79,8 +70,7 @@ def memo_rod_cutting_with_solution(price_table, cache, cache_size=20):
     :param int cache_size: The cache size
     :returns: A function to find optimal revenue and solution for rod cutting
     """
-    @functools.lru_cache(maxsize=cache_size)
-    # @memo
+    @memoize(size=cache_size, key=lambda n: n)
     def wrapper(n):
         if n == 0:
             return (0, 0)
@@ -114,17 +104,18 @@ def solutions_builder(cache):
 
 
 @benchmark
-def find_optimal_revenue(price_table, n):
-    cutting = memo_rod_cutting(price_table, n)
+def find_optimal_revenue(price_table, n, cache_size):
+    cutting = memo_rod_cutting(price_table, cache_size)
     print('Rod with length {} optimal cutting revenue is {}'.format(
-        args.length, cutting(args.length))
+        n, cutting(n))
     )
+    print('Cache: {}'.format(cutting.cache_stats()))
 
 
 @benchmark
-def find_optimal_revenue_and_solution(price_table, n):
+def find_optimal_revenue_and_solution(price_table, n, cache_size):
     cache = {}
-    cutting = memo_rod_cutting_with_solution(price_table, cache, n)
+    cutting = memo_rod_cutting_with_solution(price_table, cache, cache_size)
     revenue = cutting(n)
     solutions = solutions_builder(cache)(n)
     print('Rod with length {} optimal cutting solution: {}, revenue: {}'.format(
@@ -132,11 +123,13 @@ def find_optimal_revenue_and_solution(price_table, n):
         ' -> '.join(map(str, solutions)),
         revenue
     ))
+    print('Cache: {}'.format(cutting.cache_stats()))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('length', type=int, help='The length of the rod')
+    parser.add_argument('--cache-size', type=int, default=1024, help='The memorization cache size')
     args = parser.parse_args(sys.argv[1:])
 
     price_table = defaultdict(lambda: -float('inf'))
@@ -145,7 +138,7 @@ if __name__ == '__main__':
     )
 
     # Find the optimal value without solution
-    find_optimal_revenue(price_table, args.length)
+    find_optimal_revenue(price_table, args.length, args.cache_size)
 
     # Find the optimal value and solution path
-    find_optimal_revenue_and_solution(price_table, args.length)
+    find_optimal_revenue_and_solution(price_table, args.length, args.cache_size)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+"""
+=================
+Sharded LRU cache
+=================
+
+The hash linked lists of `lru.py` are not safe to share between threads:
+a get moves nodes around, so two threads interleaving in `_refresh_node`
+corrupt the links. One global lock fixes that but serializes every worker
+on it. Lock striping splits the cache into N independent shards, the hash
+of a key picks its shard and only that shard's lock is taken:
+
+                    hash(key) % N
+                          |
+       +---------+---------+---------+---------+
+       | shard 0 | shard 1 | shard 2 | shard 3 |
+       |  lock 0 |  lock 1 |  lock 2 |  lock 3 |
+       +---------+---------+---------+---------+
+
+Threads working on keys of different shards never wait for each other.
+Every shard is an LRU of its own, so the eviction order is only LRU within
+a shard, which is close to a global LRU as long as keys spread evenly.
+
+The capacity is split evenly across shards, the first `size % N` shards
+holding one entry more, so the shards add up to `size` exactly. A cache
+smaller than N entries gets `size` shards of one entry. Hit/miss/eviction
+counters are kept per shard under its lock and summed up by `stats()`.
+
+Note that on CPython with the GIL, pure python code does not run in
+parallel anyway, there sharding mostly saves the lock hand-offs between
+threads. The benchmark shows the scaling you get on the interpreter it
+runs on.
+
+Usage example
+================
+
+```
+# Run the unit tests
+$ python algorithm/sharded_lru.py
+
+# Throughput of 8 threads with 1, 2, 4, 8 and 16 shards
+$ python algorithm/sharded_lru.py --benchmark --threads 8 --shards 1 2 4 8 16
+```
+"""
+
+import sys
+import time
+import random
+import argparse
+import threading
+
+from lru import HashLinkedList, CacheStats
+from cache_policy import zipf_trace
+
+
+class ShardedHashLinkedList(object):
+    """
+    Thread-safe LRU cache made of `shards` locked HashLinkedList shards
+
+    :param int size: Total capacity, split evenly across the shards
+    :param int shards: Number of shards, at most `size`
+    """
+    def __init__(self, size, shards=16):
+        if shards < 1:
+            raise ValueError('shards must be positive, got {}'.format(shards))
+        if size < 1:
+            raise ValueError('size must be positive, got {}'.format(size))
+
+        shards = min(shards, size)
+        base, extra = divmod(size, shards)
+        self.shards = [HashLinkedList(base + (i < extra)) for i in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.hits = [0] * shards
+        self.misses = [0] * shards
+        self.evictions = [0] * shards
+
+    @property
+    def size(self):
+        return sum(shard.size for shard in self.shards)
+
+    def _shard(self, key):
+        return hash(key) % len(self.shards)
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def get(self, key, default=None):
+        """
+        Get the value of `key` and mark it as recently used in its shard
+        """
+        idx = self._shard(key)
+        shard = self.shards[idx]
+        with self.locks[idx]:
+            if key not in shard:
+                self.misses[idx] += 1
+                return default
+            self.hits[idx] += 1
+            return shard[key]
+
+    def __setitem__(self, key, value):
+        idx = self._shard(key)
+        shard = self.shards[idx]
+        with self.locks[idx]:
+            if key not in shard and len(shard) >= shard.size:
+                self.evictions[idx] += 1
+            shard[key] = value
+
+    def __delitem__(self, key):
+        idx = self._shard(key)
+        with self.locks[idx]:
+            del self.shards[idx][key]
+
+    def pop(self, key, *default):
+        idx = self._shard(key)
+        with self.locks[idx]:
+            return self.shards[idx].pop(key, *default)
+
+    def __contains__(self, key):
+        idx = self._shard(key)
+        with self.locks[idx]:
+            return key in self.shards[idx]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def stats(self):
+        """
+        Counters summed over all the shards
+
+        Every shard is read under its own lock, so the total is not an
+        atomic snapshot of the whole cache while other threads write.
+        """
+        hits = misses = evictions = size = 0
+        for idx, shard in enumerate(self.shards):
+            with self.locks[idx]:
+                hits += self.hits[idx]
+                misses += self.misses[idx]
+                evictions += self.evictions[idx]
+                size += len(shard)
+        return CacheStats(hits, misses, evictions, size, self.size)
+
+
+def worker(cache, trace, barrier):
+    """
+    Read-through loop of one benchmark thread
+    """
+    missing = object()
+    barrier.wait()
+    for key in trace:
+        if cache.get(key, missing) is missing:
+            cache[key] = key
+
+
+def benchmark(size, shards, threads, length, keys):
+    """
+    Run `threads` workers on one cache and return (ops/sec, stats)
+    """
+    cache = ShardedHashLinkedList(size, shards)
+    traces = [zipf_trace(keys, length, seed=i) for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+    pool = [
+        threading.Thread(target=worker, args=(cache, trace, barrier))
+        for trace in traces
+    ]
+    for t in pool:
+        t.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for t in pool:
+        t.join()
+    elapse = time.perf_counter() - start
+    return threads * length / elapse, cache.stats()
+
+
+if __name__ == '__main__':
+    import unittest
+
+    class Test(unittest.TestCase):
+        def setUp(self):
+            self.cache = ShardedHashLinkedList(8, 4)
+
+        def test_get_set(self):
+            self.assertIsNone(self.cache['aa'])
+            self.cache['aa'] = 1
+            self.assertEqual(self.cache['aa'], 1)
+            self.assertIn('aa', self.cache)
+            self.assertEqual(self.cache.pop('aa'), 1)
+            self.assertNotIn('aa', self.cache)
+
+        def test_capacity(self):
+            for i in range(100):
+                self.cache[i] = i
+            self.assertEqual(len(self.cache), 8)
+            self.assertEqual(self.cache.stats().evictions, 92)
+
+        def test_uneven_capacity(self):
+            for size, shards in [(10, 16), (1, 16), (10, 4), (17, 16)]:
+                cache = ShardedHashLinkedList(size, shards)
+                self.assertEqual(cache.size, size)
+                self.assertEqual(len(cache.shards), min(size, shards))
+                self.assertLessEqual(max(s.size for s in cache.shards) - min(s.size for s in cache.shards), 1)
+                for i in range(100):
+                    cache[i] = i
+                self.assertLessEqual(len(cache), size)
+            with self.assertRaises(ValueError):
+                ShardedHashLinkedList(0)
+
+        def test_stats(self):
+            self.cache['aa'] = 1
+            self.cache['aa']
+            self.cache['bb']
+            self.assertEqual(self.cache.stats(), CacheStats(1, 1, 0, 1, 8))
+
+        def test_threads(self):
+            cache = ShardedHashLinkedList(100, 4)
+            rnd = random.Random(0)
+            trace = [rnd.randrange(500) for _ in range(5000)]
+            barrier = threading.Barrier(5)
+            pool = [threading.Thread(target=worker, args=(cache, trace, barrier)) for _ in range(4)]
+            for t in pool:
+                t.start()
+            barrier.wait()
+            for t in pool:
+                t.join()
+
+            stats = cache.stats()
+            self.assertEqual(stats.hits + stats.misses, 4 * 5000)
+            for shard in cache.shards:
+                self.assertEqual(len(shard.items()), len(shard))
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true', help='Run the multi-threaded benchmark')
+    parser.add_argument('--size', type=int, default=10000, help='Total cache size')
+    parser.add_argument('--threads', type=int, default=8, help='Number of worker threads')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='Shard counts to compare')
+    parser.add_argument('--length', type=int, default=100000, help='Accesses per thread')
+    parser.add_argument('--keys', type=int, default=100000, help='Distinct keys')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.benchmark:
+        print('{:<8} {:>14} {:>10}'.format('Shards', 'Ops/sec', 'Hit ratio'))
+        for shards in args.shards:
+            ops, stats = benchmark(args.size, shards, args.threads, args.length, args.keys)
+            print('{:<8} {:>14,.0f} {:>10.4f}'.format(
+                shards, ops, stats.hits / (stats.hits + stats.misses)))
+    else:
+        unittest.main(argv=sys.argv[:1])
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+
+"""
+=======================
+Shared memory LRU cache
+=======================
+
+Tokenization jobs fan out over worker processes, and every worker warming
+up a private cache computes the same entries again. This LRU keeps its
+whole state in one `multiprocessing.shared_memory` block, so all the
+processes of a host attach to the same warm cache.
+
+Nothing in the block may be a python object, so keys and values are bytes
+of at most `key_size` and `value_size` bytes (pickle the values if need
+be), every entry owns a fixed size slot, and the links are slot numbers:
+
++--------+-------------+-------------+-----------+--------+---------+------+--------+
+| header | prev        | nxt         | index     | hashes | lengths | keys | values |
+|        | (cap+1) i32 | (cap+1) i32 | table i32 | cap u64| 2cap i32|      |        |
++--------+-------------+-------------+-----------+--------+---------+------+--------+
+
+- prev/nxt: the recency list of `ArrayHashLinkedList` in `lru.py`, slot
+  `capacity` being the sentinel of the ring.
+- index: open addressing hash table with linear probing, it maps a key to
+  its slot and -1 marks an empty bucket. Deletion shifts the following
+  entries of the probe sequence back, so no tombstones are needed.
+- hashes: the 64 bit hash of the key of each slot, a blake2b digest rather
+  than `hash()`, which is salted differently in every process.
+
+The header also holds the hit/miss/eviction counters, shared by all the
+processes.
+
+Process-safe locking uses `fcntl.flock` on a lock file named after the
+block, so unrelated processes attaching by name exclude each other as
+well as the children of the creator. A thread lock is taken first, since
+flock does not exclude threads sharing one file descriptor.
+
+Before python 3.13 an attaching process registers the block with its
+resource tracker, which destroys it when that process exits. Workers
+forked from the creator share its tracker and are fine, unrelated
+processes should run on 3.13 or later.
+
+Usage example
+================
+
+```
+# In the parent
+cache = SharedLRU.create('tokens', capacity=100000, key_size=64, value_size=1024)
+
+# In the workers, a SharedLRU also pickles as a reference to the block
+cache = SharedLRU.attach('tokens')
+tokens = cache.get(sentence.encode('utf-8'))
+
+# In the parent when all the workers are done
+cache.close()
+cache.unlink()
+```
+"""
+
+import os
+import sys
+import fcntl
+import hashlib
+import tempfile
+import threading
+from array import array
+from multiprocessing import shared_memory
+
+from lru import CacheStats
+
+
+MAGIC = 0x4c52555348
+HEADER_FIELDS = 16
+(F_MAGIC, F_CAPACITY, F_KEY_SIZE, F_VALUE_SIZE, F_TABLE_SIZE, F_USED,
+ F_FREE, F_COUNT, F_HITS, F_MISSES, F_EVICTIONS) = range(11)
+EMPTY = -1
+
+
+def stable_hash(key):
+    """
+    64 bit hash of `key` bytes which is the same in every process
+    """
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+class FileLock(object):
+    """
+    Inter-process lock with `fcntl.flock` on `path`
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SharedLRU(object):
+    """
+    LRU cache of bytes living in a shared memory block
+
+    Use `SharedLRU.create` in one process and `SharedLRU.attach` in the
+    others rather than this constructor.
+    """
+    def __init__(self, shm):
+        self.shm = shm
+        header = shm.buf[:HEADER_FIELDS * 8].cast('q')
+        if header[F_MAGIC] != MAGIC:
+            header.release()
+            raise ValueError('{} is not a shared LRU block'.format(shm.name))
+
+        self.header = header
+        self.capacity = header[F_CAPACITY]
+        self.key_size = header[F_KEY_SIZE]
+        self.value_size = header[F_VALUE_SIZE]
+        self.table_size = header[F_TABLE_SIZE]
+        self.mask = self.table_size - 1
+        self.lock = FileLock(os.path.join(tempfile.gettempdir(), shm.name.lstrip('/') + '.lock'))
+        self._map_arrays()
+
+    @staticmethod
+    def _layout(capacity, key_size, value_size, table_size):
+        offsets = {}
+        offset = HEADER_FIELDS * 8
+        for name, nbytes in [
+                ('prev', 4 * (capacity + 1)),
+                ('nxt', 4 * (capacity + 1)),
+                ('index', 4 * table_size),
+                ('hashes', 8 * capacity),
+                ('key_len', 4 * capacity),
+                ('value_len', 4 * capacity),
+                ('keys', key_size * capacity),
+                ('values', value_size * capacity)]:
+            offset = _align(offset)
+            offsets[name] = (offset, offset + nbytes)
+            offset += nbytes
+        return offsets, offset
+
+    def _map_arrays(self):
+        offsets, _ = self._layout(self.capacity, self.key_size, self.value_size, self.table_size)
+        buf = self.shm.buf
+        typecodes = {'prev': 'i', 'nxt': 'i', 'index': 'i', 'hashes': 'Q', 'key_len': 'i', 'value_len': 'i'}
+        for name, (start, end) in offsets.items():
+            view = buf[start:end]
+            setattr(self, name, view.cast(typecodes[name]) if name in typecodes else view)
+
+    @classmethod
+    def create(cls, name, capacity, key_size, value_size):
+        """
+        Create a new shared block
+
+        :param str name: Name the other processes attach with
+        :param int capacity: Number of entries
+        :param int key_size: Maximum key length in bytes
+        :param int value_size: Maximum value length in bytes
+        """
+        if capacity < 1:
+            raise ValueError('capacity must be positive, got {}'.format(capacity))
+
+        table_size = 1
+        while table_size < 2 * capacity:
+            table_size <<= 1
+        _, total = cls._layout(capacity, key_size, value_size, table_size)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+
+        header = shm.buf[:HEADER_FIELDS * 8].cast('q')
+        for field, value in [
+                (F_CAPACITY, capacity), (F_KEY_SIZE, key_size),
+                (F_VALUE_SIZE, value_size), (F_TABLE_SIZE, table_size),
+                (F_USED, 0), (F_FREE, EMPTY), (F_COUNT, 0)]:
+            header[field] = value
+        header[F_MAGIC] = MAGIC
+        header.release()
+
+        cache = cls(shm)
+        cache.prev[capacity] = capacity
+        cache.nxt[capacity] = capacity
+        cache.index[:] = array('i', [EMPTY]) * table_size
+        return cache
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to the block created under `name` by another process
+        """
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm)
+
+    def __reduce__(self):
+        return (SharedLRU.attach, (self.shm.name,))
+
+    def _key(self, key):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        if len(key) > self.key_size:
+            raise ValueError('key of {} bytes exceeds key_size {}'.format(len(key), self.key_size))
+        return key
+
+    def _slot_key(self, slot):
+        start = slot * self.key_size
+        return self.keys[start:start + self.key_len[slot]]
+
+    def _find(self, key, h):
+        """
+        Return (bucket, slot) of `key`, slot is EMPTY and bucket the empty
+        bucket to use when the key is absent
+        """
+        index = self.index
+        hashes = self.hashes
+        bucket = h & self.mask
+        while True:
+            slot = index[bucket]
+            if slot == EMPTY:
+                return bucket, EMPTY
+            if hashes[slot] == h and self._slot_key(slot) == key:
+                return bucket, slot
+            bucket = (bucket + 1) & self.mask
+
+    def _unindex(self, bucket):
+        # Backward shift deletion of linear probing
+        index = self.index
+        hashes = self.hashes
+        mask = self.mask
+        index[bucket] = EMPTY
+        hole = bucket
+        probe = bucket
+        while True:
+            probe = (probe + 1) & mask
+            slot = index[probe]
+            if slot == EMPTY:
+                return
+            home = hashes[slot] & mask
+            # Leave the entry if its home lies cyclically in (hole, probe]
+            if hole <= probe:
+                if hole < home <= probe:
+                    continue
+            elif home > hole or home <= probe:
+                continue
+            index[hole] = slot
+            index[probe] = EMPTY
+            hole = probe
+
+    def _unlink(self, slot):
+        prev_slot = self.prev[slot]
+        nxt_slot = self.nxt[slot]
+        self.nxt[prev_slot] = nxt_slot
+        self.prev[nxt_slot] = prev_slot
+
+    def _append(self, slot):
+        sentinel = self.capacity
+        tail = self.prev[sentinel]
+        self.prev[slot] = tail
+        self.nxt[slot] = sentinel
+        self.nxt[tail] = slot
+        self.prev[sentinel] = slot
+
+    def _refresh(self, slot):
+        if self.prev[self.capacity] != slot:
+            self._unlink(slot)
+            self._append(slot)
+
+    def _write_value(self, slot, value):
+        if len(value) > self.value_size:
+            raise ValueError('value of {} bytes exceeds value_size {}'.format(len(value), self.value_size))
+        start = slot * self.value_size
+        self.values[start:start + len(value)] = value
+        self.value_len[slot] = len(value)
+
+    def get(self, key, default=None):
+        """
+        Get the value bytes of `key` and mark it as recently used
+        """
+        key = self._key(key)
+        h = stable_hash(key)
+        with self.lock:
+            _, slot = self._find(key, h)
+            if slot == EMPTY:
+                self.header[F_MISSES] += 1
+                return default
+
+            self.header[F_HITS] += 1
+            self._refresh(slot)
+            start = slot * self.value_size
+            return bytes(self.values[start:start + self.value_len[slot]])
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        key = self._key(key)
+        if len(value) > self.value_size:
+            raise ValueError('value of {} bytes exceeds value_size {}'.format(len(value), self.value_size))
+        h = stable_hash(key)
+        header = self.header
+        with self.lock:
+            bucket, slot = self._find(key, h)
+            if slot != EMPTY:
+                self._write_value(slot, value)
+                self._refresh(slot)
+                return
+
+            if header[F_FREE] != EMPTY:
+                slot = header[F_FREE]
+                header[F_FREE] = self.nxt[slot]
+            elif header[F_USED] < self.capacity:
+                slot = header[F_USED]
+                header[F_USED] += 1
+            else:
+                # Evict the head slot and reuse it
+                slot = self.nxt[self.capacity]
+                old_bucket, _ = self._find(bytes(self._slot_key(slot)), self.hashes[slot])
+                self._unindex(old_bucket)
+                self._unlink(slot)
+                header[F_COUNT] -= 1
+                header[F_EVICTIONS] += 1
+                # The shift may have moved the empty bucket of the new key
+                bucket, _ = self._find(key, h)
+
+            start = slot * self.key_size
+            self.keys[start:start + len(key)] = key
+            self.key_len[slot] = len(key)
+            self.hashes[slot] = h
+            self._write_value(slot, value)
+            self.index[bucket] = slot
+            self._append(slot)
+            header[F_COUNT] += 1
+
+    def __delitem__(self, key):
+        key = self._key(key)
+        with self.lock:
+            bucket, slot = self._find(key, stable_hash(key))
+            if slot == EMPTY:
+                raise KeyError(key)
+            self._unindex(bucket)
+            self._unlink(slot)
+            self.nxt[slot] = self.header[F_FREE]
+            self.header[F_FREE] = slot
+            self.header[F_COUNT] -= 1
+
+    def __contains__(self, key):
+        key = self._key(key)
+        with self.lock:
+            return self._find(key, stable_hash(key))[1] != EMPTY
+
+    def __len__(self):
+        return self.header[F_COUNT]
+
+    def items(self):
+        """
+        (key, value) bytes pairs from the least to the most recently used
+        """
+        res = []
+        with self.lock:
+            slot = self.nxt[self.capacity]
+            while slot != self.capacity:
+                start = slot * self.value_size
+                res.append((bytes(self._slot_key(slot)), bytes(self.values[start:start + self.value_len[slot]])))
+                slot = self.nxt[slot]
+        return res
+
+    def stats(self):
+        header = self.header
+        return CacheStats(header[F_HITS], header[F_MISSES], header[F_EVICTIONS], header[F_COUNT], self.capacity)
+
+    def close(self):
+        """
+        Detach from the block, every process has to call it
+        """
+        for name in ['header', 'prev', 'nxt', 'index', 'hashes', 'key_len', 'value_len', 'keys', 'values']:
+            getattr(self, name).release()
+        self.lock.close()
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Destroy the block, called once by the creator after everyone closed
+        """
+        self.shm.unlink()
+        try:
+            os.unlink(self.lock.path)
+        except FileNotFoundError:
+            pass
+
+
+def _worker_fill(cache, start, end):
+    for i in range(start, end):
+        key = 'key-{}'.format(i)
+        if cache.get(key) is None:
+            cache[key] = str(i * i).encode('utf-8')
+    stats = cache.stats()
+    cache.close()
+    return stats
+
+
+if __name__ == '__main__':
+    import random
+    import unittest
+    from multiprocessing import Pool
+
+    class Test(unittest.TestCase):
+        def setUp(self):
+            self.name = 'shared_lru_test_{}'.format(os.getpid())
+            self.cache = SharedLRU.create(self.name, 4, key_size=16, value_size=16)
+
+        def tearDown(self):
+            self.cache.close()
+            self.cache.unlink()
+
+        def test_get_set(self):
+            self.assertIsNone(self.cache['aa'])
+            self.cache['aa'] = b'1'
+            self.assertEqual(self.cache['aa'], b'1')
+            self.cache['aa'] = b'22'
+            self.assertEqual(self.cache['aa'], b'22')
+            self.assertEqual(len(self.cache), 1)
+
+        def test_eviction(self):
+            for key in ['aa', 'bb', 'cc', 'dd']:
+                self.cache[key] = key.encode('utf-8')
+            self.cache['aa']
+            self.cache['ee'] = b'5'
+            self.assertNotIn('bb', self.cache)
+            self.assertEqual([k for k, _ in self.cache.items()], [b'cc', b'dd', b'aa', b'ee'])
+            self.assertEqual(self.cache.stats(), CacheStats(1, 0, 1, 4, 4))
+
+        def test_delete(self):
+            self.cache['aa'] = b'1'
+            self.cache['bb'] = b'2'
+            del self.cache['aa']
+            self.assertNotIn('aa', self.cache)
+            with self.assertRaises(KeyError):
+                del self.cache['aa']
+            for key in ['cc', 'dd', 'ee']:
+                self.cache[key] = b'x'
+            self.assertEqual(len(self.cache), 4)
+
+        def test_limits(self):
+            with self.assertRaises(ValueError):
+                self.cache['a' * 17] = b'1'
+            with self.assertRaises(ValueError):
+                self.cache['aa'] = b'1' * 17
+
+        def test_against_dict(self):
+            cache = SharedLRU.create(self.name + '_ref', 50, key_size=8, value_size=8)
+            ref = {}
+            rnd = random.Random(0)
+            try:
+                for _ in range(20000):
+                    key = str(rnd.randrange(200))
+                    if rnd.random() < 0.1 and key in ref:
+                        del cache[key]
+                        del ref[key]
+                        continue
+                    value = cache.get(key)
+                    if value is not None:
+                        self.assertEqual(value, ref[key])
+                        ref[key] = ref.pop(key)
+                    else:
+                        self.assertNotIn(key, ref)
+                        cache[key] = key.encode('utf-8')
+                        ref[key] = key.encode('utf-8')
+                        if len(ref) > 50:
+                            del ref[next(iter(ref))]
+                self.assertEqual(cache.items(), [(k.encode('utf-8'), v) for k, v in ref.items()])
+            finally:
+                cache.close()
+                cache.unlink()
+
+        def test_processes(self):
+            cache = SharedLRU.create(self.name + '_pool', 1000, key_size=16, value_size=16)
+            try:
+                with Pool(4) as pool:
+                    pool.starmap(_worker_fill, [(cache, 0, 500)] * 4)
+                stats = cache.stats()
+                self.assertEqual(stats.hits + stats.misses, 2000)
+                self.assertEqual(len(cache), 500)
+                self.assertEqual(cache['key-7'], b'49')
+            finally:
+                cache.close()
+                cache.unlink()
+
+    unittest.main(argv=sys.argv[:1])
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+"""
+=====================
+Suffix and LCP arrays
+=====================
+
+Ref: Manber & Myers, Suffix Arrays: A New Method for On-Line String
+Searches, 1993. Kasai et al., Linear-Time Longest-Common-Prefix
+Computation in Suffix Arrays and Its Applications, 2001
+
+The n-gram tables count substrings of a fixed length. The suffix array
+counts a substring of any length: it lists the starts of all the suffixes
+of the text in lexicographic order, so the occurrences of a substring are
+the starts of one contiguous block of it, found by two binary searches:
+
+    text: 林冲林冲教头
+
+    sa    suffix                        lcp
+    3     冲教头                        0
+    1     冲林冲教头                    1
+    5     头                            0
+    4     教头                          0
+    2     林冲教头                      0
+    0     林冲林冲教头                  2    <- count('林冲') = 2
+
+`count(s)` is O(m log n), m the length of s. lcp[i] is the length of the
+common prefix of the suffixes sa[i - 1] and sa[i], the longest repeated
+substring is at its maximum.
+
+Construction
+================
+
+The suffixes are sorted by prefix doubling with numpy. The characters are
+mapped to dense ids, and the first k characters of every suffix packed
+into one uint64 sort key, as many as fit. Each round then sorts the suffix
+i by the pair (rank of its first k characters, rank of the k characters at
+i + k), which orders it by its first 2k characters, until every suffix has
+a rank of its own. Suffixes already alone in their group keep their slot,
+a round only sorts the groups still tied. A text with long repeats needs
+log2(longest repeat) rounds.
+
+The LCP array comes from Kasai's algorithm in one pass over the text: the
+suffix i + 1 shares at least lcp(i) - 1 characters with its neighbour, so
+the comparisons add up to less than 2n.
+
+The arrays are int32, 8 bytes per character on top of the text. `save`
+writes the text as utf-8 and the arrays in one `.npz` file.
+
+Usage example
+================
+
+```
+# Run the unit tests
+$ python algorithm/suffix_array.py
+
+# Index the novels once, then count substrings of any length
+$ python algorithm/suffix_array.py ./data/chinese-novels --save novels.sa.npz
+$ python algorithm/suffix_array.py --index novels.sa.npz --count 林冲 豹子头林冲 --repeat
+```
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from corpus import load_corpus
+from ngram_count import encode, vocab_bits
+
+
+def suffix_array(text):
+    """
+    Sort the suffixes of `text` by prefix doubling
+
+    :param str text: The text
+    :return: int32 array of the suffix starts in lexicographic order
+    """
+    n = len(text)
+    if n == 0:
+        return np.zeros(0, dtype=np.int32)
+
+    # Dense ids from 1, 0 pads the keys past the end of the text
+    vocab, ids = np.unique(encode(text), return_inverse=True)
+    ids = ids.astype(np.uint64) + np.uint64(1)
+    bits = vocab_bits(vocab)
+    k = min(max(1, 63 // bits), n)
+    key = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        key <<= np.uint64(bits)
+        key[:n - j] |= ids[j:]
+
+    sa = np.argsort(key, kind='stable')
+    sorted_keys = key[sa]
+    del key, ids
+
+    # The rank of a suffix is the slot of the first suffix of its group
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    del sorted_keys
+    slots = np.arange(n)
+    rank = np.empty(n, dtype=np.int64)
+    rank[sa] = np.maximum.accumulate(np.where(new_group, slots, 0))
+    sizes = np.diff(np.append(np.flatnonzero(new_group), n))
+    # Slots of the groups still tied
+    active = slots[np.repeat(sizes > 1, sizes)]
+    del slots, new_group, sizes
+
+    while len(active):
+        suffixes = sa[active]
+        first = rank[suffixes]
+        second = np.full(len(suffixes), -1, dtype=np.int64)
+        inside = suffixes + k < n
+        second[inside] = rank[suffixes[inside] + k]
+        # The active slots are in order, so `first` is sorted already and
+        # the ties are broken by `second` within every group
+        order = np.argsort(first * (n + 1) + second + 1)
+        suffixes = suffixes[order]
+        first = first[order]
+        second = second[order]
+        sa[active] = suffixes
+
+        new_group = np.ones(len(suffixes), dtype=bool)
+        new_group[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+        rank[suffixes] = np.maximum.accumulate(np.where(new_group, active, 0))
+        group = np.cumsum(new_group) - 1
+        active = active[np.bincount(group)[group] > 1]
+        k *= 2
+
+    return sa.astype(np.int32)
+
+
+def lcp_array(text, sa):
+    """
+    Kasai's algorithm, lcp[i] is the length of the common prefix of the
+    suffixes sa[i - 1] and sa[i], lcp[0] = 0
+
+    :param str text: The text
+    :param sa: Its suffix array
+    :return: int32 array
+    """
+    n = len(text)
+    rank = np.empty(n, dtype=np.int64)
+    rank[sa] = np.arange(n)
+    sa = sa.tolist()
+    lcp = [0] * n
+    h = 0
+    for i, r in enumerate(rank.tolist()):
+        if r == 0:
+            h = 0
+            continue
+        j = sa[r - 1]
+        while i + h < n and j + h < n and text[i + h] == text[j + h]:
+            h += 1
+        lcp[r] = h
+        if h:
+            h -= 1
+    return np.array(lcp, dtype=np.int32)
+
+
+class SuffixArray(object):
+    """
+    Suffix array and LCP array of a text
+
+    :param str text: The text
+    :param sa: int32 array of the suffix starts in lexicographic order
+    :param lcp: int32 array of the common prefix lengths of neighbours
+    """
+    def __init__(self, text, sa, lcp):
+        self.text = text
+        self.sa = sa
+        self.lcp = lcp
+
+    @classmethod
+    def build(cls, text):
+        sa = suffix_array(text)
+        return cls(text, sa, lcp_array(text, sa))
+
+    @classmethod
+    def from_corpus(cls, path):
+        """
+        Index the cleaned text of a corpus, see `corpus.py`
+        """
+        return cls.build(load_corpus(path))
+
+    def __len__(self):
+        return len(self.text)
+
+    def range(self, s):
+        """
+        The slots [lo, hi) of the suffixes starting with `s`
+        """
+        text = self.text
+        sa = self.sa
+        m = len(s)
+
+        # First slot whose prefix is not below s
+        lo, hi = 0, len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = int(sa[mid])
+            if text[i:i + m] < s:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        # First slot whose prefix is above s
+        start, hi = lo, len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = int(sa[mid])
+            if text[i:i + m] <= s:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def count(self, s):
+        """
+        Number of occurrences of `s` in the text, overlapping ones included
+        """
+        if not s:
+            return len(self.text)
+        lo, hi = self.range(s)
+        return hi - lo
+
+    def locate(self, s, limit=None):
+        """
+        Sorted start positions of the occurrences of `s`
+
+        :param int limit: Only the first `limit` occurrences in suffix order
+        """
+        lo, hi = self.range(s)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return np.sort(self.sa[lo:hi])
+
+    def longest_repeat(self):
+        """
+        The longest substring occurring at least twice
+        """
+        if len(self.lcp) == 0:
+            return ''
+        i = int(np.argmax(self.lcp))
+        start = int(self.sa[i])
+        return self.text[start:start + int(self.lcp[i])]
+
+    def save(self, path):
+        np.savez(path, text=np.frombuffer(self.text.encode('utf-8'), dtype=np.uint8), sa=self.sa, lcp=self.lcp)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['text'].tobytes().decode('utf-8'), data['sa'], data['lcp'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', type=str, nargs='?', help='Corpus file path, run the unit tests when missing')
+    parser.add_argument('--index', type=str, help='Load the index saved to this file instead of building one')
+    parser.add_argument('--save', type=str, help='Save the index to this file')
+    parser.add_argument('--count', type=str, nargs='+', default=[], help='Substrings to count')
+    parser.add_argument('--repeat', action='store_true', help='Show the longest repeated substring')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.corpus or args.index:
+        start = time.time()
+        if args.index:
+            index = SuffixArray.load(args.index)
+        else:
+            text = load_corpus(args.corpus)
+            print('{} characters loaded in {:.1f}s'.format(len(text), time.time() - start))
+            start = time.time()
+            sa = suffix_array(text)
+            print('suffix array: {:.1f}s'.format(time.time() - start))
+            start = time.time()
+            index = SuffixArray(text, sa, lcp_array(text, sa))
+            print('lcp array: {:.1f}s'.format(time.time() - start))
+        if args.save:
+            index.save(args.save)
+
+        for s in args.count:
+            start = time.time()
+            print('{}: {} ({:.3f}ms)'.format(s, index.count(s), (time.time() - start) * 1000))
+        if args.repeat:
+            repeat = index.longest_repeat()
+            print('longest repeat: {} characters, {}'.format(len(repeat), repeat[:50]))
+        sys.exit(0)
+
+    import os
+    import random
+    import tempfile
+    import unittest
+
+    def brute_force_count(text, s):
+        return sum(text.startswith(s, i) for i in range(len(text)))
+
+    class Test(unittest.TestCase):
+        def check(self, text):
+            index = SuffixArray.build(text)
+            self.assertEqual(index.sa.tolist(), sorted(range(len(text)), key=lambda i: text[i:]))
+            starts = index.sa.tolist()
+            expected = [0] + [len(os.path.commonprefix([text[a:], text[b:]]))
+                              for a, b in zip(starts, starts[1:])]
+            self.assertEqual(index.lcp.tolist(), expected[:len(text)])
+            return index
+
+        def test_example(self):
+            index = self.check('林冲林冲教头')
+            self.assertEqual(index.sa.tolist(), [3, 1, 5, 4, 2, 0])
+            self.assertEqual(index.lcp.tolist(), [0, 1, 0, 0, 0, 2])
+            self.assertEqual(index.count('林冲'), 2)
+            self.assertEqual(index.count('林冲教'), 1)
+            self.assertEqual(index.count('教头林'), 0)
+            self.assertEqual(index.count(''), 6)
+            self.assertEqual(index.locate('冲').tolist(), [1, 3])
+            self.assertEqual(index.longest_repeat(), '林冲')
+
+        def test_edge_cases(self):
+            for text in ['', '林', 'aaaaaaaaaaaaaaaaaaaaa', 'abababababababa', 'banana']:
+                index = self.check(text)
+                self.assertEqual(index.count('a'), text.count('a'))
+            self.assertEqual(SuffixArray.build('aaaaa').count('aa'), 4)
+            self.assertEqual(SuffixArray.build('aaaaa').longest_repeat(), 'aaaa')
+
+        def test_random_texts(self):
+            rnd = random.Random(7)
+            for alphabet in ['ab', 'abcd', '林冲教头豹子', ''.join(map(chr, range(0x4e00, 0x4e00 + 3000)))]:
+                text = ''.join(rnd.choice(alphabet) for _ in range(500))
+                # Long repeats need several doubling rounds
+                text = text + text[100:400] + text
+                index = self.check(text)
+                for _ in range(50):
+                    i = rnd.randrange(len(text))
+                    s = text[i:i + rnd.randint(1, 8)]
+                    self.assertEqual(index.count(s), brute_force_count(text, s), s)
+                    self.assertEqual(index.locate(s).tolist(), [j for j in range(len(text)) if text.startswith(s, j)])
+                self.assertEqual(index.count('x'), 0)
+
+        def test_save_load(self):
+            index = SuffixArray.build('前天晚上吃晚饭的时候前天晚上')
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'index.npz')
+                index.save(path)
+                loaded = SuffixArray.load(path)
+            self.assertEqual(loaded.text, index.text)
+            self.assertEqual(loaded.sa.tolist(), index.sa.tolist())
+            self.assertEqual(loaded.lcp.tolist(), index.lcp.tolist())
+            self.assertEqual(loaded.count('前天晚上'), 2)
+
+    unittest.main(argv=sys.argv[:1])
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+"""
+======================================
+Two-tier LRU cache with disk spillover
+======================================
+
+Entries evicted from an in-memory LRU are simply lost, a restarted or
+memory squeezed process computes them again from scratch. Here the
+evicted entries are spilled into a second tier on the local disk, and
+moved back into memory when they are asked for again:
+
+              get/set
+                 |
+                 v
+    +-------------------------+   evict    +-------------------------+
+    | L1: PtHashLinkedList    | ---------> | L2: sqlite file         |
+    | `size` entries          | <--------- | `disk_bytes` budget     |
+    +-------------------------+  promote   +-------------------------+
+                                                |
+                                                v
+                                      oldest spills dropped
+
+The tiers are exclusive, an entry lives either in memory or on disk. The
+disk tier keeps the pickled (key, value) rows in spill order and drops the
+oldest spills once their total size goes past `disk_bytes`. Deleted rows
+leave free pages behind, the database runs with incremental auto vacuum
+so `compact()` gives them back to the file system, which happens by
+itself when a quarter of the pages are free.
+
+`close()` spills the whole memory tier, so the next process opening the
+same file starts warm.
+
+Keys are stored pickled, so they must pickle to the same bytes whenever
+they are equal, which holds for str, int, bytes and tuples of them.
+
+Usage example
+================
+
+```
+cache = TieredLRU(10000, '/tmp/tokens.cache.db', disk_bytes=1 << 30)
+tokens = cache.get(doc_id)
+if tokens is None:
+    tokens = cut(content)
+    cache[doc_id] = tokens
+...
+cache.close()
+```
+"""
+
+import sys
+import pickle
+import sqlite3
+from collections import namedtuple
+
+from lru import PtHashLinkedList
+
+
+TieredStats = namedtuple('TieredStats', ['hits', 'disk_hits', 'misses', 'spills', 'disk_evictions'])
+
+_MISSING = object()
+
+# DELETE ... RETURNING needs sqlite 3.35
+RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+
+
+class DiskStore(object):
+    """
+    Size capped sqlite store of pickled entries, oldest writes go first
+
+    :param str path: The database file
+    :param int max_bytes: Budget for the pickled keys and values
+    """
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path)
+        # Has to be set before the first table is created
+        self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key BLOB PRIMARY KEY, value BLOB NOT NULL, '
+            'size INTEGER NOT NULL, seq INTEGER NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_seq ON entries (seq)')
+
+        total, seq = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0), COALESCE(MAX(seq), 0) FROM entries').fetchone()
+        self.bytes = total
+        self.seq = seq
+        self.evictions = 0
+
+    @staticmethod
+    def _key(key):
+        return pickle.dumps(key, protocol=4)
+
+    def put(self, key, value):
+        blob_key = self._key(key)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(blob_key) + len(blob)
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+
+        self.seq += 1
+        with self.conn:
+            row = self.conn.execute('SELECT size FROM entries WHERE key = ?', (blob_key,)).fetchone()
+            if row is not None:
+                self.bytes -= row[0]
+            self.conn.execute(
+                'INSERT OR REPLACE INTO entries (key, value, size, seq) VALUES (?, ?, ?, ?)',
+                (blob_key, blob, size, self.seq))
+        self.bytes += size
+        if self.bytes > self.max_bytes:
+            self._trim()
+
+    def pop(self, key, default=None):
+        """
+        Remove `key` and return its value
+        """
+        blob_key = self._key(key)
+        with self.conn:
+            row = self.conn.execute(
+                'SELECT value, size FROM entries WHERE key = ?', (blob_key,)).fetchone()
+            if row is None:
+                return default
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (blob_key,))
+        self.bytes -= row[1]
+        return pickle.loads(row[0])
+
+    def delete(self, key):
+        """
+        Remove `key` without reading its value back
+        """
+        if not self.bytes:
+            return
+        blob_key = self._key(key)
+        with self.conn:
+            if RETURNING:
+                rows = self.conn.execute(
+                    'DELETE FROM entries WHERE key = ? RETURNING size', (blob_key,)).fetchall()
+            else:
+                rows = self.conn.execute('SELECT size FROM entries WHERE key = ?', (blob_key,)).fetchall()
+                if rows:
+                    self.conn.execute('DELETE FROM entries WHERE key = ?', (blob_key,))
+        for size, in rows:
+            self.bytes -= size
+
+    def _trim(self, batch=64):
+        while self.bytes > self.max_bytes:
+            with self.conn:
+                rows = self.conn.execute(
+                    'SELECT key, size FROM entries ORDER BY seq LIMIT ?', (batch,)).fetchall()
+                for blob_key, size in rows:
+                    self.conn.execute('DELETE FROM entries WHERE key = ?', (blob_key,))
+                    self.bytes -= size
+                    self.evictions += 1
+                    if self.bytes <= self.max_bytes:
+                        break
+        self._maybe_compact()
+
+    def _maybe_compact(self, ratio=0.25):
+        free = self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+        pages = self.conn.execute('PRAGMA page_count').fetchone()[0]
+        if free > pages * ratio:
+            self.compact()
+
+    def compact(self, full=False):
+        """
+        Give the free pages back to the file system, `full` rebuilds the
+        whole file which also defragments it
+        """
+        if full:
+            self.conn.execute('VACUUM')
+        else:
+            self.conn.execute('PRAGMA incremental_vacuum')
+
+    def __contains__(self, key):
+        row = self.conn.execute('SELECT 1 FROM entries WHERE key = ?', (self._key(key),)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class TieredLRU(object):
+    """
+    In-memory LRU spilling its evicted entries into a `DiskStore`
+
+    :param int size: Number of entries kept in memory
+    :param str path: The database file of the disk tier
+    :param int disk_bytes: Budget of the disk tier in bytes
+    """
+    def __init__(self, size, path, disk_bytes=1 << 30):
+        self.size = size
+        self.memory = PtHashLinkedList(size)
+        self.disk = DiskStore(path, disk_bytes)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.spills = 0
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        value = self.disk.pop(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+
+        self.disk_hits += 1
+        self._put_memory(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.memory:
+            # A stale copy on disk would come back after a restart
+            self.disk.delete(key)
+        self._put_memory(key, value)
+
+    def _put_memory(self, key, value):
+        if key not in self.memory and len(self.memory) >= self.size:
+            evicted_key, evicted_value = self.memory.popitem()
+            self.disk.put(evicted_key, evicted_value)
+            self.spills += 1
+        self.memory[key] = value
+
+    def __delitem__(self, key):
+        if key in self.memory:
+            del self.memory[key]
+        elif key in self.disk:
+            self.disk.delete(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.memory or key in self.disk
+
+    def stats(self):
+        return TieredStats(self.hits, self.disk_hits, self.misses, self.spills, self.disk.evictions)
+
+    def flush(self):
+        """
+        Spill every entry of the memory tier to disk, oldest first
+        """
+        for key, value in self.memory.items():
+            self.disk.put(key, value)
+        self.memory = PtHashLinkedList(self.size)
+
+    def close(self):
+        self.flush()
+        self.disk.close()
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import unittest
+
+    class Unpicklable(object):
+        def __reduce__(self):
+            return (Unpicklable.fail, ())
+
+        @staticmethod
+        def fail():
+            raise AssertionError('unpickled')
+
+    class Test(unittest.TestCase):
+        def setUp(self):
+            self.tmpdir = tempfile.TemporaryDirectory()
+            self.path = os.path.join(self.tmpdir.name, 'cache.db')
+            self.cache = TieredLRU(2, self.path)
+
+        def tearDown(self):
+            self.cache.disk.close()
+            self.tmpdir.cleanup()
+
+        def test_spill_and_promote(self):
+            self.cache['aa'] = [1, 2]
+            self.cache['bb'] = 2
+            self.cache['cc'] = 3
+            self.assertNotIn('aa', self.cache.memory)
+            self.assertIn('aa', self.cache.disk)
+
+            self.assertEqual(self.cache['aa'], [1, 2])
+            self.assertIn('aa', self.cache.memory)
+            self.assertNotIn('aa', self.cache.disk)
+            self.assertIn('bb', self.cache.disk)
+            self.assertIsNone(self.cache['dd'])
+            self.assertEqual(self.cache.stats(), TieredStats(0, 1, 1, 2, 0))
+
+        def test_set_drops_stale_copy(self):
+            self.cache['aa'] = 1
+            self.cache['bb'] = 2
+            self.cache['cc'] = 3
+            self.cache['aa'] = 4
+            self.assertNotIn('aa', self.cache.disk)
+            self.assertEqual(self.cache['aa'], 4)
+
+        def test_delete(self):
+            for key in ['aa', 'bb', 'cc']:
+                self.cache[key] = key
+            del self.cache['aa']
+            del self.cache['cc']
+            self.assertNotIn('aa', self.cache)
+            self.assertNotIn('cc', self.cache)
+            with self.assertRaises(KeyError):
+                del self.cache['aa']
+
+        def test_store_delete(self):
+            store = DiskStore(os.path.join(self.tmpdir.name, 'store.db'), 10000)
+            store.put('aa', Unpicklable())
+            store.put('bb', 'x' * 100)
+            # Never unpickled on the way out
+            store.delete('aa')
+            store.delete('cc')
+            self.assertNotIn('aa', store)
+            self.assertEqual(len(store), 1)
+            self.assertEqual(store.bytes, store.conn.execute('SELECT SUM(size) FROM entries').fetchone()[0])
+            store.delete('bb')
+            self.assertEqual(store.bytes, 0)
+            store.close()
+
+        def test_disk_budget(self):
+            store = DiskStore(os.path.join(self.tmpdir.name, 'store.db'), 10000)
+            for i in range(100):
+                store.put(i, 'x' * 500)
+            self.assertLessEqual(store.bytes, 10000)
+            self.assertGreater(store.evictions, 0)
+            self.assertNotIn(0, store)
+            self.assertEqual(store.pop(99), 'x' * 500)
+            store.compact(full=True)
+            store.close()
+
+        def test_restart(self):
+            for i in range(10):
+                self.cache[i] = i * i
+            self.cache.close()
+
+            cache = TieredLRU(2, self.path)
+            self.assertEqual(cache.get(3), 9)
+            self.assertEqual(cache.stats().disk_hits, 1)
+            self.assertEqual(cache.disk.bytes, sum(
+                len(DiskStore._key(i)) + len(pickle.dumps(i * i, protocol=pickle.HIGHEST_PROTOCOL))
+                for i in range(10) if i != 3))
+            self.cache = cache
+
+    unittest.main(argv=sys.argv[:1])
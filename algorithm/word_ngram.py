@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+"""
+=======================
+Word level n-gram model
+=======================
+
+`ngram_model.py` models characters. Production text is scored as words,
+the jieba tokens `text_tokenize.cut` gives, so the model here is the same
+Kneser-Ney model over word ids.
+
+Every token is interned once, the ids going in order of first appearance,
+and the corpus is kept as an int32 array of ids. The n-grams are counted
+over it as packed integer keys, the way characters are:
+
+    tokens    前天   晚上   吃    晚饭   前天   晚上
+    ids       1      2      3     4      1      2        int32
+    2-grams   1|2    2|3    3|4   4|1    1|2             uint64 keys
+
+A `Counter` of tuples of strings costs a tuple, a dict entry and an int
+per distinct n-gram, about 120 bytes for a trigram, the sorted arrays 16
+bytes, the key and its count. The tokens themselves are stored once, in
+the vocabulary.
+
+An id takes `vocab_bits` bits, so the order is at most 64 // bits, 3 for
+a vocabulary of 100k words.
+
+Pre-tokenized input is a sequence of tokens. A text goes through the
+`tokenizer` callback of the model, jieba by default:
+
+    model = WordNgramModel.from_texts(iter_text(path), order=3)
+    model.sentence_logprob('前天晚上吃晚饭')
+    model.sentence_logprob(['前天', '晚上', '吃', '晚饭'])
+
+Usage example
+================
+
+```
+# Run the unit tests
+$ python algorithm/word_ngram.py
+
+# Score the sample sentences with a word trigram model of the novels
+$ python algorithm/word_ngram.py ./data/chinese-novels --order 3
+
+# Memory of the n-gram tables against a Counter of tuples of strings
+$ python algorithm/word_ngram.py ./data/chinese-novels --benchmark
+```
+"""
+
+import sys
+import time
+import argparse
+import tracemalloc
+from collections import Counter
+from itertools import chain
+
+import numpy as np
+
+from corpus import iter_text
+from ngram_count import NgramCounts, pack, reduce_counts, vocab_bits
+from ngram_model import NgramModel
+
+
+def jieba_cut(text):
+    """
+    The jieba tokens of `text`, jieba is only imported when used
+    """
+    import jieba
+    return jieba.lcut(text)
+
+
+def intern(tokens, index):
+    """
+    Ids of the tokens, new tokens get the next ids
+
+    :param tokens: Iterable of tokens
+    :param dict index: Token to id from 1, updated in place
+    :return: int32 array of ids
+    """
+    setdefault = index.setdefault
+    return np.fromiter((setdefault(token, len(index) + 1) for token in tokens), dtype=np.int32)
+
+
+class WordNgramModel(NgramModel):
+    """
+    Interpolated Kneser-Ney word n-gram model, see `NgramModel`
+
+    :param vocab: List of the tokens, the id of a token is its 1-based
+                  index and 0 is the unknown token
+    :param tokenizer: Callback splitting a text into a list of tokens
+    """
+    kind = 'words'
+
+    def __init__(self, vocab, keys, logprobs=None, logbows=None, discounts=None, counts=None, tail=(),
+                 tokenizer=jieba_cut):
+        self.index = {}
+        self.tokenizer = tokenizer
+        super().__init__(vocab, keys, logprobs, logbows, discounts, counts, list(tail))
+
+    @classmethod
+    def from_tokens(cls, tokens, order=3, tokenizer=jieba_cut):
+        """
+        Build the model of a corpus of tokens
+
+        :param tokens: Iterable of tokens
+        :param int order: Order of the model
+        :param tokenizer: Callback the model splits texts with
+        """
+        index = {}
+        ids = intern(tokens, index)
+        vocab = list(index)
+        bits = vocab_bits(vocab)
+        if order * bits > 64:
+            raise ValueError('{} words of {} bits do not fit in 64 bits'.format(order, bits))
+        counts = {n: NgramCounts(*reduce_counts(pack(ids, n, bits)), n) for n in range(1, order + 1)}
+        tail = [vocab[i - 1] for i in ids[max(0, len(ids) - order + 1):]]
+        model = cls.from_counts(counts, vocab, tail)
+        model.tokenizer = tokenizer
+        return model
+
+    @classmethod
+    def from_texts(cls, texts, order=3, tokenizer=jieba_cut):
+        """
+        Build the model of texts split by `tokenizer`, the texts of
+        `corpus.iter_text` for example
+        """
+        return cls.from_tokens(chain.from_iterable(tokenizer(text) for text in texts), order, tokenizer)
+
+    @classmethod
+    def build(cls, path, order=3, tokenizer=jieba_cut):
+        return cls.from_texts(iter_text(path), order, tokenizer)
+
+    @classmethod
+    def load(cls, path, tokenizer=jieba_cut):
+        model = super().load(path)
+        model.tokenizer = tokenizer
+        return model
+
+    def _set_vocab(self, vocab):
+        self.vocab = vocab
+        self.bits = vocab_bits(vocab)
+        for token in vocab[len(self.index):]:
+            self.index[token] = len(self.index) + 1
+
+    def _extend_vocab(self, tokens):
+        # New tokens go after the old ones, the ids do not change
+        vocab = list(self.vocab)
+        known = set(self.index)
+        for token in tokens:
+            if token not in known:
+                known.add(token)
+                vocab.append(token)
+        return vocab, np.arange(len(self.vocab) + 1, dtype=np.uint64)
+
+    def _split(self, text):
+        if isinstance(text, str):
+            if self.tokenizer is None:
+                raise ValueError('The model has no tokenizer, give it a list of tokens')
+            return list(self.tokenizer(text))
+        return list(text)
+
+    def _join(self, symbols):
+        return list(symbols)
+
+    def _symbols(self):
+        return ['<unk>'] + list(self.vocab)
+
+    def ids(self, text):
+        """
+        Token ids of a text or a list of tokens, 0 for the unknown tokens
+        """
+        get = self.index.get
+        return np.array([get(token, 0) for token in self._split(text)], dtype=np.int64)
+
+    def logprob(self, word, context=()):
+        """
+        ln p(word | context), `word` being a token and `context` a text or
+        a list of tokens, only its last order - 1 tokens matter
+        """
+        context = self._split(context)
+        context = context[max(0, len(context) - self.order + 1):]
+        return self._logprob(self.ids(context + [word]))
+
+    def _join_ids(self, sentences):
+        sentences = [self._split(sentence) for sentence in sentences]
+        lengths = np.array([len(tokens) for tokens in sentences], dtype=np.int64)
+        return self.ids(list(chain.from_iterable(sentences))), lengths
+
+    def _vocab_array(self):
+        # Tokens separated by '\0'
+        return np.frombuffer('\0'.join(self.vocab).encode('utf-8'), dtype=np.uint8)
+
+    @staticmethod
+    def _vocab_from_array(array):
+        return array.tobytes().decode('utf-8').split('\0')
+
+
+def benchmark(tokens, order=3):
+    """
+    Memory of the n-gram tables of every order, as a `Counter` of tuples
+    of strings and as packed keys
+    """
+    tokens = list(tokens)
+    print('{} tokens'.format(len(tokens)))
+    for n in range(1, order + 1):
+        columns = [tokens[i:] for i in range(n)]
+        tracemalloc.start()
+        start = time.perf_counter()
+        counter = Counter(zip(*columns))
+        elapsed = time.perf_counter() - start
+        counter_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        distinct = len(counter)
+        del counter, columns
+
+        start = time.perf_counter()
+        index = {}
+        ids = intern(tokens, index)
+        keys, counts = reduce_counts(pack(ids, n, vocab_bits(index)))
+        packed_elapsed = time.perf_counter() - start
+        print('n={}: {} n-grams, Counter {:.1f}MB in {:.2f}s, packed {:.1f}MB (+ ids {:.1f}MB) in {:.2f}s'.format(
+            n, distinct, counter_bytes / 1e6, elapsed, (keys.nbytes + counts.nbytes) / 1e6, ids.nbytes / 1e6,
+            packed_elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', type=str, nargs='?', help='Corpus file path, run the unit tests when missing')
+    parser.add_argument('--order', type=int, default=3, help='Order of the model')
+    parser.add_argument('--tokenizer', choices=['jieba', 'chars'], default='jieba',
+                        help='Split the corpus into jieba tokens or into characters')
+    parser.add_argument('--benchmark', action='store_true', help='Compare the memory of the n-gram tables')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.corpus:
+        tokenizer = jieba_cut if args.tokenizer == 'jieba' else list
+        if args.benchmark:
+            benchmark(chain.from_iterable(tokenizer(text) for text in iter_text(args.corpus)), args.order)
+            sys.exit(0)
+
+        start = time.perf_counter()
+        model = WordNgramModel.build(args.corpus, args.order, tokenizer)
+        print('Built in {:.1f}s, {} words'.format(time.perf_counter() - start, len(model.vocab)))
+        sentences = ['前天晚上吃晚饭的时候', '前天晚上吃早饭的时候', '我无言以对简直', '我简直无言以对']
+        scores = model.score_batch(sentences)
+        for i, sentence in enumerate(sentences):
+            print('{} with log probability: {:.4f}, perplexity: {:.2f}'.format(
+                sentence, scores.logprobs[i], scores.perplexities[i]))
+        sys.exit(0)
+
+    import os
+    import math
+    import tempfile
+    import unittest
+
+    class Test(unittest.TestCase):
+        text = '前天晚上吃晚饭的时候我们前天晚上吃早饭的时候他们吃晚饭的时候前天'
+        tokens = ['前天', '晚上', '吃', '晚饭', '的', '时候', '我们', '前天', '晚上', '吃', '早饭', '的', '时候',
+                  '他们', '吃', '晚饭', '的', '时候', '前天']
+
+        def test_intern(self):
+            index = {}
+            ids = intern(['a', 'b', 'a', 'c'], index)
+            self.assertEqual(ids.dtype, np.int32)
+            self.assertEqual(ids.tolist(), [1, 2, 1, 3])
+            self.assertEqual(intern(['c', 'd'], index).tolist(), [3, 4])
+            self.assertEqual(index, {'a': 1, 'b': 2, 'c': 3, 'd': 4})
+
+        def test_same_as_characters(self):
+            # Characters as tokens give the character model
+            for order in (1, 2, 3):
+                words = WordNgramModel.from_tokens(self.text, order, tokenizer=list)
+                chars = NgramModel.from_text(self.text, order)
+                self.assertEqual(sorted(words.vocab), [chr(c) for c in chars.vocab])
+                self.assertEqual(words.discounts, chars.discounts)
+                for context, word in [('吃晚', '饭'), ('前', '天'), ('x', '天'), ('吃', 'x')]:
+                    self.assertAlmostEqual(words.logprob(word, context), chars.logprob(word, context))
+                sentences = ['前天晚上吃早饭', '晚饭前天', 'x他们']
+                self.assertTrue(np.allclose(words.score_batch(sentences).logprobs, chars.score_batch(sentences).logprobs))
+
+        def test_tokens(self):
+            model = WordNgramModel.from_tokens(self.tokens, 3, tokenizer=None)
+            self.assertEqual(model.vocab[:3], ['前天', '晚上', '吃'])
+            self.assertEqual(model.tail, ['时候', '前天'])
+            self.assertGreater(model.logprob('晚饭', ['的', '吃']), model.logprob('早饭', ['的', '吃']))
+            self.assertEqual(model.ids(['前天', '火锅']).tolist(), [1, 0])
+            total = sum(math.exp(model.logprob(token, ['晚上'])) for token in model.vocab + ['火锅'])
+            self.assertAlmostEqual(total, 1.0)
+            self.assertLess(model.perplexity(['前天', '晚上', '吃', '晚饭']), model.perplexity(['晚饭', '吃', '前天', '晚上']))
+            with self.assertRaises(ValueError):
+                model.sentence_logprob('前天晚上')
+
+            texts = model.generate(3, 5, seed=0)
+            self.assertTrue(all(len(text) == 5 and set(text) <= set(self.tokens) for text in texts))
+
+        def test_tokenizer(self):
+            def cut(text):
+                return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+            model = WordNgramModel.from_texts([self.text[:10], self.text[10:]], 2, tokenizer=cut)
+            self.assertEqual(model.vocab[:2], ['前天', '晚上'])
+            self.assertAlmostEqual(model.sentence_logprob('前天晚上'), model.sentence_logprob(['前天', '晚上']))
+            scores = model.score_batch(['前天晚上', ['吃晚', '饭的']])
+            self.assertAlmostEqual(scores.logprobs[1], model.sentence_logprob(['吃晚', '饭的']))
+
+        def test_update(self):
+            new = ['火锅', '的', '时候', '前天', '晚上', '吃', '火锅']
+            for order in (1, 2, 3):
+                expected = WordNgramModel.from_tokens(self.tokens + new, order)
+                model = WordNgramModel.from_tokens(self.tokens, order).update(new[:2]).update(new[2:])
+                self.assertEqual(model.vocab, expected.vocab)
+                self.assertEqual(model.tail, expected.tail)
+                for n in range(order):
+                    self.assertTrue(np.array_equal(model.keys[n], expected.keys[n]))
+                    self.assertTrue(np.allclose(model.logprobs[n], expected.logprobs[n]))
+
+        def test_save_load(self):
+            model = WordNgramModel.from_tokens(self.tokens, 3)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'model')
+                model.save(path)
+                loaded = WordNgramModel.load(path, tokenizer=None)
+                with self.assertRaises(ValueError):
+                    NgramModel.load(path)
+                self.assertEqual(loaded.vocab, model.vocab)
+                self.assertEqual(loaded.tail, model.tail)
+                self.assertAlmostEqual(loaded.logprob('晚饭', ['的', '吃']), model.logprob('晚饭', ['的', '吃']), places=5)
+                loaded.update(['火锅'])
+                self.assertEqual(loaded.ids(['火锅']).tolist(), [len(model.vocab) + 1])
+
+    unittest.main(argv=sys.argv[:1])